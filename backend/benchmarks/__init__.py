@@ -0,0 +1,6 @@
+"""Benchmarks of the trivia API
+
+Run them from the backend folder, e.g `python -m benchmarks.serialization`.
+They point the app at a throwaway SQLite database unless
+SQLALCHEMY_DATABASE_URI is set.
+"""
@@ -0,0 +1,96 @@
+"""Compare JSON encoders and response compression: CPU time per response
+against the bytes sent, for a page of questions and a whole category
+"""
+import argparse
+import gzip
+import json
+from time import perf_counter
+
+from benchmarks.seed import seed_app, use_benchmark_database
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    use_benchmark_database()
+
+    from flaskr import create_app
+    from models import format_question_row, question_rows, Question
+
+    app = create_app()
+    seed_app(app, args.questions, args.categories)
+
+    with app.app_context():
+        payloads = {
+            "page of 10": [
+                format_question_row(row)
+                for row in question_rows().order_by(Question.id).limit(10)
+            ],
+            "category": [
+                format_question_row(row)
+                for row in question_rows().filter(Question.category == 1)
+            ],
+        }
+
+    encoders = {
+        "json": lambda value: json.dumps(
+            value, sort_keys=True, separators=(",", ":")
+        ).encode(),
+    }
+    if orjson is not None:
+        encoders["orjson"] = lambda value: orjson.dumps(
+            value, option=orjson.OPT_SORT_KEYS
+        )
+
+    compressors = {"identity": lambda body: body}
+    for level in (1, 6, 9):
+        compressors[f"gzip {level}"] = (
+            lambda body, level=level: gzip.compress(body, compresslevel=level, mtime=0)
+        )
+    if brotli is not None:
+        for quality in (1, 4, 11):
+            compressors[f"br {quality}"] = (
+                lambda body, quality=quality: brotli.compress(body, quality=quality)
+            )
+
+    for name, payload in payloads.items():
+        print(f"\n{name}: {len(payload)} questions, best of {args.repeat}")
+        for encoder_name, encoder in encoders.items():
+            seconds = best_time(lambda: encoder({"questions": payload}), args.repeat)
+            print(f"  {encoder_name:>10} encode  {seconds * 1000:8.3f} ms")
+
+        body = list(encoders.values())[-1]({"questions": payload})
+        for compressor_name, compressor in compressors.items():
+            seconds = best_time(lambda: compressor(body), args.repeat)
+            size = len(compressor(body))
+            print(
+                f"  {compressor_name:>10} {seconds * 1000:8.3f} ms"
+                f"  {size / 1024:9.1f} KiB  ({size / len(body):6.1%})"
+            )
+
+
+if __name__ == "__main__":
+    main()
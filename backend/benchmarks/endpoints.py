@@ -0,0 +1,389 @@
+"""Load test of every endpoint of question.py and category.py
+
+Seeds a synthetic question bank, drives the app with a mix of requests
+from a thread pool and reports throughput, p50/p95/p99 latency and SQL
+queries per request for each scenario. `--save` writes the results,
+`--baseline` compares a run with saved results and exits with status 1
+when a scenario got slower than the threshold allows.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from time import perf_counter
+
+from benchmarks.seed import seed_app, use_benchmark_database, WORDS
+
+# weight of each scenario in the mixes
+MIXES = {
+    "browse": {
+        "list_questions": 40,
+        "list_questions_cursor": 20,
+        "categories": 20,
+        "category_questions": 20,
+    },
+    "quiz": {
+        "quiz": 45,
+        "quiz_adaptive": 10,
+        "quiz_batch": 5,
+        "quiz_session_next": 25,
+        "quiz_session_start": 5,
+        "quiz_session_end": 5,
+        "categories": 15,
+    },
+    "search": {
+        "search": 50,
+        "search_answers": 15,
+        "suggest": 15,
+        "list_questions": 10,
+        "categories": 10,
+    },
+    "admin": {
+        "create_question": 40,
+        "delete_question": 30,
+        "bulk_import": 5,
+        "export": 5,
+        "create_category": 3,
+        "update_category": 4,
+        "delete_category": 3,
+        "list_questions": 20,
+    },
+}
+MIXES["mixed"] = {
+    scenario: weight
+    for mix in MIXES.values()
+    for scenario, weight in mix.items()
+}
+
+# the local SQL statement counter of the thread serving a request
+_queries = threading.local()
+
+
+def count_queries(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def count(*args):
+        _queries.count = getattr(_queries, "count", 0) + 1
+
+
+class Scenarios:
+    """Builds the requests of each scenario: (method, url, body, ok statuses)"""
+
+    def __init__(self, total_questions, total_categories, seed,
+                 spare_categories=0):
+        self.random = Random(seed)
+        self.lock = threading.RLock()
+        self.total_questions = total_questions
+        self.total_categories = total_categories
+        self.deletable = list(range(total_questions, 0, -1))
+        # only the spare categories, without questions, are deleted
+        self.deletable_categories = list(range(
+            total_categories + 1,
+            total_categories + spare_categories + 1
+        ))
+        self.sessions = []
+
+    def _words(self, count):
+        return " ".join(self.random.choices(WORDS, k=count))
+
+    def list_questions(self):
+        page = self.random.randint(1, max(1, self.total_questions // 10))
+        return "GET", f"/api/questions?page={page}", None, (200, 404)
+
+    def list_questions_cursor(self):
+        from flaskr.pagination import encode_cursor
+
+        cursor = encode_cursor(self.random.randint(0, self.total_questions))
+        return "GET", f"/api/questions?after={cursor}&limit=10", None, (200,)
+
+    def categories(self):
+        return "GET", "/api/categories", None, (200,)
+
+    def category_questions(self):
+        category_id = self.random.randint(1, self.total_categories)
+        return "GET", f"/api/categories/{category_id}/questions?page=1", None, (200, 404)
+
+    def search(self):
+        body = {"searchTerm": self._words(2), "page": 1}
+        return "POST", "/api/questions", body, (200,)
+
+    def search_answers(self):
+        body = {"searchTerm": self._words(1), "searchAnswers": True, "page": 1}
+        return "POST", "/api/questions", body, (200,)
+
+    def suggest(self):
+        word = self.random.choice(WORDS)
+        prefix = word[:self.random.randint(1, len(word))]
+        return "GET", f"/api/questions/suggest?prefix={prefix}", None, (200,)
+
+    def quiz(self):
+        category_id = self.random.randint(0, self.total_categories)
+        body = {
+            "previous_questions": [
+                self.random.randint(1, self.total_questions) for _ in range(5)
+            ],
+            "quiz_category": {
+                "id": category_id,
+                "type": "ALL" if category_id == 0 else f"Category {category_id}"
+            }
+        }
+        return "POST", "/api/quizzes", body, (200, 404)
+
+    def quiz_adaptive(self):
+        method, url, body, ok = self.quiz()
+        body["strategy"] = "adaptive"
+        body["answers"] = [self.random.random() < 0.6 for _ in body["previous_questions"]]
+        return method, url, body, ok
+
+    def quiz_batch(self):
+        method, url, body, ok = self.quiz()
+        body["count"] = 10
+        return method, f"{url}/batch", body, ok
+
+    def quiz_session_next(self):
+        session_id = self.random.choice(self.sessions)
+        return "POST", f"/api/quizzes/sessions/{session_id}/next", None, (200, 404)
+
+    def quiz_session_start(self):
+        method, url, body, ok = self.quiz()
+        del body["previous_questions"]
+        return method, f"{url}/sessions", body, (200,)
+
+    def quiz_session_end(self):
+        from flaskr.quiz import quiz_sessions
+
+        # a session of its own, the sessions of quiz_session_next stay open
+        session_id, _ = quiz_sessions.start()
+        return "DELETE", f"/api/quizzes/sessions/{session_id}", None, (200,)
+
+    def create_question(self):
+        body = {
+            "question": self._words(8) + "?",
+            "answer": self._words(2),
+            "category": self.random.randint(1, self.total_categories),
+            "difficulty": self.random.randint(1, 5)
+        }
+        return "POST", "/api/questions", body, (200,)
+
+    def delete_question(self):
+        with self.lock:
+            question_id = self.deletable.pop() if self.deletable else 0
+        return "DELETE", f"/api/questions/{question_id}", None, (200, 404)
+
+    def bulk_import(self):
+        lines = "".join(
+            json.dumps({
+                "question": self._words(8) + "?",
+                "answer": self._words(2),
+                "category": self.random.randint(1, self.total_categories),
+                "difficulty": self.random.randint(1, 5)
+            }) + "\n"
+            for _ in range(100)
+        )
+        return "POST", "/api/questions/bulk", lines, (200,)
+
+    def export(self):
+        category_id = self.random.randint(1, self.total_categories)
+        return "GET", f"/api/questions/export?category={category_id}", None, (200,)
+
+    def create_category(self):
+        body = {"category": f"Category {self.random.randint(1, self.total_categories)}"}
+        # the endpoint looks the category up and answers 400 to every request
+        return "POST", "/api/categories", body, (200, 400)
+
+    def update_category(self):
+        category_id = self.random.randint(1, self.total_categories)
+        # same type, the quiz scenarios keep finding their categories
+        body = {"type": f"Category {category_id}"}
+        return "PUT", f"/api/categories/{category_id}", body, (200,)
+
+    def delete_category(self):
+        with self.lock:
+            category_id = (
+                self.deletable_categories.pop() if self.deletable_categories else 0
+            )
+        # an unknown category is a 400
+        return "DELETE", f"/api/categories/{category_id}", None, (200, 400)
+
+    def pick(self, mix):
+        with self.lock:
+            name, = self.random.choices(list(mix), weights=list(mix.values()))
+            return name, getattr(self, name)()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(app, scenarios, mix, total_requests, threads):
+    """Serve total_requests of the mix, returns the stats per scenario"""
+    client = app.test_client()
+    samples = {}
+
+    def call(_):
+        name, (method, url, body, ok) = scenarios.pick(mix)
+        if isinstance(body, dict):
+            body = json.dumps(body)
+
+        _queries.count = 0
+        start = perf_counter()
+        response = client.open(url, method=method, data=body)
+        response.get_data()
+        seconds = perf_counter() - start
+
+        return name, seconds, _queries.count, response.status_code in ok
+
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for name, seconds, queries, ok in executor.map(call, range(total_requests)):
+            samples.setdefault(name, []).append((seconds, queries, ok))
+    elapsed = perf_counter() - start
+
+    results = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, _, _ in values)
+        results[name] = {
+            "requests": len(values),
+            "errors": sum(not ok for _, _, ok in values),
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "queries": sum(queries for _, queries, _ in values) / len(values),
+        }
+    results["total"] = {
+        "requests": total_requests,
+        "errors": sum(result["errors"] for result in results.values()),
+        "requests_per_second": total_requests / elapsed,
+    }
+    return results
+
+
+def report(mix_name, results):
+    total = results["total"]
+    print(
+        f"\n{mix_name}: {total['requests_per_second']:.0f} req/s,"
+        f" {total['errors']} errors"
+    )
+    print(
+        f"  {'scenario':<22}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'queries':>9}"
+    )
+    for name, result in results.items():
+        if name == "total":
+            continue
+        print(
+            f"  {name:<22}{result['requests']:>9}{result['p50_ms']:>9.2f}"
+            f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+            f"{result['queries']:>9.1f}"
+        )
+
+
+def regressions(results, baseline, threshold):
+    """Scenarios whose p95 latency or throughput got worse than the
+    baseline by more than threshold (a fraction)"""
+    found = []
+    for mix_name, mix_results in results.items():
+        for name, result in mix_results.items():
+            reference = baseline.get(mix_name, {}).get(name)
+            if reference is None:
+                continue
+            if name == "total":
+                if result["requests_per_second"] < reference["requests_per_second"] * (1 - threshold):
+                    found.append(
+                        f"{mix_name}: {result['requests_per_second']:.0f} req/s,"
+                        f" baseline {reference['requests_per_second']:.0f}"
+                    )
+            elif result["p95_ms"] > reference["p95_ms"] * (1 + threshold):
+                found.append(
+                    f"{mix_name}/{name}: p95 {result['p95_ms']:.2f} ms,"
+                    f" baseline {reference['p95_ms']:.2f} ms"
+                )
+            # an extra query on more than one request in ten
+            if name != "total" and result["queries"] > reference["queries"] * (1 + threshold) + 0.1:
+                found.append(
+                    f"{mix_name}/{name}: {result['queries']:.1f} queries per"
+                    f" request, baseline {reference['queries']:.1f}"
+                )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="requests per mix")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--mix", choices=sorted(MIXES), action="append",
+                        help="mixes to run, every mix by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown against the baseline, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    use_benchmark_database()
+    # every request of the admin mix would be logged
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+
+    from flaskr import create_app
+    from flaskr.quiz import quiz_sessions
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        count_queries(db.engine)
+
+    results = {}
+    for mix_name in args.mix or sorted(MIXES):
+        mix = MIXES[mix_name]
+        # twice the expected category deletions, every mix starts from
+        # the same question bank
+        spare_categories = 2 * args.requests * mix.get("delete_category", 0) // sum(mix.values())
+        seed_app(
+            app,
+            args.questions,
+            args.categories,
+            args.seed,
+            spare_categories=spare_categories
+        )
+
+        scenarios = Scenarios(
+            args.questions,
+            args.categories,
+            args.seed,
+            spare_categories
+        )
+        scenarios.sessions = [
+            quiz_sessions.start()[0] for _ in range(args.threads)
+        ]
+
+        print(
+            f"{mix_name}: {args.questions} questions, {args.categories}"
+            f" categories, {args.requests} requests, {args.threads} threads",
+            file=sys.stderr
+        )
+        results[mix_name] = run(app, scenarios, mix, args.requests, args.threads)
+        report(mix_name, results[mix_name])
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        found = regressions(results, baseline, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Fill a benchmark database with a synthetic question bank"""
+import os
+import tempfile
+from random import Random
+
+from sqlalchemy import text
+
+
+def use_benchmark_database():
+    """Point the app at a throwaway SQLite file unless a URI is set
+
+    Must run before config is imported.
+    """
+    if not os.environ.get("SQLALCHEMY_DATABASE_URI"):
+        path = os.path.join(tempfile.mkdtemp(), "trivia_bench.db")
+        os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    return os.environ["SQLALCHEMY_DATABASE_URI"]
+
+
+WORDS = (
+    "what which who where when how many river capital painting planet "
+    "element team player album novel author film year country city war "
+    "king queen ocean mountain language instrument composer theory"
+).split()
+
+
+def seed_questions(db, total_questions, total_categories=6, seed=0,
+                   batch_size=5000, spare_categories=0):
+    """Insert synthetic categories and questions with executemany batches
+
+    `spare_categories` more categories, without questions, follow the
+    total_categories ones.
+    """
+    from models import Category, Question
+
+    random = Random(seed)
+
+    db.session.execute(Question.__table__.delete())
+    db.session.execute(Category.__table__.delete())
+    db.session.execute(
+        Category.__table__.insert(),
+        [
+            {"id": category_id, "type": f"Category {category_id}"}
+            for category_id in range(1, total_categories + spare_categories + 1)
+        ]
+    )
+
+    batch = []
+    for question_id in range(1, total_questions + 1):
+        batch.append({
+            "id": question_id,
+            "question": " ".join(random.choices(WORDS, k=8)) + "?",
+            "answer": " ".join(random.choices(WORDS, k=2)),
+            "category": random.randint(1, total_categories),
+            "difficulty": random.randint(1, 5)
+        })
+        if len(batch) == batch_size:
+            db.session.execute(Question.__table__.insert(), batch)
+            batch = []
+
+    if batch:
+        db.session.execute(Question.__table__.insert(), batch)
+
+    # the ids were given explicitly, move the sequences past them
+    if db.engine.dialect.name == "postgresql":
+        for table in ("questions", "categories"):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'),"
+                f" (SELECT MAX(id) FROM {table}))"
+            ))
+
+    db.session.commit()
+
+
+def seed_app(app, total_questions, total_categories=6, seed=0,
+             spare_categories=0):
+    """Seed the database of an app and reload its in-process indexes"""
+    from flaskr.cache import categories_cache
+    from flaskr.http_cache import data_version
+    from flaskr.index import question_index
+    from flaskr.search import search_engine
+    from flaskr.suggest import suggest_index
+    from models import db
+
+    with app.app_context():
+        seed_questions(
+            db,
+            total_questions,
+            total_categories,
+            seed,
+            spare_categories=spare_categories
+        )
+        question_index.build()
+        search_engine.build()
+        suggest_index.build()
+        categories_cache.invalidate()
+    # the rows were written behind the write hooks
+    data_version.bump()
@@ -0,0 +1,70 @@
+"""Compare loading and formatting questions through ORM instances
+(Question.format) with the column-only row path (format_question_row)
+"""
+import argparse
+import json
+import tracemalloc
+from time import perf_counter
+
+from benchmarks.seed import seed_questions, use_benchmark_database
+
+
+def measure(function, repeat):
+    """Best wall time and peak traced memory of function()"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    use_benchmark_database()
+
+    from flaskr import create_app
+    from models import db, format_question_row, question_rows, Question
+
+    app = create_app()
+
+    with app.app_context():
+        seed_questions(db, args.questions)
+
+        def orm_path():
+            questions = [
+                Question.format(question)
+                for question in Question.query.all()
+            ]
+            db.session.remove()
+            return json.dumps(questions)
+
+        def row_path():
+            questions = [
+                format_question_row(row)
+                for row in question_rows()
+            ]
+            db.session.remove()
+            return json.dumps(questions)
+
+        print(f"{args.questions} questions, best of {args.repeat}")
+        for name, path in (("orm", orm_path), ("rows", row_path)):
+            seconds, peak = measure(path, args.repeat)
+            print(
+                f"{name:>5}: {seconds * 1000:8.1f} ms"
+                f"  peak {peak / 1024 / 1024:7.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
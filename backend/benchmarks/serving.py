@@ -0,0 +1,134 @@
+"""Load test of the read endpoints served by the WSGI app (a thread pool,
+like a threaded WSGI server) and by the ASGI app (concurrent coroutines)
+
+Point SQLALCHEMY_DATABASE_URI at Postgres to see the effect of waiting on
+the database, SQLite mostly measures the overhead of each stack.
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+from time import perf_counter
+
+from benchmarks.seed import seed_app, use_benchmark_database
+
+# (method, path, query string, json body) of the mix of requests
+REQUESTS = (
+    ("GET", "/api/questions", "page=1", None),
+    ("GET", "/api/questions", "after=&limit=10", None),
+    ("GET", "/api/categories", "", None),
+    ("POST", "/api/questions", "", {"searchTerm": "what river", "page": 1}),
+    ("POST", "/api/quizzes", "", {
+        "previous_questions": [],
+        "quiz_category": {"id": 0, "type": "ALL"}
+    }),
+)
+
+
+def report(name, latencies, seconds):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:>5}: {len(latencies) / seconds:8.0f} req/s"
+        f"  p50 {p50 * 1000:6.2f} ms  p99 {p99 * 1000:6.2f} ms"
+    )
+
+
+def run_wsgi(app, total, threads):
+    client = app.test_client()
+
+    def call(request):
+        method, path, query, body = request
+        start = perf_counter()
+        response = client.open(
+            f"{path}?{query}",
+            method=method,
+            data=json.dumps(body) if body is not None else None
+        )
+        assert response.status_code == 200, response.status_code
+        return perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(call, islice(cycle(REQUESTS), total)))
+    return latencies, perf_counter() - start
+
+
+async def run_asgi(asgi_app, total, concurrency):
+    requests = iter(islice(cycle(REQUESTS), total))
+    latencies = []
+
+    async def call(request):
+        method, path, query, body = request
+        body = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+        }
+        status = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        start = perf_counter()
+        await asgi_app(scope, receive, send)
+        assert status == [200], status
+        latencies.append(perf_counter() - start)
+
+    async def client():
+        for request in requests:
+            await call(request)
+
+    start = perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = perf_counter() - start
+
+    await asgi_app.engine.dispose()
+    return latencies, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8,
+                        help="WSGI worker threads")
+    parser.add_argument("--concurrency", type=int, default=200,
+                        help="concurrent ASGI clients")
+    args = parser.parse_args()
+
+    use_benchmark_database()
+
+    from flaskr.asgi import create_asgi_app
+
+    asgi_app = create_asgi_app()
+    app = asgi_app.app
+    seed_app(app, args.questions)
+
+    print(
+        f"{args.questions} questions, {args.requests} requests,"
+        f" {args.threads} wsgi threads, {args.concurrency} asgi clients"
+    )
+    report("wsgi", *run_wsgi(app, args.requests, args.threads))
+    report("asgi", *asyncio.run(
+        run_asgi(asgi_app, args.requests, args.concurrency)
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Startup cost of a worker in each STARTUP_MODE: time to import the app
+and run create_app, SQL statements and connections it makes, and the
+latency of the first requests
+
+Every run starts a fresh interpreter, the way a worker boots. With
+`--fork` the app is created once and forked, like gunicorn --preload,
+and the children are timed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+from benchmarks.seed import seed_app, use_benchmark_database
+
+# STARTUP_MODE and WARM_ON_STARTUP of each configuration
+CONFIGURATIONS = {
+    "development": {"STARTUP_MODE": "development"},
+    "production": {"STARTUP_MODE": "production", "WARM_ON_STARTUP": "false"},
+    "production warm": {"STARTUP_MODE": "production", "WARM_ON_STARTUP": "true"},
+}
+
+FIRST_REQUESTS = ("/api/questions?page=1", "/api/categories")
+
+
+def boot(fork):
+    """Runs in the child interpreter, prints its measurements as JSON"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.pool import Pool
+
+    counts = {"statements": 0, "connections": 0}
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_statement(*args):
+        counts["statements"] += 1
+
+    @event.listens_for(Pool, "connect")
+    def count_connection(*args):
+        counts["connections"] += 1
+
+    start = perf_counter()
+    from flaskr import create_app
+    imported = perf_counter()
+    app = create_app()
+    created = perf_counter()
+
+    result = {
+        "import_ms": (imported - start) * 1000,
+        "create_app_ms": (created - imported) * 1000,
+        "statements": counts["statements"],
+        "connections": counts["connections"],
+    }
+
+    def first_requests():
+        client = app.test_client()
+        latencies = []
+        for url in FIRST_REQUESTS:
+            start = perf_counter()
+            response = client.get(url)
+            latencies.append((perf_counter() - start) * 1000)
+            assert response.status_code == 200, (url, response.status_code)
+        return latencies
+
+    if fork:
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            os.write(write, json.dumps(first_requests()).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            latencies = json.load(pipe)
+        os.waitpid(pid, 0)
+    else:
+        latencies = first_requests()
+
+    result["first_request_ms"] = latencies[0]
+    result["second_request_ms"] = latencies[1]
+    print(json.dumps(result))
+
+
+def measure(configuration, fork):
+    env = dict(os.environ, **CONFIGURATIONS[configuration])
+    command = [sys.executable, "-m", "benchmarks.startup", "--child"]
+    if fork:
+        command.append("--fork")
+    output = subprocess.run(
+        command, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fork", action="store_true",
+                        help="time the requests of a forked child")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return boot(args.fork)
+
+    use_benchmark_database()
+
+    from flaskr import create_app
+
+    seed_app(create_app(), args.questions, args.categories)
+
+    print(
+        f"{args.questions} questions, median of {args.repeat} boots"
+        f"{', requests served by a forked child' if args.fork else ''}"
+    )
+    print(
+        f"  {'mode':<16}{'import ms':>10}{'create ms':>10}{'queries':>9}"
+        f"{'connects':>9}{'1st req ms':>11}{'2nd req ms':>11}"
+    )
+    for configuration in CONFIGURATIONS:
+        runs = [measure(configuration, args.fork) for _ in range(args.repeat)]
+        value = lambda key: median(run[key] for run in runs)
+        print(
+            f"  {configuration:<16}{value('import_ms'):>10.1f}"
+            f"{value('create_app_ms'):>10.1f}{value('statements'):>9.0f}"
+            f"{value('connections'):>9.0f}{value('first_request_ms'):>11.2f}"
+            f"{value('second_request_ms'):>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
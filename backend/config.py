@@ -19,4 +19,123 @@ else:
     QUESTIONS_PER_PAGE = int(os.environ.get("QUESTIONS_PER_PAGE"))
 
 SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI") or DEFAULT_DB_URI
-SQLALCHEMY_TRACK_MODIFICATIONS = bool(os.environ.get("SQLALCHEMY_TRACK_MODIFICATIONS")) or False
\ No newline at end of file
+SQLALCHEMY_TRACK_MODIFICATIONS = bool(os.environ.get("SQLALCHEMY_TRACK_MODIFICATIONS")) or False
+
+# seconds between consistency checks of the in-process question index,
+# other workers may have written to the database. 0 disables the checks
+INDEX_VERIFY_INTERVAL = int(os.environ.get("INDEX_VERIFY_INTERVAL") or 0)
+
+# seconds the categories map is cached for, category writes clear it
+CATEGORIES_CACHE_TTL = int(os.environ.get("CATEGORIES_CACHE_TTL") or 300)
+
+# question search backend: "postgres" (GIN indexed full-text search),
+# "memory" (in-process inverted index) or "auto" to pick by database
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND") or "auto"
+
+# ranked results of recent searches kept per worker, per normalised term,
+# category and searchAnswers flag. question and category writes clear them
+SEARCH_CACHE_ENTRIES = int(os.environ.get("SEARCH_CACHE_ENTRIES") or 1024)
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL") or 60)
+
+# words suggested by GET /api/questions/suggest, by default and at most
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT") or 10)
+SUGGEST_MAX_LIMIT = int(os.environ.get("SUGGEST_MAX_LIMIT") or 50)
+
+# "development" creates the missing tables, applies the pending migrations
+# and loads the in-process indexes when the app is created. "production"
+# leaves the schema to `flask db upgrade` and does not touch the database
+# before the first request of a worker
+STARTUP_MODE = os.environ.get("STARTUP_MODE") or "development"
+PRODUCTION_STARTUP = STARTUP_MODE.lower() == "production"
+
+# apply the pending schema migrations when the app starts,
+# otherwise run `flask db upgrade`
+MIGRATE_ON_STARTUP = (
+    os.environ.get("MIGRATE_ON_STARTUP") or str(not PRODUCTION_STARTUP)
+).lower() != "false"
+
+# load the question index, search index and categories when the app is
+# created instead of on the first request, e.g once in the gunicorn
+# master with --preload, shared by the forked workers
+WARM_ON_STARTUP = (
+    os.environ.get("WARM_ON_STARTUP") or str(not PRODUCTION_STARTUP)
+).lower() != "false"
+
+# seconds clients and proxies may reuse a read response before
+# revalidating it with its ETag, 0 always revalidates
+HTTP_CACHE_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE") or 0)
+
+# rows inserted per executemany by the bulk question import
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE") or 1000)
+
+# rows fetched per round trip by the streaming question export
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE") or 1000)
+
+# bodies of the ETagged read endpoints kept per worker, concurrent
+# requests for a path share one computation. After a write, the requests
+# arriving while the first one recomputes a body get the previous body for
+# up to COALESCE_STALE_SECONDS, 0 makes them wait for the new one
+COALESCE_CACHE_ENTRIES = int(os.environ.get("COALESCE_CACHE_ENTRIES") or 256)
+COALESCE_STALE_SECONDS = float(os.environ.get("COALESCE_STALE_SECONDS") or 2)
+
+# without a shared cache backend a worker does not see the writes of the
+# other workers: its ETags, and the bodies cached under them, are renewed
+# every DATA_VERSION_LOCAL_TTL seconds. 0 keeps them until the next write
+# of the worker, for a single worker
+DATA_VERSION_LOCAL_TTL = float(os.environ.get("DATA_VERSION_LOCAL_TTL") or 5)
+
+# server-side quiz sessions expire after this many idle seconds,
+# the least recently used are dropped beyond QUIZ_MAX_SESSIONS
+QUIZ_SESSION_TTL = int(os.environ.get("QUIZ_SESSION_TTL") or 1800)
+QUIZ_MAX_SESSIONS = int(os.environ.get("QUIZ_MAX_SESSIONS") or 10000)
+
+# most questions served by one POST /api/quizzes/batch
+QUIZ_MAX_BATCH = int(os.environ.get("QUIZ_MAX_BATCH") or 50)
+
+# cache shared by the workers: "local" (in-process LRU, one worker) or
+# "redis" (CACHE_REDIS_URL, writes are broadcast to every worker)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND") or "local"
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL") or "redis://localhost:6379/0"
+CACHE_KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX") or "trivia:"
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES") or 1024)
+
+# database connection pool, see
+# https://docs.sqlalchemy.org/en/14/core/pooling.html
+SQLALCHEMY_POOL_SIZE = int(os.environ.get("SQLALCHEMY_POOL_SIZE") or 5)
+SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get("SQLALCHEMY_MAX_OVERFLOW") or 10)
+SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get("SQLALCHEMY_POOL_TIMEOUT") or 30)
+SQLALCHEMY_POOL_RECYCLE = int(os.environ.get("SQLALCHEMY_POOL_RECYCLE") or 1800)
+SQLALCHEMY_POOL_PRE_PING = (os.environ.get("SQLALCHEMY_POOL_PRE_PING") or "true").lower() != "false"
+# milliseconds before Postgres cancels a statement, 0 disables it
+SQLALCHEMY_STATEMENT_TIMEOUT = int(os.environ.get("SQLALCHEMY_STATEMENT_TIMEOUT") or 0)
+
+# comma separated URIs of read replicas of SQLALCHEMY_DATABASE_URI, the
+# read-only views (question lists, search, categories, quizzes) read from
+# them in turn. Empty reads from the primary only
+SQLALCHEMY_REPLICA_URIS = [
+    uri.strip()
+    for uri in (os.environ.get("SQLALCHEMY_REPLICA_URIS") or "").split(",")
+    if uri.strip()
+]
+# seconds between health checks of the replicas, a replica failing one
+# serves no reads until it passes a later check. 0 disables the checks
+REPLICA_HEALTH_INTERVAL = int(os.environ.get("REPLICA_HEALTH_INTERVAL") or 10)
+
+# requests slower than this many milliseconds are logged with their SQL
+# statements, 0 disables the log
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS") or 500)
+
+# database URI of the async serving mode (flaskr.asgi), derived from
+# SQLALCHEMY_DATABASE_URI when unset: asyncpg for postgres, aiosqlite
+# for sqlite
+ASYNC_DATABASE_URI = os.environ.get("ASYNC_DATABASE_URI")
+# threads of an async worker serving the requests left to the Flask app
+ASYNC_WSGI_THREADS = int(os.environ.get("ASYNC_WSGI_THREADS") or 8)
+
+# compress responses of at least COMPRESS_MIN_SIZE bytes with brotli (when
+# installed) or gzip, for clients accepting it. 0 disables compression
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE") or 1024)
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL") or 6)
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY") or 4)
+# compressed bodies of ETagged responses kept per worker
+COMPRESS_CACHE_ENTRIES = int(os.environ.get("COMPRESS_CACHE_ENTRIES") or 256)
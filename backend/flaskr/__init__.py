@@ -1,31 +1,159 @@
 
 
 
-from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
 from config import (
-    ALLOWED_LIST,
-    SQLALCHEMY_DATABASE_URI
+    CACHE_BACKEND,
+    CACHE_KEY_PREFIX,
+    CACHE_MAX_ENTRIES,
+    CACHE_REDIS_URL,
+    INDEX_VERIFY_INTERVAL,
+    MIGRATE_ON_STARTUP,
+    PRODUCTION_STARTUP,
+    REPLICA_HEALTH_INTERVAL,
+    SEARCH_BACKEND,
+    SLOW_REQUEST_MS,
+    SQLALCHEMY_DATABASE_URI,
+    SQLALCHEMY_MAX_OVERFLOW,
+    SQLALCHEMY_POOL_PRE_PING,
+    SQLALCHEMY_POOL_RECYCLE,
+    SQLALCHEMY_POOL_SIZE,
+    SQLALCHEMY_POOL_TIMEOUT,
+    SQLALCHEMY_REPLICA_URIS,
+    SQLALCHEMY_STATEMENT_TIMEOUT,
+    SQLALCHEMY_TRACK_MODIFICATIONS,
+    WARM_ON_STARTUP
 )
+from flaskr.cache import (
+    categories_cache,
+    setup_cache,
+    shared_cache,
+    write_broadcast
+)
+from flaskr.cli import (
+    db_cli,
+    export_questions_command,
+    import_questions_command,
+    index_cli
+)
+from flaskr.coalescing import coalesced_responses
+from flaskr.compression import compress_response, compressed_cache
 from flaskr.controllers.question import question_controller
 from flaskr.controllers.category import categories_controller
-from models import setup_db
+from flaskr.controllers.metrics import metrics_controller
+from flaskr.cors import allowed_origin_headers
+from flaskr.http_cache import data_version
+from flaskr.index import question_index
+from flaskr.metrics import engine_options, instrument_app, request_metrics
+from flaskr.search import search_engine
+from flaskr.startup import dispose_pools, on_fork, warmup
+from flaskr.suggest import suggest_index
+from models import db, on_write, setup_db
+from replicas import replica_set
 
-# load environment variables
-load_dotenv(".env")
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
     
-    # database entrypoint
-    setup_db(app, SQLALCHEMY_DATABASE_URI)
+    # database entrypoint, the replicas share the dialect of the primary
+    pool_options = (
+        SQLALCHEMY_POOL_SIZE,
+        SQLALCHEMY_MAX_OVERFLOW,
+        SQLALCHEMY_POOL_TIMEOUT,
+        SQLALCHEMY_POOL_RECYCLE,
+        SQLALCHEMY_POOL_PRE_PING,
+        SQLALCHEMY_STATEMENT_TIMEOUT
+    )
+    setup_db(
+        app,
+        SQLALCHEMY_DATABASE_URI,
+        SQLALCHEMY_TRACK_MODIFICATIONS,
+        migrate=MIGRATE_ON_STARTUP,
+        create_tables=not PRODUCTION_STARTUP,
+        engine_options=engine_options(SQLALCHEMY_DATABASE_URI, *pool_options),
+        replica_uris=SQLALCHEMY_REPLICA_URIS,
+        replica_engine_options=engine_options(
+            SQLALCHEMY_DATABASE_URI, *pool_options, instrumented=False
+        )
+    )
+
+    # cache shared by the workers, the writes of every worker are
+    # broadcast through it
+    setup_cache(
+        app,
+        CACHE_BACKEND,
+        CACHE_REDIS_URL,
+        CACHE_MAX_ENTRIES,
+        CACHE_KEY_PREFIX
+    )
+    on_write(write_broadcast.on_write, remote=False)
+
+    # in-process question index and caches, kept in sync by the model
+    # write hooks
+    on_write(question_index.on_write)
+    on_write(categories_cache.on_write)
+    on_write(search_engine.on_write)
+    on_write(suggest_index.on_write)
+
+    # a shared data version is bumped once, by the worker that wrote
+    if shared_cache.shared:
+        data_version.bind(shared_cache)
+        on_write(data_version.on_write, remote=False)
+    else:
+        on_write(data_version.on_write)
+
+    # the search backend is picked from the URI, without connecting
+    with app.app_context():
+        search_engine.configure(SEARCH_BACKEND, db.engine.dialect.name)
+
+    # the indexes are loaded now or by the first request of the worker
+    warmup.reset()
+    if WARM_ON_STARTUP:
+        warmup.run(app)
+
+    # a worker forked from this process (gunicorn --preload) opens its
+    # own connections and cache subscription
+    on_fork(dispose_pools)
+    on_fork(shared_cache.after_fork)
+    on_fork(write_broadcast.after_fork)
+    on_fork(data_version.after_fork)
+
+    # per request metrics, served at /metrics
+    instrument_app(app, SLOW_REQUEST_MS / 1000)
+    request_metrics.register_cache("categories", categories_cache)
+    request_metrics.register_cache("shared", shared_cache)
+    request_metrics.register_cache("search", search_engine.results)
+
+    # gzip / brotli, after the views so the ETag is set
+    app.after_request(compress_response)
+    request_metrics.register_cache("compressed", compressed_cache)
+    request_metrics.register_cache("responses", coalesced_responses)
+
+    @app.before_request
+    def warm_up():
+        warmup.run(app)
+
+    @app.before_request
+    def verify_question_index():
+        question_index.verify_if_due(INDEX_VERIFY_INTERVAL)
+
+    @app.before_request
+    def check_replicas():
+        replica_set.check_if_due(REPLICA_HEALTH_INTERVAL)
+
+    # cli commands
+    app.cli.add_command(index_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(export_questions_command)
     
     # routes
     app.register_blueprint(question_controller, url_prefix='/api/')
     app.register_blueprint(categories_controller, url_prefix='/api/')
+    app.register_blueprint(metrics_controller)
 
     """
     Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -38,27 +166,12 @@ def create_app(test_config=None):
     @app.after_request
     def set_access_controls(response):
 
-        if str(request.origin) in ALLOWED_LIST:
-
-            response.headers.add('Access-Control-Allow-Origin',
-                                 request.origin)
-
-            response.headers.add('Access-Control-Allow-Credentials', 'true')
-
-            response.headers.add(
-                'Access-Control-Allow-Headers', 'Content-Type')
-
-            response.headers.add(
-                'Access-Control-Allow-Headers', 'Cache-Control')
-
-            response.headers.add(
-                'Access-Control-Allow-Headers', 'X-Requested-With')
-
-            response.headers.add(
-                'Access-Control-Allow-Headers', 'Authorization')
+        # the headers depend on the Origin of the request, the read
+        # responses are Cache-Control: public
+        response.vary.add('Origin')
 
-            response.headers.add('Access-Control-Allow-Methods',
-                                 'GET, POST, OPTIONS, PUT, DELETE')
+        for name, value in allowed_origin_headers(request.origin):
+            response.headers.add(name, value)
 
         return response
 
@@ -0,0 +1,541 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.parse import parse_qsl
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, parse_etags
+
+from config import (
+    ASYNC_DATABASE_URI,
+    ASYNC_WSGI_THREADS,
+    HTTP_CACHE_MAX_AGE,
+    INDEX_VERIFY_INTERVAL,
+    QUESTIONS_PER_PAGE,
+    SQLALCHEMY_DATABASE_URI,
+    SQLALCHEMY_MAX_OVERFLOW,
+    SQLALCHEMY_POOL_PRE_PING,
+    SQLALCHEMY_POOL_RECYCLE,
+    SQLALCHEMY_POOL_SIZE,
+    SQLALCHEMY_POOL_TIMEOUT,
+    SQLALCHEMY_STATEMENT_TIMEOUT
+)
+from flaskr import create_app
+from flaskr.cache import categories_cache
+from flaskr.coalescing import AsyncSingleFlight, coalesced_responses
+from flaskr.compression import compress
+from flaskr.cors import access_control_headers
+from flaskr.http_cache import data_version
+from flaskr.index import question_index
+from flaskr.metrics import request_metrics
+from flaskr.quiz import pick_quiz_question_id, pick_quiz_question_ids
+from flaskr.reads import (
+    check_page,
+    current_category_arg,
+    in_order,
+    questions_after,
+    questions_by_id,
+    questions_page,
+    questions_payload,
+    quiz_batch_request,
+    quiz_request,
+    search_page,
+    search_payload,
+    search_request,
+    search_scope,
+    split_page
+)
+from flaskr.responses import encode
+from flaskr.search import PostgresSearch, search_engine
+from flaskr.startup import on_fork, warmup
+from models import format_question_row
+
+"""
+asgi
+    async serving mode. The read-heavy endpoints (questions list, search,
+    categories and quizzes) are served by coroutines reading through an
+    async driver, so a worker holds many concurrent players while their
+    queries wait on the database. Every other request, and the requests
+    the coroutines do not handle (errors, writes), goes to the Flask app.
+    The arguments, statements and payloads are those of the Flask views
+    (flaskr.reads). The coroutines read from the primary only, replicas
+    (replicas.py) serve the reads of the Flask app. The bodies of the
+    ETagged views go through coalesced_responses like those of the Flask
+    views (flaskr.coalescing).
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+"""
+
+
+def async_database_uri(database_uri):
+    """URI of the async driver for a SQLALCHEMY_DATABASE_URI"""
+    scheme, _, location = database_uri.partition("://")
+    dialect = scheme.split("+")[0]
+
+    if dialect in ("postgres", "postgresql"):
+        return f"postgresql+asyncpg://{location}"
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite://{location}"
+
+    raise ValueError(f"no async driver for {scheme}")
+
+
+def async_engine_options(database_uri, pool_size, max_overflow, pool_timeout,
+                         pool_recycle, pool_pre_ping, statement_timeout):
+    """create_async_engine options matching metrics.engine_options"""
+    options = {"pool_pre_ping": pool_pre_ping}
+
+    # SQLAlchemy opens an aiosqlite connection (and its thread) per
+    # checkout on SQLite files unless told to pool them
+    if database_uri.startswith("sqlite"):
+        options["poolclass"] = AsyncAdaptedQueuePool
+
+    options.update({
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+    })
+
+    if statement_timeout and database_uri.startswith("postgres"):
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(statement_timeout)}
+        }
+
+    return options
+
+
+class AsyncRequest:
+    """The parts of an ASGI request the async views read"""
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        self.body = body
+
+    @property
+    def full_path(self):
+        # same as flask.Request.full_path, the ETags of both modes match
+        return f"{self.path}?{self.query_string}"
+
+    def json(self):
+        """The decoded JSON body, None when it is not valid JSON"""
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+class ThreadPoolWsgi:
+    """ASGI application serving a WSGI app on a pool of threads
+
+    WsgiToAsgi runs the WSGI app on the thread of the sync code that
+    awaits it, a single thread shared by every request when awaited from
+    the event loop. Each request is handed to a thread of the pool,
+    which awaits WsgiToAsgi back on the event loop (async_to_sync) and
+    so runs the WSGI app itself.
+
+    Args:
+        app: WSGI application
+        threads (int): size of the pool, requests served at once
+    """
+
+    def __init__(self, app, threads):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+        self.serve = sync_to_async(
+            async_to_sync(WsgiToAsgi(app)),
+            thread_sensitive=False,
+            executor=self.executor
+        )
+
+    async def __call__(self, scope, receive, send):
+        await self.serve(scope, receive, send)
+
+
+class AsyncApi:
+    """ASGI application: async views in front of the Flask app
+
+    An async view returns None, or aborts like a Flask view, to hand the
+    request over to the Flask app, which keeps the error responses and
+    the writes in one place.
+
+    Args:
+        app (Flask): the app built by create_app
+        engine (AsyncEngine): async engine on the same database
+        wsgi_threads (int): threads serving the requests of the Flask app
+    """
+
+    def __init__(self, app, engine, wsgi_threads=ASYNC_WSGI_THREADS):
+        self.app = app
+        self.engine = engine
+        self.wsgi = ThreadPoolWsgi(app, wsgi_threads)
+        self.flight = AsyncSingleFlight()
+        self.routes = {
+            ("GET", "/api/questions"): self.fetch_questions,
+            ("POST", "/api/questions"): self.search_questions,
+            ("GET", "/api/categories"): self.fetch_categories,
+            ("POST", "/api/quizzes"): self.quizzes,
+            ("POST", "/api/quizzes/batch"): self.quizzes_batch,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        view = None
+        if scope["type"] == "http":
+            view = self.routes.get((scope["method"], scope["path"]))
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+
+        body = await read_body(receive)
+        request = AsyncRequest(scope, body)
+        statements = []
+        start = perf_counter()
+
+        if not warmup.done:
+            await asyncio.to_thread(warmup.run, self.app)
+        if question_index.verify_due(INDEX_VERIFY_INTERVAL):
+            await asyncio.to_thread(self.verify_question_index)
+
+        try:
+            response = await view(request, statements)
+        except HTTPException:
+            response = None
+
+        # replay the request to the Flask app
+        if response is None:
+            async def replay():
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await self.wsgi(scope, replay, send)
+
+        status, headers, content = response
+        # the headers depend on the Origin of the request, as in the Flask app
+        vary = ["Origin"]
+        if status == 200:
+            etag = dict(headers).get("ETag")
+            content, encoding = compress(
+                content,
+                request.headers.get("accept-encoding"),
+                (etag, request.full_path) if etag else None
+            )
+            vary.append("Accept-Encoding")
+            if encoding is not None:
+                headers.append(("Content-Encoding", encoding))
+        headers.append(("Vary", ", ".join(vary)))
+        headers.extend(access_control_headers(request.headers.get("origin")))
+        headers.append(("Content-Length", str(len(content))))
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+        })
+        await send({"type": "http.response.body", "body": content})
+
+        request_metrics.record(
+            scope["path"],
+            scope["method"],
+            status,
+            perf_counter() - start,
+            statements,
+            len(content)
+        )
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                self.wsgi.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def verify_question_index(self):
+        with self.app.app_context():
+            question_index.verify_if_due(INDEX_VERIFY_INTERVAL)
+
+    async def execute(self, statement, statements):
+        """Run a statement on a pooled connection, recording its duration"""
+        start = perf_counter()
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(statement)).all()
+        statements.append((str(statement), perf_counter() - start))
+        return rows
+
+    async def categories(self, statements):
+        """categories_cache, reloaded through the async engine if stale.
+        Concurrent requests wait for a single reload."""
+        if not categories_cache.stale():
+            return categories_cache
+
+        async def load():
+            generation = categories_cache.generation
+            return categories_cache.fill(
+                await self.execute(categories_cache.query, statements),
+                generation
+            )
+
+        return await self.flight.do("categories", load)
+
+    async def search(self, search_term, category_id, search_answers, statements):
+        """search_engine.search, the Postgres search running on the async
+        engine"""
+        backend = search_engine.backend
+        if not isinstance(backend, PostgresSearch):
+            return search_engine.search(search_term, category_id, search_answers)
+
+        key = search_engine.result_key(search_term, category_id, search_answers)
+        if key is None:
+            return ()
+
+        question_ids = search_engine.results.get(key)
+        if question_ids is None:
+            generation = search_engine.generation
+            statement = backend.statement(search_term, category_id, search_answers)
+            question_ids = search_engine.remember(key, [
+                question_id
+                for question_id, in await self.execute(statement, statements)
+            ], generation)
+        return question_ids
+
+    async def conditional(self, request, render):
+        """Serve an ETagged view like http_cache.conditional: a 304 while
+        If-None-Match matches the data version, else the body through
+        coalesced_responses, shared with the Flask views
+
+        Args:
+            render (coroutine function): returns the JSON body
+        """
+        etag = data_version.etag(request.full_path)
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+            return 304, validator_headers(etag), b""
+
+        async def compute():
+            return 200, await render(), [("Content-Type", "application/json")]
+
+        entry = await coalesced_responses.get_async(
+            request.full_path,
+            etag,
+            data_version.last_modified,
+            compute
+        )
+
+        # the previous body, with its own validators, while it is recomputed
+        headers = validator_headers(entry["etag"], entry["last_modified"])
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(entry["etag"]):
+            return 304, headers, b""
+        return 200, headers + [("Content-Type", "application/json")], entry["body"]
+
+    async def fetch_questions(self, request, statements):
+        """GET /api/questions, see controllers.question.fetch_questions"""
+        async def render():
+            current_category = current_category_arg(request.args.get("current_category"))
+            categories = await self.categories(statements)
+
+            if "after" in request.args:
+                statement, limit = questions_after(
+                    request.args.get("after"),
+                    request.args.get("limit", QUESTIONS_PER_PAGE, int)
+                )
+                questions, next_cursor = split_page(
+                    await self.execute(statement, statements),
+                    limit
+                )
+                return encode(questions_payload(
+                    questions,
+                    current_category,
+                    categories.fragment(),
+                    question_index.count(),
+                    next_cursor=next_cursor
+                )).encode()
+
+            page_number = request.args.get("page", 1, int)
+            rows, total = questions_page(page_number)
+            questions = await self.execute(rows, statements)
+            check_page(questions, page_number)
+            (total_questions,), = await self.execute(total, statements)
+
+            return encode(questions_payload(
+                questions,
+                current_category,
+                categories.fragment(),
+                total_questions
+            )).encode()
+
+        return await self.conditional(request, render)
+
+    async def fetch_categories(self, request, statements):
+        """GET /api/categories, see controllers.category.fecth_categories"""
+        async def render():
+            categories = await self.categories(statements)
+            return encode({"categories": categories.fragment()}).encode()
+
+        return await self.conditional(request, render)
+
+    async def search_questions(self, request, statements):
+        """POST /api/questions with a searchTerm, see
+        controllers.question.search_question. Creating a question is left
+        to Flask."""
+        data = request.json()
+        if not isinstance(data, dict) or not data.get("searchTerm"):
+            return None
+
+        search_term, search_answers, page, limit = search_request(data)
+        current_category, category_id = search_scope(
+            request.args.get("current_category"),
+            await self.categories(statements)
+        )
+
+        # return empty if the category is not found
+        if current_category is not None and category_id is None:
+            return json_ok(search_payload([], current_category, 0))
+
+        question_ids = await self.search(
+            search_term,
+            category_id,
+            search_answers,
+            statements
+        )
+        total_questions = len(question_ids)
+        question_ids = search_page(question_ids, page, limit)
+
+        # load the page of questions and keep the ranking order
+        rows = await self.execute(
+            questions_by_id(question_ids),
+            statements
+        ) if question_ids else []
+
+        return json_ok(search_payload(
+            in_order(rows, question_ids),
+            current_category,
+            total_questions
+        ))
+
+    async def quizzes(self, request, statements):
+        """POST /api/quizzes, see controllers.question.quizzes"""
+        category_id, previous_question_ids, sampling = quiz_request(request.json())
+
+        try:
+            question_id = pick_quiz_question_id(
+                category_id,
+                previous_question_ids,
+                **sampling
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        if question_id is None:
+            return None
+
+        rows = await self.execute(questions_by_id([question_id]), statements)
+        # deleted since the index was read
+        if not rows:
+            return None
+
+        return json_ok({"question": format_question_row(rows[0])})
+
+    async def quizzes_batch(self, request, statements):
+        """POST /api/quizzes/batch, see controllers.question.quizzes_batch"""
+        category_id, previous_question_ids, count, sampling = quiz_batch_request(
+            request.json()
+        )
+
+        try:
+            question_ids = pick_quiz_question_ids(
+                category_id,
+                previous_question_ids,
+                count,
+                **sampling
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        if not question_ids:
+            return None
+
+        questions = in_order(
+            await self.execute(questions_by_id(question_ids), statements),
+            question_ids
+        )
+        # deleted since the index was read
+        if not questions:
+            return None
+
+        return json_ok({
+            "questions": questions,
+            "total_questions": len(questions)
+        })
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def json_ok(payload):
+    return 200, [("Content-Type", "application/json")], encode(payload).encode()
+
+
+def validator_headers(etag, last_modified=None):
+    """Headers of http_cache.conditional: weak ETag, Last-Modified and
+    Cache-Control
+
+    Args:
+        last_modified (datetime): of the body, the data version by default
+    """
+    if HTTP_CACHE_MAX_AGE:
+        cache_control = f"public, max-age={HTTP_CACHE_MAX_AGE}"
+    else:
+        cache_control = "public, no-cache"
+
+    return [
+        ("ETag", f'W/"{etag}"'),
+        ("Last-Modified", http_date(last_modified or data_version.last_modified)),
+        ("Cache-Control", cache_control)
+    ]
+
+
+def create_asgi_app(test_config=None):
+    """Create the ASGI application: create_app behind the async views"""
+    app = create_app(test_config)
+
+    database_uri = ASYNC_DATABASE_URI or async_database_uri(SQLALCHEMY_DATABASE_URI)
+    engine = create_async_engine(
+        database_uri,
+        **async_engine_options(
+            database_uri,
+            SQLALCHEMY_POOL_SIZE,
+            SQLALCHEMY_MAX_OVERFLOW,
+            SQLALCHEMY_POOL_TIMEOUT,
+            SQLALCHEMY_POOL_RECYCLE,
+            SQLALCHEMY_POOL_PRE_PING,
+            SQLALCHEMY_STATEMENT_TIMEOUT
+        )
+    )
+
+    # the forked workers of a preloaded app open their own connections
+    on_fork(lambda: engine.sync_engine.dispose(close=False))
+
+    return AsyncApi(app, engine)
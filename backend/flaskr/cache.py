@@ -0,0 +1,527 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, sleep
+from uuid import uuid4
+
+from sqlalchemy import select
+
+from config import CATEGORIES_CACHE_TTL
+from flaskr.responses import RawJSON, dumps
+from models import Category, db, notify_write, Question
+
+logger = logging.getLogger("flaskr.cache")
+
+
+class CacheBackend(ABC):
+    """Interface of the cache backends
+
+    Keys with an optional TTL, integer counters and a publish/subscribe
+    channel, shared by every worker for the backends where `shared` is
+    True.
+    """
+
+    hits = 0
+    misses = 0
+
+    def get(self, key):
+        """Value of a key, counted as a hit or a miss"""
+        value = self.peek(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    @abstractmethod
+    def peek(self, key):
+        """Value of a key, not counted in the hit ratio"""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        """Store a value, for ttl seconds when given"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Drop a key"""
+
+    @abstractmethod
+    def incr(self, key):
+        """Increment an integer key, returns its new value"""
+
+    @abstractmethod
+    def publish(self, channel, message):
+        """Send a message to the subscribers of a channel"""
+
+    @abstractmethod
+    def subscribe(self, channel, callback):
+        """Call callback(message) for each message of a channel"""
+
+    def after_fork(self):
+        """Reopen what a forked child can't share with its parent"""
+
+    def on_reconnect(self, callback):
+        """Call callback() after the subscriptions were down, the messages
+        published meanwhile are lost. Local messages never are."""
+
+
+class LocalCache(CacheBackend):
+    """In-process LRU cache with per-key TTL
+
+    Messages published are delivered to the subscribers of this process
+    only.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._subscribers = {}
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires_at = self._entries.get(key, (0, None))
+            self._entries[key] = (value + 1, expires_at)
+            self._entries.move_to_end(key)
+            return value + 1
+
+    def publish(self, channel, message):
+        for callback in self._subscribers.get(channel, []):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """Cache shared by every worker through a Redis server
+
+    Values are stored as JSON under `prefix`. Subscriptions are served
+    by a background thread of redis-py, restarted when it fails. Any
+    client with the redis-py interface works, e.g fakeredis in tests.
+    """
+
+    shared = True
+
+    # seconds between two attempts to subscribe again, doubled up to
+    # max_retry_delay while the server is unreachable
+    retry_delay = 0.5
+    max_retry_delay = 30
+
+    def __init__(self, client, prefix="trivia:"):
+        self.client = client
+        self.prefix = prefix
+        self._subscribers = {}
+        self._pubsub = None
+        self._thread = None
+        self._reconnect_callbacks = []
+        self._closed = False
+
+    def peek(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, message)
+
+    def subscribe(self, channel, callback):
+        callbacks = self._subscribers.setdefault(channel, [])
+        callbacks.append(callback)
+
+        if len(callbacks) == 1:
+            self._listen(channel)
+
+    def _listen(self, channel):
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+        callbacks = self._subscribers[channel]
+        self._pubsub.subscribe(**{
+            self.prefix + channel: lambda message: [
+                subscriber(_text(message["data"]))
+                for subscriber in callbacks
+            ]
+        })
+
+        if self._thread is None:
+            self._thread = self._pubsub.run_in_thread(
+                sleep_time=0.1,
+                daemon=True,
+                exception_handler=self._restart
+            )
+
+    def _resubscribe(self):
+        self._pubsub = None
+        self._thread = None
+        for channel in self._subscribers:
+            self._listen(channel)
+
+    def _restart(self, error, pubsub, thread):
+        """exception_handler of the listener thread: stop it and subscribe
+        again on a new connection once the server answers"""
+        thread.stop()
+        logger.warning("cache subscriptions lost, subscribing again: %r", error)
+
+        delay = self.retry_delay
+        while not self._closed:
+            try:
+                self._resubscribe()
+                break
+            except Exception as retry_error:
+                if self._pubsub is not None:
+                    self._pubsub.close()
+                logger.warning("cache subscriptions failed: %r", retry_error)
+                sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+        else:
+            return
+
+        for callback in self._reconnect_callbacks:
+            callback()
+
+    def on_reconnect(self, callback):
+        self._reconnect_callbacks.append(callback)
+
+    def after_fork(self):
+        """The listener thread of the parent is not running in a forked
+        child, subscribe again on a connection of the child"""
+        self._resubscribe()
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+
+def _text(data):
+    return data.decode() if isinstance(data, bytes) else data
+
+
+class SharedCache(CacheBackend):
+    """Cache backend chosen when the app is created"""
+
+    def __init__(self):
+        self.backend = LocalCache()
+        self.configured = False
+
+    def configure(self, backend):
+        self.backend = backend
+        self.configured = True
+
+    @property
+    def shared(self):
+        return self.backend.shared
+
+    @property
+    def hits(self):
+        return self.backend.hits
+
+    @property
+    def misses(self):
+        return self.backend.misses
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def peek(self, key):
+        return self.backend.peek(key)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def incr(self, key):
+        return self.backend.incr(key)
+
+    def publish(self, channel, message):
+        self.backend.publish(channel, message)
+
+    def subscribe(self, channel, callback):
+        self.backend.subscribe(channel, callback)
+
+    def on_reconnect(self, callback):
+        self.backend.on_reconnect(callback)
+
+    def after_fork(self):
+        self.backend.after_fork()
+
+
+def create_cache_backend(name, redis_url=None, max_entries=1024, prefix="trivia:"):
+    """Cache backend for the CACHE_BACKEND setting
+
+    Args:
+        name (str): "local" or "redis"
+        redis_url (str): url of the Redis server, for "redis"
+        max_entries (int): size of the LRU, for "local"
+        prefix (str): prefix of the Redis keys and channels
+    """
+    if name == "local":
+        return LocalCache(max_entries)
+
+    if name == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires: pip install redis")
+        return RedisCache(redis.Redis.from_url(redis_url), prefix)
+
+    raise ValueError(f"unknown cache backend: {name}")
+
+
+class WriteBroadcast:
+    """Replays the writes committed by a worker on every other worker
+
+    Registered as a write hook, it publishes each write to the cache
+    backend. The other workers receive it and run their own write hooks
+    (question index, search index, caches) as if the write was theirs.
+    """
+
+    channel = "writes"
+
+    def __init__(self):
+        self.origin = uuid4().hex
+        self.backend = None
+        self.app = None
+
+    def start(self, app, backend):
+        self.app = app
+        self.backend = backend
+        backend.subscribe(self.channel, self.receive)
+        backend.on_reconnect(self.resync)
+
+    def after_fork(self):
+        """Forked workers share the origin of their parent, each needs its
+        own to receive the writes of the others"""
+        self.origin = uuid4().hex
+
+    def on_write(self, table, action, record):
+        """models.on_write hook, registered as local only"""
+        if self.backend is not None:
+            self.backend.publish(self.channel, json.dumps({
+                "origin": self.origin,
+                "table": table,
+                "action": action,
+                "record": record
+            }))
+
+    def receive(self, message):
+        # an exception would stop the listener of every channel
+        try:
+            write = json.loads(message)
+
+            # our own writes already ran the hooks
+            if write["origin"] == self.origin:
+                return
+
+            with self.app.app_context():
+                notify_write(
+                    write["table"],
+                    write["action"],
+                    write["record"],
+                    remote=True
+                )
+        except Exception:
+            logger.exception("could not replay the write %s", message)
+
+    def resync(self):
+        """The writes of the other workers published while the
+        subscriptions were down are lost, reload the indexes and caches
+        they would have updated"""
+        categories_cache.invalidate()
+        try:
+            with self.app.app_context():
+                notify_write(Question.__tablename__, "import", {}, remote=True)
+        except Exception:
+            logger.exception("could not reload the indexes")
+
+
+class CategoryLookups:
+    """Lookups of a categories map entry, returned by _get()"""
+
+    def _get(self):
+        raise NotImplementedError
+
+    def mapping(self):
+        """dict: {"id": "type"} of every category"""
+        return self._get()["mapping"]
+
+    def fragment(self):
+        """RawJSON: the categories map already serialised"""
+        return self._get()["fragment"]
+
+    def type_of(self, category_id):
+        return self.mapping().get(str(category_id))
+
+    def id_of(self, category_type):
+        return self._get()["ids"].get(category_type)
+
+
+class LoadedCategories(CategoryLookups):
+    """A categories map entry loaded by one request"""
+
+    def __init__(self, entry):
+        self._entry = entry
+
+    def _get(self):
+        return self._entry
+
+
+class CategoriesCache(CategoryLookups):
+    """Categories map shared by the question and category endpoints
+
+    The {"id": "type"} map is loaded once, serialised once and served
+    until the TTL expires or a category is written. Requests arriving
+    while an expired map is reloaded get the expired one. A map loaded
+    across a category write is served to its request but not cached.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entry = None
+        # bumped by every invalidate(), a load that started before it
+        # may have read the categories of before the write
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    # (id, type) rows of every category, in id order
+    query = select(Category.id, Category.type).order_by(Category.id)
+
+    def _load(self):
+        # the entry outlives the request: a lagging replica would cache
+        # the categories of before a write, read them from the primary
+        return self._entry_of(
+            db.session.execute(self.query, bind_arguments={"bind": db.engine})
+        )
+
+    def _entry_of(self, rows):
+        categories = {
+            str(category_id): category_type
+            for category_id, category_type in rows
+        }
+        return {
+            "mapping": categories,
+            "ids": {
+                category_type: int(category_id)
+                for category_id, category_type in categories.items()
+            },
+            "fragment": RawJSON(dumps(categories)),
+            "expires_at": monotonic() + self.ttl
+        }
+
+    def _get(self):
+        entry = self._entry
+        if entry is None or entry["expires_at"] <= monotonic():
+            # an expired map is served while another request reloads it,
+            # after a category write (no entry) every request waits
+            if entry is not None and not self._lock.acquire(blocking=False):
+                self.stale_hits += 1
+                return entry
+            if entry is None:
+                self._lock.acquire()
+            try:
+                entry = self._entry
+                if entry is None or entry["expires_at"] <= monotonic():
+                    self.misses += 1
+                    generation = self.generation
+                    entry = self._load()
+                    if self.generation == generation:
+                        self._entry = entry
+                    return entry
+            finally:
+                self._lock.release()
+        self.hits += 1
+        return entry
+
+    def stale(self):
+        """True when the next lookup would reload the categories"""
+        entry = self._entry
+        return entry is None or entry["expires_at"] <= monotonic()
+
+    def fill(self, rows, generation):
+        """Cache (id, type) rows of `query` read by the caller, e.g. with
+        an async connection, unless a category was written since the
+        caller read `generation`
+
+        Returns:
+            LoadedCategories: the lookups of the rows
+        """
+        entry = self._entry_of(rows)
+        if self.generation == generation:
+            self._entry = entry
+        return LoadedCategories(entry)
+
+    def invalidate(self):
+        self.generation += 1
+        self._entry = None
+
+    def on_write(self, table, action, record):
+        """models.on_write hook dropping the cache on category writes"""
+        if table == Category.__tablename__:
+            self.invalidate()
+
+
+categories_cache = CategoriesCache(CATEGORIES_CACHE_TTL)
+shared_cache = SharedCache()
+write_broadcast = WriteBroadcast()
+
+
+def setup_cache(app, name, redis_url, max_entries, prefix):
+    """Pick the shared cache backend once per process and start the
+    write broadcast on it"""
+    if shared_cache.configured:
+        return
+
+    shared_cache.configure(
+        create_cache_backend(name, redis_url, max_entries, prefix)
+    )
+    write_broadcast.start(app, shared_cache)
@@ -0,0 +1,84 @@
+import click
+from flask.cli import AppGroup
+
+from flaskr.exporter import export_lines, export_rows
+from flaskr.importer import import_questions
+from flaskr.index import question_index
+from migrations import apply_migrations, applied_versions, MIGRATIONS
+from models import db
+
+index_cli = AppGroup("index", help="Manage the in-process question index.")
+
+
+@index_cli.command("rebuild")
+def rebuild_index():
+    """Reload the question index from the database"""
+    question_index.rebuild()
+    click.echo(f"Indexed {question_index.count()} questions")
+
+
+@index_cli.command("verify")
+def verify_index():
+    """Check the question index against the database"""
+    question_index.build()
+
+    if question_index.verify(repair=False):
+        click.echo("Question index is in sync with the database")
+    else:
+        raise click.ClickException("Question index is out of sync")
+
+
+db_cli = AppGroup("db", help="Manage the database schema.")
+
+
+@db_cli.command("upgrade")
+def upgrade_db():
+    """Create the missing tables and apply the pending schema migrations"""
+    db.create_all()
+    applied = apply_migrations(db.engine)
+
+    for version, description in applied:
+        click.echo(f"Applied {version}: {description}")
+
+    if not applied:
+        click.echo("Database schema is up to date")
+
+
+@db_cli.command("status")
+def db_status():
+    """List the schema migrations and whether they are applied"""
+    applied = applied_versions(db.engine)
+
+    for version, description, _ in MIGRATIONS:
+        state = "applied" if version in applied else "pending"
+        click.echo(f"{version} [{state}] {description}")
+
+
+@click.command("import-questions")
+@click.argument("source", type=click.File("rb"))
+@click.option(
+    "--format",
+    type=click.Choice(["jsonl", "csv"]),
+    help="Defaults to the file extension, jsonl for stdin."
+)
+def import_questions_command(source, format):
+    """Import questions from a JSON Lines or CSV file ('-' for stdin)"""
+    if format is None:
+        format = "csv" if source.name.endswith(".csv") else "jsonl"
+
+    report = import_questions(source, format)
+
+    for error in report["errors"]:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {report['imported']} questions, {report['failed']} failed")
+
+
+@click.command("export-questions")
+@click.argument("destination", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", type=click.Choice(["jsonl", "csv"]), default="jsonl")
+@click.option("--category", type=int, help="Only export this category id.")
+@click.option("--difficulty", type=int, help="Only export this difficulty.")
+def export_questions_command(destination, format, category, difficulty):
+    """Export questions as JSON Lines or CSV (stdout by default)"""
+    for line in export_lines(export_rows(category, difficulty), format):
+        destination.write(line)
@@ -0,0 +1,211 @@
+import asyncio
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+
+from config import COALESCE_CACHE_ENTRIES, COALESCE_STALE_SECONDS
+
+"""
+coalescing
+    concurrent identical reads of a worker share one computation. The
+    body of an ETagged read endpoint is kept per path: requests whose
+    ETag matches it are served without a query. The first request after
+    a write recomputes it; the concurrent requests for the same path wait
+    for that result, or get the previous body with its own ETag for up to
+    COALESCE_STALE_SECONDS after the write. The async views (flaskr.asgi)
+    share the bodies, their concurrent requests wait on the event loop.
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """One computation per key at a time: concurrent callers of a key
+    wait for it and share its result, or its exception"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self.joined = 0
+
+    def running(self, key):
+        return key in self._calls
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.joined += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = compute()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class AsyncSingleFlight:
+    """SingleFlight for the coroutines of an event loop: concurrent
+    callers of a key await the computation of the first one"""
+
+    def __init__(self):
+        self._calls = {}
+        self.joined = 0
+
+    def running(self, key):
+        return key in self._calls
+
+    async def do(self, key, compute):
+        call = self._calls.get(key)
+        if call is not None:
+            self.joined += 1
+            # a cancelled waiter must not cancel the computation
+            return await asyncio.shield(call)
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await compute()
+        except Exception as error:
+            call.set_exception(error)
+            # retrieved by the waiters, if any
+            call.exception()
+            raise
+        except BaseException:
+            call.cancel()
+            raise
+        finally:
+            del self._calls[key]
+
+        call.set_result(result)
+        return result
+
+
+class CoalescedResponses:
+    """Last body of each path of the conditional read endpoints
+
+    Entries are dicts with the etag and last_modified the body was
+    computed for, its status, body and headers. Only 200 responses are
+    kept, the least recently used paths are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries, stale_seconds):
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    @property
+    def coalesced(self):
+        """Requests that waited for the computation of another one"""
+        return self.flight.joined + self.async_flight.joined
+
+    def _cached(self, path, etag):
+        """The entry of a path for etag, or the previous one while etag
+        is being computed, None to compute it"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(path)
+            if entry["etag"] == etag:
+                self.hits += 1
+                return entry
+
+            if entry["stale_since"] is None:
+                entry["stale_since"] = monotonic()
+            key = (path, etag)
+            if (
+                (self.flight.running(key) or self.async_flight.running(key))
+                and monotonic() - entry["stale_since"] <= self.stale_seconds
+            ):
+                self.stale_hits += 1
+                return entry
+
+        return None
+
+    def _store(self, path, etag, last_modified, status, body, headers):
+        entry = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "status": status,
+            "body": body,
+            "headers": headers,
+            "stale_since": None,
+        }
+
+        with self._lock:
+            self.misses += 1
+            if status == 200:
+                self._entries[path] = entry
+                self._entries.move_to_end(path)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return entry
+
+    def get(self, path, etag, last_modified, compute):
+        """The entry of a path for the current data version
+
+        Args:
+            path (str): path and query string of the request
+            etag (str): ETag of the current data version
+            last_modified (datetime): Last-Modified of the current version
+            compute (callable): renders the response, returns
+                (status, body, headers)
+
+        Returns:
+            dict: the entry, computed for an older ETag when it is served
+            stale while another request recomputes it
+        """
+        entry = self._cached(path, etag)
+        if entry is not None:
+            return entry
+
+        def load():
+            return self._store(path, etag, last_modified, *compute())
+
+        return self.flight.do((path, etag), load)
+
+    async def get_async(self, path, etag, last_modified, compute):
+        """get() for the async views, compute is a coroutine function"""
+        entry = self._cached(path, etag)
+        if entry is not None:
+            return entry
+
+        async def load():
+            return self._store(path, etag, last_modified, *await compute())
+
+        return await self.async_flight.do((path, etag), load)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+coalesced_responses = CoalescedResponses(COALESCE_CACHE_ENTRIES, COALESCE_STALE_SECONDS)
@@ -0,0 +1,135 @@
+import gzip
+from collections import OrderedDict
+from threading import Lock
+
+from flask import request
+from werkzeug.http import parse_accept_header
+
+from config import (
+    COMPRESS_BROTLI_QUALITY,
+    COMPRESS_CACHE_ENTRIES,
+    COMPRESS_GZIP_LEVEL,
+    COMPRESS_MIN_SIZE
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+compression
+    gzip / brotli compression of the responses, negotiated with the
+    Accept-Encoding header of the client. Bodies smaller than
+    COMPRESS_MIN_SIZE are sent as they are, the compressed bodies of
+    ETagged responses (categories, question pages) are cached until the
+    data version changes their ETag.
+"""
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/csv", "text/html"}
+
+
+def negotiate(accept_encoding):
+    """Content encoding to use for an Accept-Encoding header, brotli
+    first, None for identity"""
+    accepted = parse_accept_header(accept_encoding)
+
+    if brotli is not None and accepted.quality("br"):
+        return "br"
+    if accepted.quality("gzip"):
+        return "gzip"
+    return None
+
+
+def compress_bytes(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class CompressedCache:
+    """LRU of compressed bodies, keyed by (ETag, path, encoding)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, body, encoding):
+        """The compressed body, compressed and stored on a miss"""
+        key = (*key, encoding)
+
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = compress_bytes(body, encoding)
+
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return compressed
+
+
+def compress(body, accept_encoding, cache_key=None):
+    """Compress a body for a client
+
+    Args:
+        body (bytes): the response body
+        accept_encoding (str): Accept-Encoding header of the request
+        cache_key (tuple): identifies the body, e.g (ETag, path), to reuse
+            its compressed bytes. None compresses every time
+
+    Returns:
+        tuple: (body, content encoding), the body as it is and None when
+        it is too small or the client does not accept compression
+    """
+    if not COMPRESS_MIN_SIZE or len(body) < COMPRESS_MIN_SIZE:
+        return body, None
+
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return body, None
+
+    if cache_key is not None:
+        return compressed_cache.get(cache_key, body, encoding), encoding
+    return compress_bytes(body, encoding), encoding
+
+
+def compress_response(response):
+    """after_request hook compressing the buffered responses"""
+    if (
+        not COMPRESS_MIN_SIZE
+        or response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    etag = response.headers.get("ETag")
+    body, encoding = compress(
+        response.get_data(),
+        request.headers.get("Accept-Encoding"),
+        (etag, request.full_path) if etag else None
+    )
+
+    if encoding is not None:
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+compressed_cache = CompressedCache(COMPRESS_CACHE_ENTRIES)
@@ -3,6 +3,7 @@ from random import randint
 
 categories_controller = Blueprint("categories", __name__)
 question_controller = Blueprint("questions", __name__)
+metrics_controller = Blueprint("metrics", __name__)
 
 
 def get_random_integer(length=0):
@@ -1,34 +1,42 @@
-from json import dumps, loads
-from flask import jsonify, request
+from json import loads
+from flask import abort, request
 
+from config import MAX_QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE
+from flaskr.cache import categories_cache
 from flaskr.controllers import categories_controller
+from flaskr.http_cache import conditional
+from flaskr.responses import json_response
+from models import db, format_question_row, QUESTION_COLUMNS
 from models import Category
 from models import Question
 
 
 @categories_controller.route('/categories')
+@conditional
 def fecth_categories():
     """Fetch all categories
 
     Returns:
         dict: a key-value {'id':'type'}
     """
-    all_categories = Category.query.all()
-    return {
-        "categories": {
-            Category.format(category)['id']:  Category.format(category)['type']
-            for category in all_categories
-        }
-    }
+    return json_response({"categories": categories_cache.fragment()})
 
 
 @categories_controller.route('/categories/<int:id>/questions')
+@conditional
 def get_by_category(id):
     """Get all questions given a category id
 
+    The category, its questions and their count are read in a single
+    query: categories LEFT JOIN questions with a COUNT(*) OVER () window.
+
     Args:
         id (int): category id
 
+    Query Args:
+        page (int, optional): page of questions, every question when omitted
+        limit (int, optional): questions per page, defaults to QUESTIONS_PER_PAGE
+
     Returns:
         result: {
             "questions": questions,
@@ -36,20 +44,37 @@ def get_by_category(id):
             "total_questions": total_questions
         }
     """
+    page = request.args.get("page", type=int)
+    limit = request.args.get("limit", type=int)
+
+    query = db.session.query(
+        Category.type,
+        db.func.count(Question.id).over(),
+        *QUESTION_COLUMNS
+    ).outerjoin(
+        Question, Question.category == Category.id
+    ).filter(
+        Category.id == id
+    ).order_by(Question.id)
+
+    if page is not None or limit is not None:
+        page = max(page or 1, 1)
+        limit = max(1, min(limit or QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE))
+        query = query.limit(limit).offset((page - 1) * limit)
 
-    # get the category type
-    current_category = Category.format(Category.query.get(id)).get("type")
+    rows = query.all()
 
-    # get all questions in the category
-    questions = Question.query.filter_by(category=id).all()
+    # unknown category or page past the last one
+    if not rows:
+        abort(404)
 
-    # get the questions count
-    total_questions = Question.query.filter_by(category=id).count()
+    current_category, total_questions = rows[0][:2]
 
-    # format the questions
+    # format the questions, an empty category joins a single NULL question
     questions = [
-        Question.format(question)
-        for question in questions
+        format_question_row(row[2:])
+        for row in rows
+        if row.id is not None
     ]
 
     result = {
@@ -57,7 +82,7 @@ def get_by_category(id):
         "current_category": current_category,
         "total_questions": total_questions
     }
-    return jsonify(result)
+    return json_response(result)
 
 
 @categories_controller.route("/categories", methods=["POST"])
@@ -93,11 +118,19 @@ def update_category(id):
 
     if category is None:
         return "Category does not exist", 404
-    
-    # update the category
-    new_category = Category(category_type)
-    new_category.id = id
-    new_category.update()
+
+    # category types are unique
+    duplicate = Category.query.filter(
+        Category.type == category_type,
+        Category.id != id
+    ).first()
+
+    if duplicate is not None:
+        return "Category already exists!", 400
+
+    # update the loaded row, update() commits then notifies the write
+    category.type = category_type
+    category.update()
     
     return "Category Updated Successfully", 200
     
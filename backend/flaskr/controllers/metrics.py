@@ -0,0 +1,36 @@
+from flask import current_app, jsonify
+
+from flaskr.controllers import metrics_controller
+from flaskr.metrics import pool_metrics, request_metrics
+
+
+@metrics_controller.route('/metrics')
+def fetch_metrics():
+    """Metrics of this worker in the Prometheus text format
+
+    Per route latency, SQL queries and response size histograms,
+    responses by status, cache hit ratios and connection pool usage.
+    """
+    return current_app.response_class(
+        request_metrics.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@metrics_controller.route('/metrics/pool')
+def fetch_pool_metrics():
+    """Connection pool usage of this worker
+
+    Returns:
+        json: {
+            "checkouts": 120,
+            "checkout_seconds_avg": 0.0004,
+            "checkout_seconds_max": 0.2,
+            "checked_out": 3,
+            "overflow": 0,
+            "overflow_checkouts": 2,
+            "timeouts": 0,
+            ...
+        }
+    """
+    return jsonify(pool_metrics.snapshot())
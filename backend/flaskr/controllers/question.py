@@ -4,31 +4,63 @@
 import json
 from flask import (
     abort,
+    current_app,
     jsonify,
-    request
+    request,
+    stream_with_context
 )
 
 from config import (
-    ERROR_OUT,
-    MAX_QUESTIONS_PER_PAGE,
     QUESTIONS_PER_PAGE,
+    SUGGEST_LIMIT,
+    SUGGEST_MAX_LIMIT,
 )
-from flaskr.controllers import (
-    get_random_integer,
-    question_controller
+from flaskr.cache import categories_cache
+from flaskr.controllers import question_controller
+from flaskr.http_cache import conditional
+from flaskr.exporter import export_lines, export_rows, MIMETYPES
+from flaskr.importer import import_questions, RowError, validate_row
+from flaskr.index import question_index
+from flaskr.quiz import (
+    fetch_question,
+    quiz_sessions,
+    select_random_question,
+    select_random_questions
 )
-from models import (
-    Category,
-    Question
+from flaskr.reads import (
+    check_page,
+    current_category_arg,
+    in_order,
+    questions_after,
+    questions_by_id,
+    questions_page,
+    questions_payload,
+    quiz_batch_request,
+    quiz_category_id,
+    quiz_request,
+    search_page,
+    search_payload,
+    search_request,
+    search_scope,
+    split_page
 )
+from flaskr.responses import json_response
+from flaskr.search import search_engine
+from flaskr.suggest import suggest_index
+from models import db, Question
+from replicas import replica_reads
 
 
 @question_controller.route('/questions')
+@conditional
 def fetch_questions():
     """Fetch Questions from the database and automatically paginate them.
 
     return 10 questions per page
 
+    Passing `after` (with an optional `limit`) switches to cursor
+    pagination, see fetch_questions_after
+
     Returns:
         object : jsonify dictionary of format 
 
@@ -41,37 +73,61 @@ def fetch_questions():
     """
     # get page number
     page_number = request.args.get("page", 1, int)
-    current_category = request.args.get("current_category")
+    current_category = current_category_arg(request.args.get("current_category"))
 
-    if current_category == 'null':
-        current_category = None
-
-    # flask_sqlalchemy.BaseQuery.paginate
-    # https: // flask-sqlalchemy.palletsprojects.com/en/2.x/api /?highlight = basequery
-    # paginate returns a generator
-    questions = Question.query.paginate(
-        page_number,
-        QUESTIONS_PER_PAGE,
-        ERROR_OUT,
-        MAX_QUESTIONS_PER_PAGE
-    )
-    categories = Category.query.all()
-    format_categories = {
-        str(Category.format(category)['id']): Category.format(category)['type']
-        for category in categories
-    }
+    if "after" in request.args:
+        return fetch_questions_after(
+            request.args.get("after"),
+            request.args.get("limit", QUESTIONS_PER_PAGE, int),
+            current_category
+        )
 
-    formatted_questions = [
-        Question.format(question)
-        for question in questions.items
-    ]
+    # the page and the total, with the checks of flask_sqlalchemy's paginate
+    rows, total = questions_page(page_number)
+    questions = db.session.execute(rows).all()
+    check_page(questions, page_number)
 
-    return jsonify({
+    return json_response(questions_payload(
+        questions,
+        current_category,
+        categories_cache.fragment(),
+        db.session.execute(total).scalar()
+    ))
+
+
+def fetch_questions_after(cursor, limit, current_category):
+    """Keyset pagination: the questions following a cursor, by id.
+
+    Each page is a `WHERE id > :cursor ORDER BY id LIMIT n` query, so deep
+    pages cost as much as the first one. The total comes from the
+    in-process question index instead of a COUNT(*).
+
+    Args:
+        cursor (str): `next_cursor` of the previous page, empty for the first
+        limit (int): page size, capped by MAX_QUESTIONS_PER_PAGE
+        current_category (str): echoed back to the client
+
+    Returns:
+        object : jsonify dictionary of format
+
+        {
         "questions": formatted_questions,
-        "current_category": current_category,
+        "current_category": 2,
         "categories": format_categories,
-        "total_questions": questions.total
-    })
+        "total_questions": 19,
+        "next_cursor": "cTo1" # None on the last page
+    }
+    """
+    statement, limit = questions_after(cursor, limit)
+    questions, next_cursor = split_page(db.session.execute(statement).all(), limit)
+
+    return json_response(questions_payload(
+        questions,
+        current_category,
+        categories_cache.fragment(),
+        question_index.count(),
+        next_cursor=next_cursor
+    ))
 
 
 @question_controller.route('/questions/<int:id>', methods=["DELETE"])
@@ -118,16 +174,35 @@ def create_question():
     answer = data.get('answer')
     
     if search_term:
-        return search_question(search_term, current_category)
+        search_term, search_answers, page, limit = search_request(data)
+        return search_question(
+            search_term,
+            current_category,
+            search_answers,
+            page,
+            limit
+        )
 
     
     elif question != None and answer != None and category != None and difficulty != None:
 
+        # the write hooks index the row once it is committed, a category
+        # or difficulty they can't read must not reach the database
+        try:
+            values = validate_row({
+                "question": question,
+                "answer": answer,
+                "category": category,
+                "difficulty": difficulty
+            })
+        except RowError as error:
+            return str(error), 400
+
         _question = Question(
-                question, 
-                answer,
-                category, 
-                difficulty
+                values["question"], 
+                values["answer"],
+                values["category"], 
+                values["difficulty"]
             )
 
         Question.insert(_question)   # create the question
@@ -136,97 +211,294 @@ def create_question():
     return "request object must have the following fields: question, answer, category, difficulty", 400
 
 
-def search_question(search_term, current_category):
-    # get the category
-    
-    category_id = None
+@question_controller.route('/questions/bulk', methods=["POST"])
+def bulk_import_questions():
+    """Import questions from a JSON Lines or CSV request body
 
-    if current_category == 'null':
-        current_category = None
-    else:
-        category_id = Category.query.filter_by(type=current_category).first().id
-    
-    # return empty if the category is not found
-    if search_term is None:
-        return jsonify({
-            "questions": [],
-            "current_category": current_category,
-            "total_questions": 0
-        })
+    The body is streamed: rows are validated as they are read and
+    inserted in batches. Send `Content-Type: text/csv` (or `?format=csv`)
+    for CSV with a header row, JSON Lines otherwise.
 
-    # category_id = category.id
-    questions_like = Question.question.like(f"%{search_term}%")
-    
-    # if category is not None, then get the id
-    if current_category != None:
-        questions = Question.query.filter_by(
-            category=category_id
-        ).filter(
-            questions_like
-        ).all()
-    else:
-        questions = Question.query.filter(
-            questions_like
-        ).all()
+    Returns:
+        json: {
+            "success": True,
+            "imported": 2,
+            "failed": 1,
+            "errors": [{"line": 3, "error": "missing fields: answer"}]
+        }
+    """
+    format = request.args.get("format")
+    if format is None:
+        format = "csv" if request.mimetype == "text/csv" else "jsonl"
 
-    
+    if format not in ("csv", "jsonl"):
+        abort(400)
 
-    questions_formatted = [
-        Question.format(question)
-        for question in questions
-    ]
+    # the lines are decoded one by one, an invalid byte fails its own line
+    report = import_questions(request.stream, format)
 
-    result = {
-        "questions": questions_formatted,
-        "current_category": current_category,
-        "total_questions": len(questions_formatted)
-    }
+    return jsonify({"success": True, **report})
+
+
+@question_controller.route('/questions/export')
+def export_questions():
+    """Stream every question as JSON Lines or CSV
+
+    Rows are read through a server-side cursor and written as they come,
+    memory stays flat whatever the size of the question bank.
+
+    Query Args:
+        format (str): "jsonl" (default) or "csv"
+        category (int, optional): only export this category
+        difficulty (int, optional): only export this difficulty
+
+    Returns:
+        response: the export, as an attachment
+    """
+    format = request.args.get("format", "jsonl")
+    category = request.args.get("category", type=int)
+    difficulty = request.args.get("difficulty", type=int)
+
+    if format not in MIMETYPES:
+        abort(400)
 
-    return jsonify(result)
+    lines = export_lines(export_rows(category, difficulty), format)
+
+    return current_app.response_class(
+        stream_with_context(lines),
+        mimetype=MIMETYPES[format],
+        headers={
+            "Content-Disposition": f"attachment; filename=questions.{format}"
+        }
+    )
+
+
+@question_controller.route('/questions/suggest')
+def suggest_questions():
+    """Type-ahead suggestions for the search box
+
+    The words are read from the in-process suggestion index, no SQL runs.
+
+    Query Args:
+        prefix (str): text typed so far, the last word is completed
+        limit (int, optional): most suggestions, defaults to SUGGEST_LIMIT
+
+    Returns:
+        result: {
+            "prefix": "what riv",
+            "suggestions": ["river", "rivers"],
+            "categories": [{"id": 4, "type": "History"}]
+        }
+    """
+    prefix = request.args.get("prefix")
+    if prefix is None:
+        abort(400)
+
+    limit = request.args.get("limit", SUGGEST_LIMIT, int)
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+
+    words, categories = suggest_index.suggest(prefix, limit)
+
+    return json_response({
+        "prefix": prefix,
+        "suggestions": words,
+        "categories": categories
+    })
+
+
+@replica_reads
+def search_question(search_term, current_category, search_answers=False,
+                    page=None, limit=None):
+    """Full-text search of the questions, best matches first
+
+    Matching is case-insensitive and every word of the term has to
+    prefix a word of the question (or of the answer with searchAnswers).
+
+    Args:
+        search_term (str): words to look for
+        current_category (str): category type to search in, 'null' for all
+        search_answers (bool): also search the answers
+        page (int): page of results, every result when None
+        limit (int): results per page, defaults to QUESTIONS_PER_PAGE
+
+    Returns:
+        result: {
+            "questions": questions,
+            "current_category": current_category,
+            "total_questions": total_questions
+        }
+    """
+    current_category, category_id = search_scope(
+        current_category,
+        categories_cache
+    )
+
+    # return empty if the category is not found
+    if search_term is None or (
+        current_category is not None and category_id is None
+    ):
+        return json_response(search_payload([], current_category, 0))
+
+    question_ids = search_engine.search(
+        search_term,
+        category_id,
+        search_answers
+    )
+    total_questions = len(question_ids)
+    question_ids = search_page(question_ids, page, limit)
+
+    # load the page of questions and keep the ranking order
+    rows = db.session.execute(
+        questions_by_id(question_ids)
+    ).all() if question_ids else []
+
+    return json_response(search_payload(
+        in_order(rows, question_ids),
+        current_category,
+        total_questions
+    ))
 
 
 @question_controller.route("/quizzes", methods=["POST"])
+@replica_reads
 def quizzes():
     """Generate a random question and when the questions list is exhusted, it would restart
 
+    Optional body fields pick the question by difficulty:
+        difficulty (int | list): a difficulty or a [min, max] band
+        strategy (str): "uniform" (default), "ramp" (harder every few
+            questions) or "adaptive" (harder as the answers get right)
+        answers (list): whether each previous answer was right, for
+            the adaptive strategy
+
     Returns:
         json: question object
     """
-    data = json.loads(request.data)
-    quiz_category = data.get("quiz_category")
+    category_id, previous_question_ids, sampling = quiz_request(
+        json.loads(request.data)
+    )
 
-    if  quiz_category == None or data.get("previous_questions") == None:
-        print("Wrong data format. 'quiz_category' objet must be specified!")
+    try:
+        question = select_random_question(
+            category_id,
+            previous_question_ids,
+            **sampling
+        )
+    except ValueError:
         abort(400)
-    else:
-        category_id = data["quiz_category"]["id"]
-        category_type = data["quiz_category"]["type"]
-    previous_question_ids = data["previous_questions"]
 
-    # get the questions by category
-    questions_by_category = []
+    # if the category does not contain any unseen question
+    if question is None:
+        return "This category does not have any question.", 404
 
-    if category_id == 0 and category_type == "ALL":
-        questions_by_category = Question.query.all()
-    else:
-        questions_by_category = Question.query.filter(
-            Question.category == category_id).all()
+    return json_response({
+        "question": question
+    })
+
+
+@question_controller.route("/quizzes/batch", methods=["POST"])
+@replica_reads
+def quizzes_batch():
+    """Generate `count` distinct random questions in one request
+
+    Takes the body of /quizzes (previous_questions, quiz_category and the
+    optional difficulty, strategy and answers) plus:
+        count (int): questions wanted, 10 by default, at most QUIZ_MAX_BATCH
 
-    # filter off the previous questions
-    questions = list(
-        filter(lambda x: x.id not in previous_question_ids,
-               questions_by_category or [])
+    Returns:
+        json: {
+            "questions": [question objects],
+            "total_questions": 10
+        }
+    """
+    category_id, previous_question_ids, count, sampling = quiz_batch_request(
+        json.loads(request.data)
     )
 
-    # generate random integer =<  len(questions)
-    if len(questions) != 0:
-        random_question_index = get_random_integer(len(questions))
-        random_question = Question.format(questions[random_question_index])
+    try:
+        questions = select_random_questions(
+            category_id,
+            previous_question_ids,
+            count,
+            **sampling
+        )
+    except ValueError:
+        abort(400)
 
-    # if the category does not contain any question
-    else:
+    # if the category does not contain any unseen question
+    if not questions:
         return "This category does not have any question.", 404
 
+    return json_response({
+        "questions": questions,
+        "total_questions": len(questions)
+    })
+
+
+@question_controller.route("/quizzes/sessions", methods=["POST"])
+def start_quiz_session():
+    """Start a server-side quiz session on a category
+
+    The server keeps the questions served by the session, the client
+    asks for the next question without resending previous_questions.
+
+    Returns:
+        json: {
+            "session_id": "l2H8...",
+            "total_questions": 5
+        }
+    """
+    data = json.loads(request.data)
+    quiz_category = data.get("quiz_category")
+
+    if quiz_category is None:
+        abort(400)
+
+    session_id, total_questions = quiz_sessions.start(
+        quiz_category_id(quiz_category)
+    )
+
     return jsonify({
-        "question": random_question
+        "session_id": session_id,
+        "total_questions": total_questions
     })
+
+
+@question_controller.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+@replica_reads
+def next_quiz_question(session_id):
+    """Serve the next question of a quiz session
+
+    Returns:
+        json: {
+            "question": question object,
+            "remaining_questions": 4
+        }
+    """
+    while True:
+        try:
+            question_id, remaining = quiz_sessions.next_question_id(session_id)
+        except KeyError:
+            abort(404)
+
+        if question_id is None:
+            return "This quiz session does not have any question left.", 404
+
+        # skip the questions deleted since the session started
+        question = fetch_question(question_id)
+        if question is not None:
+            break
+
+    return json_response({
+        "question": question,
+        "remaining_questions": remaining
+    })
+
+
+@question_controller.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+def end_quiz_session(session_id):
+    """End a quiz session before it expires"""
+    if not quiz_sessions.end(session_id):
+        abort(404)
+
+    return jsonify({"success": True})
@@ -0,0 +1,35 @@
+from config import ALLOWED_LIST
+
+"""
+cors
+    Access-Control headers of the /api/ responses, sent by the Flask app
+    (flaskr.set_access_controls, on top of flask_cors) and by the async
+    views (flaskr.asgi), which do not go through flask_cors.
+"""
+
+# credentials are allowed for the origins of ALLOWED_LIST only
+ALLOWED_ORIGIN_HEADERS = (
+    ("Access-Control-Allow-Credentials", "true"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+    ("Access-Control-Allow-Headers", "Cache-Control"),
+    ("Access-Control-Allow-Headers", "X-Requested-With"),
+    ("Access-Control-Allow-Headers", "Authorization"),
+    ("Access-Control-Allow-Methods", "GET, POST, OPTIONS, PUT, DELETE"),
+)
+
+
+def allowed_origin_headers(origin):
+    """Headers for a request from an origin of ALLOWED_LIST, an empty
+    list for any other origin"""
+    if str(origin) not in ALLOWED_LIST:
+        return []
+    return [("Access-Control-Allow-Origin", origin), *ALLOWED_ORIGIN_HEADERS]
+
+
+def access_control_headers(origin):
+    """Headers of an /api/ response: those of an allowed origin, else
+    what flask_cors sends for `origins: "*"` (the origin echoed back, `*`
+    without an Origin header)"""
+    return allowed_origin_headers(origin) or [
+        ("Access-Control-Allow-Origin", origin or "*")
+    ]
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from config import EXPORT_BATCH_SIZE
+from models import format_question_row, question_rows, Question
+
+EXPORT_FIELDS = ("id", "question", "answer", "category", "difficulty")
+
+MIMETYPES = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+def export_rows(category=None, difficulty=None, batch_size=EXPORT_BATCH_SIZE):
+    """Question rows in id order, read through a server-side cursor
+
+    Only batch_size rows are held in memory at a time, whatever the size
+    of the table.
+    """
+    query = question_rows()
+
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+
+    return query.order_by(Question.id).execution_options(
+        stream_results=True
+    ).yield_per(batch_size)
+
+
+def export_lines(rows, format):
+    """Serialise rows lazily, one line at a time
+
+    Args:
+        rows (iterable): question rows
+        format (str): "jsonl" or "csv" (with a header row)
+
+    Yields:
+        str: lines of the export
+    """
+    if format == "jsonl":
+        for row in rows:
+            yield json.dumps(format_question_row(row)) + "\n"
+        return
+
+    if format != "csv":
+        raise ValueError(f"unknown export format: {format}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line(EXPORT_FIELDS)
+    for row in rows:
+        yield line(row)
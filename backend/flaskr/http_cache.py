@@ -0,0 +1,151 @@
+from datetime import datetime, timezone
+from functools import wraps
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+from zlib import crc32
+
+from flask import current_app, request
+
+from config import DATA_VERSION_LOCAL_TTL, HTTP_CACHE_MAX_AGE
+from flaskr.coalescing import coalesced_responses
+from replicas import primary_reads
+
+
+class DataVersion:
+    """Counter bumped by every committed write
+
+    Responses of the read endpoints only depend on the data, so the
+    version (with the request path) identifies a payload. The boot id
+    keeps versions of different processes or restarts apart. Bound to a
+    shared cache backend, the counter lives in the backend and every
+    worker serves the same ETags. Otherwise the writes of other workers
+    are not counted, the ETags also change every local_ttl seconds.
+    """
+
+    version_key = "data-version"
+    modified_key = "data-version:modified"
+
+    def __init__(self, local_ttl=DATA_VERSION_LOCAL_TTL):
+        self.local_ttl = local_ttl
+        self._lock = Lock()
+        self.boot_id = uuid4().hex[:8]
+        self._counter = 0
+        self._last_modified = _now()
+        self.backend = None
+
+    def bind(self, backend):
+        """Keep the counter in a shared cache backend"""
+        self.backend = backend
+        self.boot_id = "shared"
+
+    def after_fork(self):
+        """Forked workers inherit the boot id of their parent but count
+        their own writes, each needs its own unless the counter is shared"""
+        if self.backend is None:
+            self.boot_id = uuid4().hex[:8]
+
+    @property
+    def counter(self):
+        if self.backend is not None:
+            return self.backend.peek(self.version_key) or 0
+        return self._counter
+
+    @property
+    def last_modified(self):
+        if self.backend is not None:
+            timestamp = self.backend.peek(self.modified_key)
+            if timestamp is not None:
+                return datetime.fromtimestamp(timestamp, timezone.utc)
+        return self._last_modified
+
+    def bump(self):
+        if self.backend is not None:
+            self.backend.incr(self.version_key)
+            self.backend.set(self.modified_key, _now().timestamp())
+            return
+
+        with self._lock:
+            self._counter += 1
+            self._last_modified = _now()
+
+    def on_write(self, table, action, record):
+        """models.on_write hook"""
+        self.bump()
+
+    def etag(self, key):
+        version = self.counter
+        if self.backend is None and self.local_ttl:
+            version = f"{version}.{int(monotonic() // self.local_ttl)}"
+        return f"{self.boot_id}-{version}-{crc32(key.encode()):08x}"
+
+
+def _now():
+    # http dates have a one second resolution
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def conditional(view):
+    """Serve a read endpoint with ETag / Last-Modified validators
+
+    A request whose If-None-Match still matches the data version gets a
+    304 without running the view. If-Modified-Since is not honoured,
+    http dates are too coarse to tell apart writes within a second.
+
+    The bodies go through coalesced_responses: concurrent requests of a
+    path run the view once, and may be served the body of the previous
+    data version, with its ETag, while it is recomputed.
+
+    The view reads from the primary. The ETag is the data version of the
+    primary, a body read from a lagging replica would be cached and
+    revalidated under it until the next write.
+    """
+    @wraps(view)
+    def conditional_view(*args, **kwargs):
+        etag = data_version.etag(request.full_path)
+        last_modified = data_version.last_modified
+
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            def render():
+                primary_reads()
+                response = current_app.make_response(view(*args, **kwargs))
+                return response.status_code, response.get_data(), list(response.headers)
+
+            entry = coalesced_responses.get(
+                request.full_path, etag, last_modified, render
+            )
+            if entry["status"] != 200:
+                return current_app.response_class(
+                    entry["body"], entry["status"], entry["headers"]
+                )
+
+            etag = entry["etag"]
+            last_modified = entry["last_modified"]
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.response_class(
+                    entry["body"], headers=entry["headers"]
+                )
+
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        set_cache_control(response)
+        return response
+
+    return conditional_view
+
+
+def set_cache_control(response):
+    """Let clients and proxies store the payload, revalidating it after
+    HTTP_CACHE_MAX_AGE seconds"""
+    response.cache_control.public = True
+    if HTTP_CACHE_MAX_AGE:
+        response.cache_control.max_age = HTTP_CACHE_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+
+
+data_version = DataVersion()
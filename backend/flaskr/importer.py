@@ -0,0 +1,151 @@
+import csv
+import json
+
+from config import IMPORT_BATCH_SIZE
+from flaskr.cache import categories_cache
+from models import db, notify_write, Question
+
+REQUIRED_FIELDS = ("question", "answer", "category", "difficulty")
+DIFFICULTIES = range(1, 6)
+
+# errors listed in the report, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class RowError(ValueError):
+    """A row of the import that can't be inserted"""
+
+
+def read_rows(lines, format):
+    """Parse an import stream lazily
+
+    Args:
+        lines (iterable): lines of the stream, text or UTF-8 bytes decoded
+            one line at a time
+        format (str): "jsonl" (one JSON object per line) or "csv" (with a
+            header row)
+
+    Yields:
+        tuple: (line number, parsed row or the RowError raised parsing it).
+        A CSV stream that can't be decoded or split into records ends
+        with a RowError, the lines following it are not read
+    """
+    if format == "csv":
+        reader = csv.DictReader(decode_line(line) for line in lines)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as error:
+            yield reader.line_num, RowError(f"invalid CSV: {error}")
+        except UnicodeDecodeError as error:
+            yield reader.line_num + 1, RowError(
+                f"invalid UTF-8, the following lines were not read: {error.reason}"
+            )
+        return
+
+    if format != "jsonl":
+        raise ValueError(f"unknown import format: {format}")
+
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            line = decode_line(line)
+        except UnicodeDecodeError as error:
+            yield line_number, RowError(f"invalid UTF-8: {error.reason}")
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, RowError(f"invalid JSON: {error}")
+
+
+def decode_line(line):
+    return line.decode("utf-8") if isinstance(line, bytes) else line
+
+
+def validate_row(row):
+    """Check a parsed row and build the values to insert
+
+    category can be a category id or type.
+
+    Raises:
+        RowError: the row is not a valid question
+    """
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError("a row must be an object")
+
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, "")]
+    if missing:
+        raise RowError(f"missing fields: {', '.join(missing)}")
+
+    category = str(row["category"]).strip()
+    if categories_cache.type_of(category) is not None:
+        category_id = int(category)
+    else:
+        category_id = categories_cache.id_of(category)
+    if category_id is None:
+        raise RowError(f"unknown category: {category}")
+
+    try:
+        difficulty = int(row["difficulty"])
+    except (TypeError, ValueError):
+        difficulty = None
+    if difficulty not in DIFFICULTIES:
+        raise RowError(f"difficulty must be between 1 and 5: {row['difficulty']}")
+
+    return {
+        "question": str(row["question"]),
+        "answer": str(row["answer"]),
+        "category": category_id,
+        "difficulty": difficulty
+    }
+
+
+def import_questions(lines, format, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and insert questions from a stream in batches
+
+    Rows are validated as they are read and inserted batch_size at a time
+    with a single executemany per batch, committed batch by batch. The
+    write hooks (indexes, caches) are notified once, at the end.
+
+    Returns:
+        dict: {"imported": 2, "failed": 1, "errors": [{"line": 3, "error": "..."}]}
+    """
+    report = {"imported": 0, "failed": 0, "errors": []}
+    batch = []
+
+    def flush():
+        db.session.execute(Question.__table__.insert(), batch)
+        db.session.commit()
+        report["imported"] += len(batch)
+        batch.clear()
+
+    try:
+        for line_number, row in read_rows(lines, format):
+            try:
+                batch.append(validate_row(row))
+            except RowError as error:
+                report["failed"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append(
+                        {"line": line_number, "error": str(error)}
+                    )
+                continue
+
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    finally:
+        if report["imported"]:
+            notify_write(
+                Question.__tablename__,
+                "import",
+                {"imported": report["imported"]}
+            )
+
+    return report
@@ -0,0 +1,198 @@
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from models import db, Question
+
+
+def to_category_id(category):
+    """Normalise a category value (int, '4', None) to an int key"""
+    if category is None or category == "":
+        return None
+    return int(category)
+
+
+def to_difficulty(difficulty):
+    """Normalise a difficulty value (int, '4', None) to an int key"""
+    if difficulty is None or difficulty == "":
+        return None
+    return int(difficulty)
+
+
+class QuestionIndex:
+    """In-process index of question ids per category
+
+    Every category maps to a sorted array of question ids so counts and
+    id lists are served without SQL, and every (category, difficulty)
+    bucket to the ids of its questions for the quiz sampler. Writes
+    replace the arrays instead of mutating them, readers always see a
+    consistent snapshot.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._by_category = {}
+        self._by_bucket = {}
+        self._all = array("i")
+        self._verified_at = 0
+        self.ready = False
+
+    def build(self):
+        """(Re)load the index from the database"""
+        by_category = {}
+        by_bucket = {}
+        all_ids = array("i")
+
+        rows = db.session.query(
+            Question.id,
+            Question.category,
+            Question.difficulty
+        ).order_by(Question.id)
+
+        for question_id, category, difficulty in rows:
+            category_id = to_category_id(category)
+            all_ids.append(question_id)
+            by_category.setdefault(category_id, array("i")).append(question_id)
+            by_bucket.setdefault(
+                (category_id, to_difficulty(difficulty)), array("i")
+            ).append(question_id)
+
+        with self._lock:
+            self._by_category = by_category
+            self._by_bucket = by_bucket
+            self._all = all_ids
+            self.ready = True
+
+    rebuild = build
+
+    def ids(self, category_id=None):
+        """Sorted question ids of a category, every question when None"""
+        if category_id is None:
+            return self._all
+        return self._by_category.get(to_category_id(category_id), array("i"))
+
+    def buckets(self, category_id=None):
+        """{(category id, difficulty): sorted question ids} of a category,
+        of every category when None"""
+        buckets = self._by_bucket
+        if category_id is None:
+            return dict(buckets)
+        category_id = to_category_id(category_id)
+        return {
+            key: ids
+            for key, ids in buckets.items()
+            if key[0] == category_id
+        }
+
+    def count(self, category_id=None):
+        return len(self.ids(category_id))
+
+    def counts(self):
+        """Number of questions per category id"""
+        return {
+            category_id: len(ids)
+            for category_id, ids in self._by_category.items()
+        }
+
+    def add(self, question_id, category, difficulty=None):
+        category_id = to_category_id(category)
+        bucket = (category_id, to_difficulty(difficulty))
+
+        with self._lock:
+            self._all = _with_id(self._all, question_id)
+            self._by_category[category_id] = _with_id(
+                self._by_category.get(category_id, array("i")), question_id
+            )
+            self._by_bucket[bucket] = _with_id(
+                self._by_bucket.get(bucket, array("i")), question_id
+            )
+
+    def remove(self, question_id):
+        with self._lock:
+            self._all = _without_id(self._all, question_id)
+
+            for groups in (self._by_category, self._by_bucket):
+                for key, ids in list(groups.items()):
+                    position = bisect_left(ids, question_id)
+                    if position < len(ids) and ids[position] == question_id:
+                        groups[key] = _without_id(ids, question_id)
+
+    def verify(self, repair=True):
+        """Compare the question ids of every category with the database
+
+        Other workers write to the same database, call this periodically
+        (or `flask index verify`) to detect and repair drift.
+
+        Returns:
+            bool: True when the index matches the database
+        """
+        rows = db.session.query(
+            Question.id,
+            Question.category
+        ).order_by(Question.id)
+
+        expected = {}
+        for question_id, category in rows:
+            expected.setdefault(to_category_id(category), array("i")).append(question_id)
+
+        actual = {
+            category_id: ids
+            for category_id, ids in self._by_category.items()
+            if ids
+        }
+        in_sync = expected == actual
+
+        if not in_sync and repair:
+            self.build()
+
+        self._verified_at = monotonic()
+        return in_sync
+
+    def verify_due(self, interval):
+        """True when the last verify() is `interval` seconds old, never
+        when interval is 0"""
+        return bool(interval) and monotonic() - self._verified_at >= interval
+
+    def verify_if_due(self, interval):
+        """verify() at most once every `interval` seconds, 0 disables it"""
+        if self.verify_due(interval):
+            self.verify()
+
+    def on_write(self, table, action, record):
+        """models.on_write hook keeping the index consistent"""
+        if table == Question.__tablename__:
+            if action == "import":
+                self.build()
+            if action in ("update", "delete"):
+                self.remove(record["id"])
+            if action in ("insert", "update"):
+                self.add(
+                    record["id"],
+                    record["category"],
+                    record.get("difficulty")
+                )
+
+        # deleting a category detaches its questions in the database
+        elif action == "delete":
+            self.build()
+
+
+def _with_id(ids, question_id):
+    ids = array("i", ids)
+    position = bisect_left(ids, question_id)
+    if position == len(ids) or ids[position] != question_id:
+        ids.insert(position, question_id)
+    return ids
+
+
+def _without_id(ids, question_id):
+    position = bisect_left(ids, question_id)
+    if position == len(ids) or ids[position] != question_id:
+        return ids
+    ids = array("i", ids)
+    del ids[position]
+    return ids
+
+
+question_index = QuestionIndex()
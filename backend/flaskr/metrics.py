@@ -0,0 +1,356 @@
+import logging
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+slow_request_logger = logging.getLogger("flaskr.slow_requests")
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class PoolMetrics:
+    """Counters of the connection pool checkouts"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.pool = None
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.checkout_seconds_max = 0.0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+
+    def record_checkout(self, seconds, opened_overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+            if opened_overflow:
+                self.overflow_checkouts += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        """Counters and the current state of the pool"""
+        pool = self.pool
+        return {
+            "checkouts": self.checkouts,
+            "checkout_seconds_total": self.checkout_seconds,
+            "checkout_seconds_max": self.checkout_seconds_max,
+            "checkout_seconds_avg": (
+                self.checkout_seconds / self.checkouts if self.checkouts else 0.0
+            ),
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "size": pool.size() if pool is not None else 0,
+            "checked_in": pool.checkedin() if pool is not None else 0,
+            "checked_out": pool.checkedout() if pool is not None else 0,
+            "overflow": max(pool.overflow(), 0) if pool is not None else 0,
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool timing how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool_metrics.pool = self
+
+    def _do_get(self):
+        start = perf_counter()
+        overflow = self.overflow()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_timeout()
+            raise
+
+        # QueuePool counts every connection it opens in overflow(), from
+        # -pool_size up, the ones opened past pool_size are the overflow
+        opened = self.overflow()
+        pool_metrics.record_checkout(
+            perf_counter() - start, opened > overflow and opened > 0
+        )
+        return connection
+
+
+def engine_options(database_uri, pool_size, max_overflow, pool_timeout,
+                   pool_recycle, pool_pre_ping, statement_timeout,
+                   instrumented=True):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured pool
+
+    SQLite keeps the SQLAlchemy default pool, its connections can't be
+    shared between threads.
+
+    Args:
+        statement_timeout (int): milliseconds, Postgres only, 0 disables it
+        instrumented (bool): report the pool in pool_metrics, the primary
+            pool only
+    """
+    options = {"pool_pre_ping": pool_pre_ping}
+
+    if database_uri.startswith("sqlite"):
+        return options
+
+    options.update({
+        "poolclass": InstrumentedQueuePool if instrumented else QueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+    })
+
+    if statement_timeout and database_uri.startswith("postgres"):
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={statement_timeout}"
+        }
+
+    return options
+
+
+class Histogram:
+    """Prometheus style histogram: cumulative buckets, sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestMetrics:
+    """Per-route latency, SQL queries and response sizes of a worker"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.latency = {}
+        self.queries = {}
+        self.query_seconds = {}
+        self.response_bytes = {}
+        self.responses = {}
+        self.caches = {}
+
+    def register_cache(self, name, cache):
+        """Report the hits and misses of a cache (any object with
+        `hits` and `misses` counters)"""
+        self.caches[name] = cache
+
+    def record(self, route, method, status, seconds, statements, size):
+        key = (route, method)
+        with self._lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(
+                len(statements)
+            )
+            self.query_seconds[key] = self.query_seconds.get(key, 0) + sum(
+                duration for _, duration in statements
+            )
+            if size is not None:
+                self.response_bytes.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+            status_key = (route, method, str(status))
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help, histograms):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for (route, method), values in sorted(histograms.items()):
+                labels = f'route="{route}",method="{method}"'
+                for bound, total in values.samples():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f"{name}_sum{{{labels}}} {values.sum}")
+                lines.append(f"{name}_count{{{labels}}} {values.count}")
+
+        def metric(name, type, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}{labels} {value}")
+
+        with self._lock:
+            histogram(
+                "trivia_request_duration_seconds",
+                "Time spent serving requests.",
+                self.latency
+            )
+            metric(
+                "trivia_responses_total", "counter", "Responses sent.",
+                [
+                    (f'route="{route}",method="{method}",status="{status}"', total)
+                    for (route, method, status), total in sorted(self.responses.items())
+                ]
+            )
+            histogram(
+                "trivia_sql_queries_per_request",
+                "SQL statements executed per request.",
+                self.queries
+            )
+            metric(
+                "trivia_sql_duration_seconds_total", "counter",
+                "Time spent executing SQL statements.",
+                [
+                    (f'route="{route}",method="{method}"', seconds)
+                    for (route, method), seconds in sorted(self.query_seconds.items())
+                ]
+            )
+            histogram(
+                "trivia_response_size_bytes",
+                "Size of the response bodies.",
+                self.response_bytes
+            )
+
+        caches = sorted(self.caches.items())
+        metric(
+            "trivia_cache_hits_total", "counter", "Cache lookups served from the cache.",
+            [(f'cache="{name}"', cache.hits) for name, cache in caches]
+        )
+        metric(
+            "trivia_cache_misses_total", "counter", "Cache lookups that missed.",
+            [(f'cache="{name}"', cache.misses) for name, cache in caches]
+        )
+        metric(
+            "trivia_cache_stale_hits_total", "counter",
+            "Lookups served an expired value while it was recomputed.",
+            [
+                (f'cache="{name}"', cache.stale_hits)
+                for name, cache in caches
+                if hasattr(cache, "stale_hits")
+            ]
+        )
+        metric(
+            "trivia_cache_coalesced_total", "counter",
+            "Lookups that waited for the computation of a concurrent one.",
+            [
+                (f'cache="{name}"', cache.coalesced)
+                for name, cache in caches
+                if hasattr(cache, "coalesced")
+            ]
+        )
+        metric(
+            "trivia_cache_hit_ratio", "gauge", "Hits over lookups of the caches.",
+            [
+                (f'cache="{name}"', cache.hits / (cache.hits + cache.misses))
+                for name, cache in caches
+                if cache.hits + cache.misses
+            ]
+        )
+
+        pool = pool_metrics.snapshot()
+        metric(
+            "trivia_db_pool_checkouts_total", "counter",
+            "Connections checked out of the pool.",
+            [("", pool["checkouts"])]
+        )
+        metric(
+            "trivia_db_pool_checkout_seconds_total", "counter",
+            "Time spent waiting for a pool connection.",
+            [("", pool["checkout_seconds_total"])]
+        )
+        metric(
+            "trivia_db_pool_overflow_checkouts_total", "counter",
+            "Checkouts that opened an overflow connection.",
+            [("", pool["overflow_checkouts"])]
+        )
+        metric(
+            "trivia_db_pool_timeouts_total", "counter",
+            "Checkouts that timed out waiting for a connection.",
+            [("", pool["timeouts"])]
+        )
+        metric(
+            "trivia_db_pool_checked_out", "gauge", "Connections in use.",
+            [("", pool["checked_out"])]
+        )
+        metric(
+            "trivia_db_pool_overflow", "gauge", "Overflow connections open.",
+            [("", pool["overflow"])]
+        )
+
+        return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - conn.info["statement_start"].pop()
+    if has_request_context() and "sql_statements" in g:
+        g.sql_statements.append((statement, duration))
+
+
+def instrument_app(app, slow_request_seconds):
+    """Record the metrics of every request of the app
+
+    Requests slower than slow_request_seconds are logged with the SQL
+    statements they executed, 0 disables the log.
+    """
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = perf_counter()
+        g.sql_statements = []
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "request_start" not in g:
+            return response
+
+        seconds = perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        size = None if response.is_streamed else response.calculate_content_length()
+
+        request_metrics.record(
+            route,
+            request.method,
+            response.status_code,
+            seconds,
+            g.sql_statements,
+            size
+        )
+
+        if slow_request_seconds and seconds >= slow_request_seconds:
+            slow_request_logger.warning(
+                "%s %s took %.3fs, %d queries:\n%s",
+                request.method,
+                request.full_path,
+                seconds,
+                len(g.sql_statements),
+                "\n".join(
+                    f"  {duration * 1000:.1f}ms {statement}"
+                    for statement, duration in g.sql_statements
+                )
+            )
+
+        return response
+
+
+pool_metrics = PoolMetrics()
+request_metrics = RequestMetrics()
@@ -0,0 +1,31 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+
+CURSOR_PREFIX = "q:"
+
+
+def encode_cursor(question_id):
+    """Opaque cursor pointing after the given question id"""
+    token = f"{CURSOR_PREFIX}{question_id}".encode()
+    return urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Question id encoded in a cursor, 0 for an empty cursor
+
+    Raises:
+        ValueError: the cursor was not produced by encode_cursor
+    """
+    if not cursor:
+        return 0
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        token = urlsafe_b64decode(cursor + padding).decode()
+    except (DecodeError, UnicodeDecodeError):
+        raise ValueError(f"invalid cursor: {cursor}")
+
+    if not token.startswith(CURSOR_PREFIX):
+        raise ValueError(f"invalid cursor: {cursor}")
+
+    return int(token[len(CURSOR_PREFIX):])
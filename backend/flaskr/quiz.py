@@ -0,0 +1,319 @@
+from collections import OrderedDict
+from random import choice, randrange
+from secrets import token_urlsafe
+from threading import Lock
+from time import monotonic
+
+from config import QUIZ_MAX_SESSIONS, QUIZ_SESSION_TTL
+from flaskr.index import question_index
+from flaskr.sampling import (
+    parse_difficulty,
+    sample_question_id,
+    STRATEGIES,
+    target_difficulty
+)
+from models import format_question_row, question_rows, Question
+from replicas import primary_reads
+
+# how many random draws to try before falling back to a set difference
+MAX_REJECTION_DRAWS = 8
+
+
+def pick_question_id(question_ids, previous_question_ids):
+    """Pick a random id that is not one of the previous questions
+
+    Few previous questions compared to the pool: draw at random and reject
+    the seen ids (expected O(1)). Otherwise fall back to a set difference.
+
+    Args:
+        question_ids (sequence): candidate question ids
+        previous_question_ids (iterable): ids already served to the player
+
+    Returns:
+        int: a question id or None when every question has been seen
+    """
+    if not question_ids:
+        return None
+
+    excluded = set(previous_question_ids or [])
+
+    if len(excluded) * 2 < len(question_ids):
+        for _ in range(MAX_REJECTION_DRAWS):
+            question_id = question_ids[randrange(len(question_ids))]
+            if question_id not in excluded:
+                return question_id
+
+    remaining = [
+        question_id
+        for question_id in question_ids
+        if question_id not in excluded
+    ]
+
+    return choice(remaining) if remaining else None
+
+
+def pick_quiz_question_id(category_id, previous_question_ids,
+                          difficulty=None, strategy=None, answers=None):
+    """Pick the next unseen question id of a quiz
+
+    Without difficulty and strategy every question is equally likely
+    (pick_question_id), otherwise see flaskr.sampling.
+
+    Args:
+        category_id (int): category id. None means every category
+        previous_question_ids (list): ids already served to the player
+        difficulty (int | list): a difficulty or a [min, max] band
+        strategy (str): "uniform", "ramp" (harder every few questions) or
+            "adaptive" (harder as the recent answers get right)
+        answers (list): whether each previous answer was right, oldest
+            first, for the adaptive strategy
+
+    Returns:
+        int: a question id or None when the quiz is exhausted
+
+    Raises:
+        ValueError: invalid difficulty, strategy or answers
+    """
+    if strategy not in (None, *STRATEGIES):
+        raise ValueError(f"unknown strategy: {strategy}")
+    if answers is not None and not isinstance(answers, list):
+        raise ValueError("answers must be a list")
+
+    band = parse_difficulty(difficulty)
+
+    if band is None and strategy in (None, "uniform"):
+        return pick_question_id(
+            question_index.ids(category_id),
+            previous_question_ids
+        )
+
+    return sample_question_id(
+        category_id,
+        previous_question_ids,
+        band,
+        target_difficulty(strategy, previous_question_ids, answers)
+    )
+
+
+def select_random_question(category_id, previous_question_ids, **sampling):
+    """Select a random unseen question in a category
+
+    The question is chosen from the in-process index and its columns are
+    read with a single primary-key lookup.
+
+    Args:
+        category_id (int): category id. None means every category
+        previous_question_ids (list): ids already served to the player
+        sampling: difficulty, strategy and answers of pick_quiz_question_id
+
+    Returns:
+        dict: the formatted question or None when the category is exhausted
+
+    Raises:
+        ValueError: invalid sampling options
+    """
+    question_id = pick_quiz_question_id(
+        category_id,
+        previous_question_ids,
+        **sampling
+    )
+
+    if question_id is None:
+        return None
+
+    return fetch_question(question_id)
+
+
+def pick_quiz_question_ids(category_id, previous_question_ids, count,
+                           **sampling):
+    """Pick up to `count` distinct unseen question ids
+
+    The ids are picked one after the other, each pick joining the
+    excluded ids (and moving the ramp strategy along).
+
+    Returns:
+        list: question ids, fewer than count when the quiz runs out
+
+    Raises:
+        ValueError: invalid sampling options
+    """
+    seen = list(previous_question_ids)
+    picked = []
+
+    for _ in range(count):
+        question_id = pick_quiz_question_id(category_id, seen, **sampling)
+        if question_id is None:
+            break
+        seen.append(question_id)
+        picked.append(question_id)
+
+    return picked
+
+
+def select_random_questions(category_id, previous_question_ids, count,
+                            **sampling):
+    """Select up to `count` distinct random unseen questions
+
+    The ids are picked from the in-process index and the questions are
+    read with a single query.
+
+    Args:
+        category_id (int): category id. None means every category
+        previous_question_ids (list): ids already served to the player
+        count (int): number of questions wanted
+        sampling: difficulty, strategy and answers of pick_quiz_question_id
+
+    Returns:
+        list: formatted questions in the order they were picked, fewer
+        than count when the category runs out
+
+    Raises:
+        ValueError: invalid sampling options
+    """
+    picked = pick_quiz_question_ids(
+        category_id,
+        previous_question_ids,
+        count,
+        **sampling
+    )
+
+    if not picked:
+        return []
+
+    questions = {
+        row.id: format_question_row(row)
+        for row in question_rows().filter(Question.id.in_(picked))
+    }
+
+    missing = [question_id for question_id in picked if question_id not in questions]
+    if missing and primary_reads():
+        questions.update(
+            (row.id, format_question_row(row))
+            for row in question_rows().filter(Question.id.in_(missing))
+        )
+
+    # skip the questions deleted since the index was read
+    return [
+        questions[question_id]
+        for question_id in picked
+        if question_id in questions
+    ]
+
+
+def fetch_question(question_id):
+    """Formatted question read by primary key, None if it was deleted"""
+    row = question_rows().filter(Question.id == question_id).first()
+
+    # the index follows the primary, a lagging replica may miss the row
+    if row is None and primary_reads():
+        row = question_rows().filter(Question.id == question_id).first()
+
+    return format_question_row(row) if row is not None else None
+
+
+class QuizSession:
+    """Question ids of a category drawn without replacement
+
+    A lazy Fisher-Yates shuffle of the ids the category had when the
+    session started: the array is shared with the question index, only
+    the swapped positions are kept, so a draw is O(1) and a session holds
+    a few bytes per question served. Each session has its own lock.
+    """
+
+    __slots__ = ("category_id", "question_ids", "swaps", "served", "expires_at", "lock")
+
+    def __init__(self, category_id, question_ids, expires_at):
+        self.category_id = category_id
+        self.question_ids = question_ids
+        self.swaps = {}
+        self.served = 0
+        self.expires_at = expires_at
+        self.lock = Lock()
+
+    def next_question_id(self):
+        """(question id or None once exhausted, questions remaining)"""
+        with self.lock:
+            total = len(self.question_ids)
+            if self.served >= total:
+                return None, 0
+
+            # swap a random remaining position with the first remaining one
+            position = randrange(self.served, total)
+            picked = self.swaps.pop(position, position)
+            if position != self.served:
+                self.swaps[position] = self.swaps.pop(self.served, self.served)
+            self.served += 1
+
+            return self.question_ids[picked], total - self.served
+
+
+class QuizSessions:
+    """Server-side quiz sessions
+
+    A session draws the questions of its category in a random order
+    (QuizSession), so the client no longer sends previous_questions and
+    no query runs to pick a question. The questions created after a
+    session started are not part of it, the deleted ones are skipped by
+    the view. Sessions expire `ttl` seconds after their last use and at
+    most `max_sessions` are kept, the least recently used are dropped
+    first. The global lock only guards the session table.
+    """
+
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = Lock()
+        self._sessions = OrderedDict()
+
+    def start(self, category_id=None):
+        """Open a session on a category, every category when None
+
+        Returns:
+            tuple: (session id, number of questions in the session)
+        """
+        session_id = token_urlsafe(16)
+        question_ids = question_index.ids(category_id)
+
+        with self._lock:
+            self._evict()
+            self._sessions[session_id] = QuizSession(
+                category_id, question_ids, monotonic() + self.ttl
+            )
+
+        return session_id, len(question_ids)
+
+    def next_question_id(self, session_id):
+        """Pick the next question id of a session
+
+        Returns:
+            tuple: (question id or None once exhausted, questions remaining)
+
+        Raises:
+            KeyError: unknown or expired session
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions[session_id]
+            self._sessions.move_to_end(session_id)
+            session.expires_at = monotonic() + self.ttl
+
+        return session.next_question_id()
+
+    def end(self, session_id):
+        """Close a session, returns False if it did not exist"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict(self):
+        now = monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now and len(self._sessions) < self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+quiz_sessions = QuizSessions(QUIZ_SESSION_TTL, QUIZ_MAX_SESSIONS)
@@ -0,0 +1,227 @@
+from flask import abort
+from sqlalchemy import func, select
+
+from config import (
+    ERROR_OUT,
+    MAX_QUESTIONS_PER_PAGE,
+    QUESTIONS_PER_PAGE,
+    QUIZ_MAX_BATCH
+)
+from flaskr.pagination import decode_cursor, encode_cursor
+from models import format_question_row, Question, QUESTION_COLUMNS
+
+"""
+reads
+    arguments, statements and payloads of the read endpoints, shared by
+    the Flask views (flaskr.controllers) and the async views (flaskr.asgi)
+    so both serving modes answer alike. The views run the statements on
+    their own connection: the routing session of the Flask app, or the
+    async engine. Invalid arguments abort with a 400 or a 404, the async
+    views hand those requests over to the Flask app.
+"""
+
+# questions per page of GET /api/questions, capped like paginate does
+QUESTIONS_PAGE_SIZE = min(QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE)
+
+
+def is_positive_int(value):
+    """True for an int of at least 1 read from a JSON body, booleans are
+    not numbers"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def current_category_arg(current_category):
+    """The current_category argument, None for 'null'"""
+    return None if current_category == "null" else current_category
+
+
+def page_size(limit=None):
+    """Questions per page for a requested limit, QUESTIONS_PER_PAGE by
+    default and at most MAX_QUESTIONS_PER_PAGE"""
+    if limit is None:
+        limit = QUESTIONS_PER_PAGE
+    return max(1, min(limit, MAX_QUESTIONS_PER_PAGE))
+
+
+def questions_page(page_number):
+    """Statements of a page of GET /api/questions, with the checks of
+    flask_sqlalchemy's paginate
+
+    Returns:
+        tuple: (rows of the page, total number of questions)
+    """
+    if page_number < 1 and ERROR_OUT:
+        abort(404)
+    page_number = max(page_number, 1)
+
+    rows = select(*QUESTION_COLUMNS).order_by(Question.id).limit(
+        QUESTIONS_PAGE_SIZE
+    ).offset((page_number - 1) * QUESTIONS_PAGE_SIZE)
+
+    return rows, select(func.count()).select_from(Question)
+
+
+def check_page(rows, page_number):
+    """404 for an empty page past the first one, like paginate"""
+    if not rows and page_number != 1 and ERROR_OUT:
+        abort(404)
+
+
+def questions_after(cursor, limit):
+    """Statement of the questions following a cursor, by id
+
+    One row more than the page is selected, it tells whether there is a
+    next page (split_page).
+
+    Returns:
+        tuple: (statement, page size)
+    """
+    try:
+        after_id = decode_cursor(cursor)
+    except ValueError:
+        abort(400)
+
+    limit = page_size(limit)
+    statement = select(*QUESTION_COLUMNS).where(
+        Question.id > after_id
+    ).order_by(Question.id).limit(limit + 1)
+
+    return statement, limit
+
+
+def split_page(rows, limit):
+    """(rows of the page, next_cursor) of the rows read by questions_after,
+    next_cursor is None on the last page"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+
+def questions_payload(rows, current_category, categories, total_questions,
+                      **extra):
+    """Payload of GET /api/questions
+
+    Args:
+        categories (RawJSON): categories_cache.fragment()
+        extra: next_cursor of the cursor pagination
+    """
+    return {
+        "questions": [format_question_row(row) for row in rows],
+        "current_category": current_category,
+        "categories": categories,
+        "total_questions": total_questions,
+        **extra
+    }
+
+
+def questions_by_id(question_ids):
+    """Statement of the questions with these ids, in no particular order"""
+    return select(*QUESTION_COLUMNS).where(Question.id.in_(question_ids))
+
+
+def in_order(rows, question_ids):
+    """Formatted questions of rows in the order of question_ids, the ids
+    without a row (deleted since they were picked) are skipped"""
+    questions = {row.id: format_question_row(row) for row in rows}
+    return [
+        questions[question_id]
+        for question_id in question_ids
+        if question_id in questions
+    ]
+
+
+def search_request(data):
+    """(searchTerm, searchAnswers, page, limit) of a search body, 400 for
+    a page or limit that is not a positive integer"""
+    page = data.get("page")
+    limit = data.get("limit")
+    if not all(is_positive_int(value) for value in (page, limit) if value is not None):
+        abort(400)
+
+    return data.get("searchTerm"), bool(data.get("searchAnswers")), page, limit
+
+
+def search_scope(current_category, categories):
+    """(current_category, category id) of a search, both None for 'null'
+    (every category). The category id is None for an unknown category.
+
+    Args:
+        categories (CategoriesCache): maps the category type to its id
+    """
+    current_category = current_category_arg(current_category)
+    if current_category is None:
+        return None, None
+    return current_category, categories.id_of(current_category)
+
+
+def search_page(question_ids, page, limit):
+    """The ranked ids of a page of results, every result when page is None"""
+    if page is None:
+        return question_ids
+    limit = page_size(limit)
+    return question_ids[(page - 1) * limit:page * limit]
+
+
+def search_payload(questions, current_category, total_questions):
+    return {
+        "questions": questions,
+        "current_category": current_category,
+        "total_questions": total_questions
+    }
+
+
+def quiz_category_id(quiz_category):
+    """Category id of a quiz_category object, None for "ALL"
+
+    Args:
+        quiz_category (dict): e.g {"id": 1, "type": "Science"}
+    """
+    category_id = quiz_category["id"]
+    category_type = quiz_category["type"]
+
+    # "ALL" draws from every category
+    if category_id == 0 and category_type == "ALL":
+        return None
+
+    return category_id
+
+
+def quiz_request(data):
+    """Arguments of a POST /api/quizzes body
+
+    Returns:
+        tuple: (category id, previous question ids, sampling options of
+        flaskr.quiz.pick_quiz_question_id)
+    """
+    if not isinstance(data, dict):
+        abort(400)
+
+    quiz_category = data.get("quiz_category")
+    previous_question_ids = data.get("previous_questions")
+    if quiz_category is None or not isinstance(previous_question_ids, list):
+        abort(400)
+
+    try:
+        category_id = quiz_category_id(quiz_category)
+    except (KeyError, TypeError):
+        abort(400)
+
+    sampling = {
+        "difficulty": data.get("difficulty"),
+        "strategy": data.get("strategy"),
+        "answers": data.get("answers")
+    }
+    return category_id, previous_question_ids, sampling
+
+
+def quiz_batch_request(data):
+    """quiz_request of a POST /api/quizzes/batch body, plus the number of
+    questions wanted, at most QUIZ_MAX_BATCH"""
+    category_id, previous_question_ids, sampling = quiz_request(data)
+
+    count = data.get("count", QUESTIONS_PER_PAGE)
+    if not is_positive_int(count):
+        abort(400)
+
+    return category_id, previous_question_ids, min(count, QUIZ_MAX_BATCH), sampling
@@ -0,0 +1,62 @@
+import json
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawJSON(str):
+    """A value that is already serialised to JSON"""
+
+
+def dumps(value):
+    """Serialise like jsonify: sorted keys, compact separators
+
+    Uses orjson when it is installed (pip install orjson). Non-ASCII
+    characters are written as UTF-8 with either encoder, so both give
+    the same bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    return json.dumps(
+        value,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+
+
+def encode(payload):
+    """Serialise a dict whose values may be RawJSON, like json_response"""
+    members = ",".join(
+        f"{dumps(key)}:{value if isinstance(value, RawJSON) else dumps(value)}"
+        for key, value in sorted(payload.items())
+    )
+    return "{" + members + "}\n"
+
+
+def json_response(payload, status=200):
+    """Build a JSON response from a dict whose values may be RawJSON
+
+    RawJSON values are written to the body as they are, which lets hot
+    paths reuse fragments serialised once and cached.
+
+    Args:
+        payload (dict): top-level object of the response
+        status (int): http status code
+
+    Returns:
+        Response: application/json response
+    """
+    return current_app.response_class(
+        encode(payload),
+        status=status,
+        mimetype="application/json"
+    )
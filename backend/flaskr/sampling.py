@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from random import random, randrange
+
+from flaskr.index import question_index
+
+"""
+sampling
+    weighted quiz question sampling over the (category, difficulty)
+    buckets of the question index. A strategy gives every difficulty a
+    weight, a bucket is drawn with probability weight x size from a
+    Fenwick tree and a question of the bucket by rejection of the seen
+    ids. Exhausted buckets drop out of the tree in O(log buckets).
+"""
+
+DIFFICULTIES = range(1, 6)
+
+STRATEGIES = ("uniform", "ramp", "adaptive")
+
+# weight of a difficulty `d` away from the target: FALLOFF ** d
+DIFFICULTY_FALLOFF = 0.25
+
+# ramp: the target difficulty goes up every RAMP_STEP questions
+RAMP_STEP = 3
+
+# adaptive: the accuracy of the last ADAPTIVE_WINDOW answers sets the
+# target difficulty, 1 (every answer wrong) to 5 (every answer right)
+ADAPTIVE_WINDOW = 5
+
+# random draws in a bucket before counting its unseen questions
+MAX_REJECTION_DRAWS = 8
+
+
+class FenwickTree:
+    """Prefix sums of weights, for weighted draws with O(log n) updates"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.tree = [0.0] * (self.size + 1)
+        for position, weight in enumerate(weights):
+            self.add(position, weight)
+
+    def add(self, position, delta):
+        position += 1
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def total(self):
+        total = 0.0
+        position = self.size
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def find(self, value):
+        """Position whose cumulative weight range contains value"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            following = position + step
+            if following <= self.size and self.tree[following] <= value:
+                position = following
+                value -= self.tree[following]
+            step >>= 1
+        return min(position, self.size - 1)
+
+
+def quiz_difficulty(value):
+    """A difficulty of the quiz body, an int or its string. Floats and
+    booleans are rejected rather than truncated.
+
+    Raises:
+        ValueError: not an int or a string of one
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"invalid difficulty: {value!r}")
+    return int(value)
+
+
+def parse_difficulty(difficulty):
+    """Difficulty band of the quiz body: 3, [2, 4] or None
+
+    Returns:
+        range: the difficulties allowed, every difficulty when None
+
+    Raises:
+        ValueError: not a difficulty or a [min, max] pair
+    """
+    if difficulty is None:
+        return None
+
+    if isinstance(difficulty, list):
+        if len(difficulty) != 2:
+            raise ValueError(f"invalid difficulty: {difficulty}")
+        lowest, highest = (quiz_difficulty(value) for value in difficulty)
+    else:
+        lowest = highest = quiz_difficulty(difficulty)
+
+    if lowest not in DIFFICULTIES or highest not in DIFFICULTIES or lowest > highest:
+        raise ValueError(f"invalid difficulty: {difficulty}")
+
+    return range(lowest, highest + 1)
+
+
+def target_difficulty(strategy, previous_question_ids, answers):
+    """Difficulty a strategy aims at, None for uniform"""
+    if strategy == "ramp":
+        return min(DIFFICULTIES[-1], 1 + len(previous_question_ids) // RAMP_STEP)
+
+    if strategy == "adaptive":
+        recent = (answers or [])[-ADAPTIVE_WINDOW:]
+        if not recent:
+            return 3
+        accuracy = sum(bool(answer) for answer in recent) / len(recent)
+        return 1 + round(accuracy * (len(DIFFICULTIES) - 1))
+
+    return None
+
+
+def difficulty_weight(difficulty, band, target):
+    if band is not None and difficulty not in band:
+        return 0
+    if target is None:
+        return 1
+    # questions without a difficulty are the least likely
+    distance = abs(difficulty - target) if difficulty is not None else len(DIFFICULTIES)
+    return DIFFICULTY_FALLOFF ** distance
+
+
+def sample_question_id(category_id, previous_question_ids, band=None,
+                       target=None):
+    """Draw an unseen question id, weighted by difficulty
+
+    Args:
+        category_id (int): category id, None means every category
+        previous_question_ids (iterable): ids already served to the player
+        band (range): allowed difficulties, every difficulty when None
+        target (int): favoured difficulty, uniform when None
+
+    Returns:
+        int: a question id or None when every matching question was seen
+    """
+    buckets = []
+    weights = []
+    for (_, difficulty), ids in question_index.buckets(category_id).items():
+        weight = difficulty_weight(difficulty, band, target)
+        if ids and weight:
+            buckets.append(ids)
+            weights.append(weight * len(ids))
+
+    if not buckets:
+        return None
+
+    excluded = set(previous_question_ids or [])
+    tree = FenwickTree(weights)
+    live_buckets = len(buckets)
+
+    while live_buckets:
+        position = tree.find(random() * tree.total())
+        # float rounding can land on an exhausted bucket
+        if not weights[position]:
+            continue
+
+        question_id = _pick_unseen(buckets[position], excluded)
+        if question_id is not None:
+            return question_id
+
+        tree.add(position, -weights[position])
+        weights[position] = 0
+        live_buckets -= 1
+
+    return None
+
+
+def _pick_unseen(ids, excluded):
+    """A random id of a sorted bucket that is not excluded"""
+    for _ in range(MAX_REJECTION_DRAWS):
+        question_id = ids[randrange(len(ids))]
+        if question_id not in excluded:
+            return question_id
+
+    # mostly seen: draw among the unseen ones
+    seen = sum(
+        1
+        for question_id in excluded
+        if _contains(ids, question_id)
+    )
+    unseen = len(ids) - seen
+    if unseen <= 0:
+        return None
+
+    skip = randrange(unseen)
+    for question_id in ids:
+        if question_id not in excluded:
+            if not skip:
+                return question_id
+            skip -= 1
+
+
+def _contains(ids, question_id):
+    position = bisect_left(ids, question_id)
+    return position < len(ids) and ids[position] == question_id
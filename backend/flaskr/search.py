@@ -0,0 +1,350 @@
+import re
+from collections import Counter
+from bisect import bisect_left, insort
+from threading import Lock
+
+from sqlalchemy import literal_column, select
+
+from config import SEARCH_CACHE_ENTRIES, SEARCH_CACHE_TTL
+from flaskr.cache import LocalCache
+from flaskr.index import to_category_id
+from models import db, Question
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Postgres text search configuration, 'simple' keeps stop words such as
+# "what" searchable and does not stem
+TS_CONFIG = "simple"
+
+# matches in the question text rank above matches in the answer
+QUESTION_WEIGHT = 2
+ANSWER_WEIGHT = 1
+
+
+def tokenize(value):
+    """Lower-cased word tokens of a text"""
+    return TOKEN_PATTERN.findall((value or "").lower())
+
+
+class InvertedIndexSearch:
+    """In-process full-text search for SQLite and test setups
+
+    Maps every token to the questions (and answers) containing it. Each
+    search token matches the indexed tokens it prefixes, every search
+    token has to match for a question to be returned. Writes replace the
+    postings of a token and the sorted token list instead of mutating
+    them, and build() swaps in a complete index: searches running
+    without the lock never see a partial index.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = Lock()
+        self._questions = {}
+        self._answers = {}
+        self._tokens = []
+        self._categories = {}
+        self._document_tokens = {}
+
+    def build(self):
+        """(Re)load the index from the database"""
+        rows = db.session.query(
+            Question.id,
+            Question.question,
+            Question.answer,
+            Question.category
+        )
+
+        questions = {}
+        answers = {}
+        categories = {}
+        document_tokens = {}
+        for question_id, question, answer, category in rows:
+            categories[question_id] = to_category_id(category)
+            tokens = document_tokens[question_id] = set()
+            for postings, value in ((questions, question), (answers, answer)):
+                for token in tokenize(value):
+                    counts = postings.setdefault(token, {})
+                    counts[question_id] = counts.get(question_id, 0) + 1
+                    tokens.add(token)
+        tokens = sorted(set(questions) | set(answers))
+
+        with self._lock:
+            self._questions = questions
+            self._answers = answers
+            self._categories = categories
+            self._document_tokens = document_tokens
+            self._tokens = tokens
+
+    def _add(self, question_id, question, answer, category):
+        """Index a question, returns the tokens new to the index"""
+        self._categories[question_id] = to_category_id(category)
+        document_tokens = self._document_tokens[question_id] = set()
+        new_tokens = []
+
+        for postings, value in (
+            (self._questions, question),
+            (self._answers, answer)
+        ):
+            for token, count in Counter(tokenize(value)).items():
+                if token not in self._questions and token not in self._answers:
+                    new_tokens.append(token)
+                counts = dict(postings.get(token, ()))
+                counts[question_id] = counts.get(question_id, 0) + count
+                postings[token] = counts
+                document_tokens.add(token)
+
+        return new_tokens
+
+    def _remove(self, question_id):
+        """Unindex a question, returns the tokens gone from the index"""
+        self._categories.pop(question_id, None)
+        dropped_tokens = []
+
+        for token in self._document_tokens.pop(question_id, ()):
+            for postings in (self._questions, self._answers):
+                counts = postings.get(token)
+                if counts is not None and question_id in counts:
+                    counts = dict(counts)
+                    del counts[question_id]
+                    if counts:
+                        postings[token] = counts
+                    else:
+                        del postings[token]
+            if token not in self._questions and token not in self._answers:
+                dropped_tokens.append(token)
+
+        return dropped_tokens
+
+    def on_write(self, table, action, record):
+        """models.on_write hook keeping the index consistent"""
+        if table == Question.__tablename__ and action == "import":
+            self.build()
+
+        elif table == Question.__tablename__:
+            with self._lock:
+                tokens = list(self._tokens)
+                if action in ("update", "delete"):
+                    for token in self._remove(record["id"]):
+                        del tokens[bisect_left(tokens, token)]
+                if action in ("insert", "update"):
+                    for token in set(self._add(
+                        record["id"],
+                        record["question"],
+                        record["answer"],
+                        record["category"]
+                    )):
+                        insort(tokens, token)
+                self._tokens = tokens
+
+        # deleting a category detaches its questions in the database
+        elif action == "delete":
+            self.build()
+
+    def _prefixed(self, prefix):
+        tokens = self._tokens
+        position = bisect_left(tokens, prefix)
+        while position < len(tokens) and tokens[position].startswith(prefix):
+            yield tokens[position]
+            position += 1
+
+    def _scores(self, term_token, search_answers):
+        scores = {}
+        for token in self._prefixed(term_token):
+            # exact token matches rank above prefix matches
+            boost = 2 if token == term_token else 1
+            sources = [(self._questions, QUESTION_WEIGHT)]
+            if search_answers:
+                sources.append((self._answers, ANSWER_WEIGHT))
+            for postings, weight in sources:
+                for question_id, count in postings.get(token, {}).items():
+                    scores[question_id] = (
+                        scores.get(question_id, 0) + count * weight * boost
+                    )
+        return scores
+
+    def search(self, search_term, category_id=None, search_answers=False):
+        """Question ids matching every token of the term, best first"""
+        term_tokens = tokenize(search_term)
+        if not term_tokens:
+            return []
+
+        scores = None
+        for term_token in term_tokens:
+            token_scores = self._scores(term_token, search_answers)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    question_id: score + token_scores[question_id]
+                    for question_id, score in scores.items()
+                    if question_id in token_scores
+                }
+            if not scores:
+                return []
+
+        if category_id is not None:
+            category_id = to_category_id(category_id)
+            scores = {
+                question_id: score
+                for question_id, score in scores.items()
+                if self._categories.get(question_id) == category_id
+            }
+
+        return sorted(
+            scores,
+            key=lambda question_id: (-scores[question_id], question_id)
+        )
+
+
+class PostgresSearch:
+    """Full-text search with tsvector expressions backed by GIN indexes"""
+
+    name = "postgres"
+
+    # the expressions are rendered with literals so that they match the
+    # expressions of the GIN indexes
+    question_vector = db.func.to_tsvector(
+        literal_column(f"'{TS_CONFIG}'"),
+        db.func.coalesce(Question.question, literal_column("''"))
+    )
+    document_vector = db.func.to_tsvector(
+        literal_column(f"'{TS_CONFIG}'"),
+        db.func.coalesce(Question.question, literal_column("''"))
+        .op("||")(literal_column("' '"))
+        .op("||")(db.func.coalesce(Question.answer, literal_column("''")))
+    )
+
+    def build(self):
+        """The GIN indexes are created by migration 3 (migrations.py)"""
+
+    def on_write(self, table, action, record):
+        """Postgres maintains the GIN indexes itself"""
+
+    def search(self, search_term, category_id=None, search_answers=False):
+        """Question ids matching every token of the term, best first"""
+        statement = self.statement(search_term, category_id, search_answers)
+        if statement is None:
+            return []
+
+        return [question_id for question_id, in db.session.execute(statement)]
+
+    def statement(self, search_term, category_id=None, search_answers=False):
+        """SELECT of the matching question ids, None when the term has no
+        words. Lets async callers run the search on their own connection.
+        """
+        term_tokens = tokenize(search_term)
+        if not term_tokens:
+            return None
+
+        # every token, matched as a prefix
+        query = db.func.to_tsquery(
+            TS_CONFIG,
+            " & ".join(f"{token}:*" for token in term_tokens)
+        )
+        vector = self.document_vector if search_answers else self.question_vector
+        rank = db.func.ts_rank(vector, query)
+
+        statement = select(Question.id).where(vector.op("@@")(query))
+
+        if category_id is not None:
+            statement = statement.where(Question.category == category_id)
+
+        return statement.order_by(rank.desc(), Question.id)
+
+
+def create_search_backend(name, dialect):
+    """Search backend for the SEARCH_BACKEND setting
+
+    Args:
+        name (str): "postgres", "memory" or "auto"
+        dialect (str): name of the database dialect, used by "auto"
+    """
+    if name == "auto":
+        name = "postgres" if dialect == "postgresql" else "memory"
+
+    if name == "postgres":
+        return PostgresSearch()
+    if name == "memory":
+        return InvertedIndexSearch()
+
+    raise ValueError(f"unknown search backend: {name}")
+
+
+class SearchEngine:
+    """Search backend chosen when the app is created
+
+    The ranked ids of recent searches are cached per normalised term,
+    category and searchAnswers flag, until a question or a category is
+    written or the TTL expires. Every write bumps the write generation:
+    a search that ran across a write is not cached, it may have read the
+    data of before the write after the cache was cleared.
+    """
+
+    def __init__(self, cache_entries=SEARCH_CACHE_ENTRIES, cache_ttl=SEARCH_CACHE_TTL):
+        self.backend = InvertedIndexSearch()
+        self.results = LocalCache(cache_entries)
+        self.results_ttl = cache_ttl
+        self._lock = Lock()
+        self.generation = 0
+
+    def configure(self, name, dialect):
+        """Pick the backend, build() loads it"""
+        self.backend = create_search_backend(name, dialect)
+        self._invalidate()
+
+    def build(self):
+        self.backend.build()
+        self._invalidate()
+
+    def _invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self.results.clear()
+
+    def result_key(self, search_term, category_id=None, search_answers=False):
+        """Key of the results of a search: the sorted distinct tokens of
+        the term, the category and the flag. None for a term without
+        tokens, it matches nothing"""
+        tokens = sorted(set(tokenize(search_term)))
+        if not tokens:
+            return None
+        if category_id is not None:
+            category_id = to_category_id(category_id)
+        return f"{category_id}:{int(bool(search_answers))}:{' '.join(tokens)}"
+
+    def remember(self, key, question_ids, generation):
+        """Cache the ranked ids of a search started at `generation`,
+        unless a write happened since. Returns them as a tuple"""
+        question_ids = tuple(question_ids)
+        with self._lock:
+            if generation == self.generation:
+                self.results.set(key, question_ids, self.results_ttl)
+        return question_ids
+
+    def search(self, search_term, category_id=None, search_answers=False):
+        key = self.result_key(search_term, category_id, search_answers)
+        if key is None:
+            return ()
+
+        question_ids = self.results.get(key)
+        if question_ids is None:
+            generation = self.generation
+            question_ids = self.remember(
+                key,
+                self.backend.search(search_term, category_id, search_answers),
+                generation
+            )
+        return question_ids
+
+    def on_write(self, table, action, record):
+        # a new, deleted or recategorised question changes the results,
+        # so does a deleted category (its questions lose their category).
+        # The backend is updated first, a search reading it before then
+        # started at the previous generation
+        self.backend.on_write(table, action, record)
+        self._invalidate()
+
+
+search_engine = SearchEngine()
@@ -0,0 +1,83 @@
+import os
+from threading import Lock
+from time import perf_counter
+
+from flaskr.cache import categories_cache
+from flaskr.index import question_index
+from flaskr.search import search_engine
+from flaskr.suggest import suggest_index
+from models import db
+from replicas import replica_set
+
+"""
+startup
+    loading of the in-process indexes and caches, and the state a worker
+    forked from a preloaded app (gunicorn --preload) has to reopen. The
+    indexes are loaded when the app is created or by the first request
+    of the worker, see STARTUP_MODE and WARM_ON_STARTUP in config.py.
+    connection pools, the cache listener thread and the write broadcast
+    origin are renewed in every forked child by the fork hooks
+"""
+
+
+class Warmup:
+    """Loads the question index, the search and suggestion indexes and the
+    categories once per process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.done = False
+        self.seconds = None
+
+    def run(self, app):
+        if self.done:
+            return
+
+        with self._lock:
+            if self.done:
+                return
+
+            start = perf_counter()
+            with app.app_context():
+                question_index.build()
+                search_engine.build()
+                suggest_index.build()
+                categories_cache.mapping()
+            self.seconds = perf_counter() - start
+            self.done = True
+
+    def reset(self):
+        self.done = False
+
+
+"""
+fork hooks
+    callables run in the child after os.fork(), once the app was created
+    in the parent. hooks are called without arguments
+"""
+
+fork_hooks = []
+
+
+def on_fork(hook):
+    if not fork_hooks and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=run_fork_hooks)
+    if hook not in fork_hooks:
+        fork_hooks.append(hook)
+    return hook
+
+
+def run_fork_hooks():
+    for hook in fork_hooks:
+        hook()
+
+
+def dispose_pools():
+    """Drop the database connections inherited from the parent without
+    closing them, the parent and every other child share their sockets"""
+    if db.app is not None:
+        db.get_engine(db.app).dispose(close=False)
+    replica_set.after_fork()
+
+
+warmup = Warmup()
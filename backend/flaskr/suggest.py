@@ -0,0 +1,190 @@
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from threading import Lock
+
+from flaskr.search import tokenize
+from models import Category, db, Question
+
+# the top words of prefixes up to this length are kept until the next
+# write, they would scan a large part of the vocabulary
+MEMOISED_PREFIX_LENGTH = 2
+
+
+class SuggestIndex:
+    """In-process prefix index for type-ahead suggestions
+
+    Keeps the distinct words of the question texts in a sorted list with
+    the number of questions using each word, and the words of the
+    category names. A prefix is a bisect into the sorted lists, the most
+    used words come first, the words of the shortest prefixes are
+    memoised. Writes update the lists and counts in place under the lock,
+    a word is inserted or deleted only when its count crosses zero, and
+    drop the memoised words of the prefixes they change. Readers do not
+    lock, a read running across a write may miss or repeat a word but is
+    not memoised.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tokens = []
+        self._counts = {}
+        self._question_tokens = {}
+        self._category_tokens = []
+        self._categories = {}
+        self._top_words = {}
+        # bumped by every write, words read across one are not memoised
+        self._generation = 0
+
+    def build(self):
+        """(Re)load the index from the database"""
+        counts = {}
+        question_tokens = {}
+        for question_id, question in db.session.query(Question.id, Question.question):
+            tokens = question_tokens[question_id] = frozenset(tokenize(question))
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+
+        categories = dict(db.session.query(Category.id, Category.type))
+
+        with self._lock:
+            self._counts = counts
+            self._question_tokens = question_tokens
+            self._tokens = sorted(counts)
+            self._top_words = {}
+            self._generation += 1
+            self._categories = categories
+            self._category_tokens = _category_tokens(categories)
+
+    def suggest(self, prefix, limit=10):
+        """Completions of the last word of a prefix
+
+        Args:
+            prefix (str): text typed so far, e.g "what riv"
+            limit (int): most words returned
+
+        Returns:
+            tuple: (words, categories), the words completing the last word
+            of the prefix, most used first, and the {"id", "type"} of the
+            categories with a word starting like it
+        """
+        tokens = tokenize(prefix)
+        if not tokens:
+            return [], []
+        last = tokens[-1]
+
+        words = self._top_words.get((last, limit))
+        if words is None:
+            generation = self._generation
+            counts = self._counts
+            words = nsmallest(
+                limit,
+                _prefixed(self._tokens, last),
+                key=lambda token: (-counts.get(token, 0), token)
+            )
+            if len(last) <= MEMOISED_PREFIX_LENGTH:
+                with self._lock:
+                    if self._generation == generation:
+                        self._top_words[(last, limit)] = words
+
+        categories = self._categories
+        category_ids = []
+        for _, category_id in _prefixed(self._category_tokens, last, pairs=True):
+            if category_id not in category_ids:
+                category_ids.append(category_id)
+
+        matches = []
+        for category_id in category_ids[:limit]:
+            category_type = categories.get(category_id)
+            if category_type is not None:
+                matches.append({"id": category_id, "type": category_type})
+        return words, matches
+
+    def _add_question(self, question_id, question):
+        question_tokens = self._question_tokens[question_id] = frozenset(tokenize(question))
+        for token in question_tokens:
+            count = self._counts.get(token, 0)
+            if not count:
+                insort(self._tokens, token)
+            self._counts[token] = count + 1
+        return question_tokens
+
+    def _remove_question(self, question_id):
+        question_tokens = self._question_tokens.pop(question_id, ())
+        for token in question_tokens:
+            count = self._counts.get(token, 0) - 1
+            if count > 0:
+                self._counts[token] = count
+            else:
+                self._counts.pop(token, None)
+                del self._tokens[bisect_left(self._tokens, token)]
+        return question_tokens
+
+    def _forget(self, tokens):
+        """Drop the memoised words of the prefixes of tokens"""
+        self._generation += 1
+        prefixes = {
+            token[:length]
+            for token in tokens
+            for length in range(1, MEMOISED_PREFIX_LENGTH + 1)
+        }
+        for key in [key for key in self._top_words if key[0] in prefixes]:
+            del self._top_words[key]
+
+    def on_write(self, table, action, record):
+        """models.on_write hook keeping the index consistent"""
+        if table == Question.__tablename__ and action == "import":
+            self.build()
+
+        elif table == Question.__tablename__:
+            with self._lock:
+                changed = set()
+                if action in ("update", "delete"):
+                    changed.update(self._remove_question(record["id"]))
+                if action in ("insert", "update"):
+                    changed.update(self._add_question(record["id"], record["question"]))
+                self._forget(changed)
+
+        elif table == Category.__tablename__:
+            with self._lock:
+                category_id = record["id"]
+                category_type = self._categories.get(category_id)
+                if category_type is not None:
+                    for token in set(tokenize(category_type)):
+                        del self._category_tokens[
+                            bisect_left(self._category_tokens, (token, category_id))
+                        ]
+
+                if action == "delete":
+                    self._categories.pop(category_id, None)
+                else:
+                    self._categories[category_id] = record["type"]
+                    for token in set(tokenize(record["type"])):
+                        insort(self._category_tokens, (token, category_id))
+
+
+def _category_tokens(categories):
+    """Sorted (word, category id) of every word of the category names"""
+    return sorted(
+        (token, category_id)
+        for category_id, category_type in categories.items()
+        for token in set(tokenize(category_type))
+    )
+
+
+def _prefixed(entries, prefix, pairs=False):
+    """Entries of a sorted list of words, or of (word, value) pairs,
+    whose word starts with prefix"""
+    position = bisect_left(entries, (prefix,) if pairs else prefix)
+    while True:
+        # a write may shorten the list while it is read
+        try:
+            entry = entries[position]
+        except IndexError:
+            return
+        if not (entry[0] if pairs else entry).startswith(prefix):
+            return
+        yield entry
+        position += 1
+
+
+suggest_index = SuggestIndex()
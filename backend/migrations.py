@@ -0,0 +1,190 @@
+from sqlalchemy import Integer, inspect, text
+
+"""
+migrations
+    versioned schema changes applied in order. schema_migrations records
+    the versions already applied to a database, every migration runs in
+    its own transaction and is written to be safe on databases created
+    by db.create_all() or restored from trivia.psql
+"""
+
+MIGRATIONS = []
+
+# postgres advisory lock serialising workers migrating at the same time
+LOCK_KEY = 7_414_001
+
+
+def migration(version, description):
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return upgrade
+    return register
+
+
+@migration(1, "typed category foreign key on questions")
+def typed_category(connection):
+    postgres = connection.dialect.name == "postgresql"
+
+    columns = {
+        column["name"]: column
+        for column in inspect(connection).get_columns("questions")
+    }
+
+    if postgres and not isinstance(columns["category"]["type"], Integer):
+        # rows that can't be cast lose their category
+        connection.execute(text(
+            "UPDATE questions SET category = NULL "
+            "WHERE category !~ '^[0-9]+$'"
+        ))
+        connection.execute(text(
+            "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+            "USING category::integer"
+        ))
+    elif not postgres and not isinstance(columns["category"]["type"], Integer):
+        # a VARCHAR column keeps the ids as text whatever is stored in
+        # it, and sqlite can't alter a column: rebuild the table
+        connection.execute(text(
+            "CREATE TABLE questions_typed ("
+            "  id INTEGER NOT NULL PRIMARY KEY,"
+            "  question VARCHAR,"
+            "  answer VARCHAR,"
+            "  category INTEGER REFERENCES categories (id) "
+            "    ON UPDATE CASCADE ON DELETE SET NULL,"
+            "  difficulty INTEGER"
+            ")"
+        ))
+        connection.execute(text(
+            "INSERT INTO questions_typed (id, question, answer, category, difficulty) "
+            "SELECT id, question, answer, CAST(category AS INTEGER), difficulty "
+            "FROM questions"
+        ))
+        connection.execute(text("DROP TABLE questions"))
+        connection.execute(text("ALTER TABLE questions_typed RENAME TO questions"))
+
+    # questions pointing at deleted categories
+    connection.execute(text(
+        "UPDATE questions SET category = NULL "
+        "WHERE category NOT IN (SELECT id FROM categories)"
+    ))
+
+    foreign_keys = inspect(connection).get_foreign_keys("questions")
+    if postgres and not foreign_keys:
+        connection.execute(text(
+            "ALTER TABLE questions ADD CONSTRAINT category "
+            "FOREIGN KEY (category) REFERENCES categories (id) "
+            "ON UPDATE CASCADE ON DELETE SET NULL"
+        ))
+
+
+@migration(2, "indexes on questions.category, questions.difficulty "
+              "and unique categories.type")
+def hot_column_indexes(connection):
+    # merge duplicated category types into the oldest category
+    duplicates = connection.execute(text(
+        "SELECT c.id, k.keep_id FROM categories c JOIN ("
+        "  SELECT type, MIN(id) AS keep_id FROM categories"
+        "  GROUP BY type HAVING COUNT(*) > 1"
+        ") k ON c.type = k.type AND c.id <> k.keep_id"
+    )).fetchall()
+
+    for duplicate_id, keep_id in duplicates:
+        connection.execute(
+            text("UPDATE questions SET category = :keep WHERE category = :id"),
+            {"keep": keep_id, "id": duplicate_id}
+        )
+        connection.execute(
+            text("DELETE FROM categories WHERE id = :id"),
+            {"id": duplicate_id}
+        )
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category "
+        "ON questions (category)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_difficulty "
+        "ON questions (difficulty)"
+    ))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_categories_type "
+        "ON categories (type)"
+    ))
+
+
+@migration(3, "full-text search indexes on questions")
+def full_text_search_indexes(connection):
+    # must match the expressions of flaskr.search.PostgresSearch
+    if connection.dialect.name != "postgresql":
+        return
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_question_fts "
+        "ON questions USING GIN ("
+        "  to_tsvector('simple', coalesce(question, ''))"
+        ")"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_document_fts "
+        "ON questions USING GIN ("
+        "  to_tsvector('simple', coalesce(question, '') || ' ' || coalesce(answer, ''))"
+        ")"
+    ))
+
+
+def ensure_version_table(connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "  version INTEGER PRIMARY KEY,"
+        "  description VARCHAR NOT NULL,"
+        "  applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+        ")"
+    ))
+
+
+def applied_versions(engine):
+    """Versions already applied to the database"""
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        rows = connection.execute(text("SELECT version FROM schema_migrations"))
+        return {version for version, in rows}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [entry for entry in MIGRATIONS if entry[0] not in applied]
+
+
+def apply_migrations(engine):
+    """Apply the pending migrations in version order
+
+    Returns:
+        list: (version, description) of the applied migrations
+    """
+    postgres = engine.dialect.name == "postgresql"
+    applied = []
+
+    with engine.connect() as lock:
+        if postgres:
+            lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+
+        try:
+            for version, description, upgrade in pending_migrations(engine):
+                with engine.begin() as connection:
+                    upgrade(connection)
+                    connection.execute(
+                        text(
+                            "INSERT INTO schema_migrations (version, description) "
+                            "VALUES (:version, :description)"
+                        ),
+                        {"version": version, "description": description}
+                    )
+                applied.append((version, description))
+        finally:
+            if postgres:
+                lock.execute(
+                    text("SELECT pg_advisory_unlock(:key)"),
+                    {"key": LOCK_KEY}
+                )
+
+    return applied
@@ -1,20 +1,94 @@
-from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, ForeignKey, String, Integer, event, orm
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
 
-db = SQLAlchemy()
+from migrations import apply_migrations
+from replicas import mark_written, replica_engine, replica_set
+
+"""
+routing session
+    reads of the views decorated with `replica_reads` go to a read
+    replica, flushes and every other query to the primary. A request
+    that flushed reads from the primary from then on
+"""
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # execute(..., bind_arguments={"bind": db.engine}) pins a read
+        if bind is not None:
+            return bind
+        if not self._flushing:
+            engine = replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        session_factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(session_factory, "after_flush", mark_written)
+        return session_factory
+
+
+db = RoutingSQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, creates the
+    missing tables and applies the pending migrations. replica_uris are
+    read replicas of database_path, empty to read from the primary only.
+    with create_tables and migrate off it does not connect to the database
 """
 
 
-def setup_db(app, database_path, track_modifications = True):
+def setup_db(app, database_path, track_modifications = False, migrate = True,
+             engine_options = None, replica_uris = (),
+             replica_engine_options = None, create_tables = True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = track_modifications
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options or {}
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    if create_tables:
+        db.create_all()
+
+    if migrate:
+        apply_migrations(db.engine)
+
+    replica_set.configure(replica_uris, replica_engine_options)
+
+
+"""
+write hooks
+    callables notified once a write on a model has been committed.
+    hooks are called as hook(table, action, record) where record is
+    the formatted row. bulk imports notify a single "import" action with
+    a summary record once every batch is committed.
+    writes committed by other workers are replayed with remote=True,
+    hooks registered with remote=False only see the local writes
+"""
+
+write_hooks = []
+local_write_hooks = []
+
+
+def on_write(hook, remote=True):
+    if hook not in write_hooks:
+        write_hooks.append(hook)
+    if not remote and hook not in local_write_hooks:
+        local_write_hooks.append(hook)
+    return hook
+
+
+def notify_write(table, action, record, remote=False):
+    for hook in write_hooks:
+        if remote and hook in local_write_hooks:
+            continue
+        hook(table, action, record)
 
 
 """
@@ -29,8 +103,12 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
-    difficulty = Column(Integer)
+    category = Column(
+        Integer,
+        ForeignKey("categories.id", onupdate="CASCADE", ondelete="SET NULL"),
+        index=True
+    )
+    difficulty = Column(Integer, index=True)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -40,14 +118,21 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        record = self.format()
         db.session.commit()
+        notify_write(self.__tablename__, "insert", record)
 
     def update(self):
+        record = self.format()
         db.session.commit()
+        notify_write(self.__tablename__, "update", record)
 
     def delete(self):
+        record = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_write(self.__tablename__, "delete", record)
 
     def format(self):
         return {
@@ -59,6 +144,37 @@ class Question(db.Model):
         }
 
 
+"""
+question rows
+    read-only fast path for the list endpoints: the question columns are
+    selected as plain tuples, skipping ORM instances, the identity map
+    and change tracking
+"""
+
+QUESTION_COLUMNS = (
+    Question.id,
+    Question.question,
+    Question.answer,
+    Question.category,
+    Question.difficulty
+)
+
+
+def question_rows():
+    return db.session.query(*QUESTION_COLUMNS)
+
+
+def format_question_row(row):
+    id, question, answer, category, difficulty = row
+    return {
+        'id': id,
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
 """
 Category
 
@@ -69,21 +185,28 @@ class Category(db.Model):
     __tablename__ = 'categories'
 
     id = Column(Integer, primary_key=True)
-    type = Column(String)
+    type = Column(String, unique=True, index=True)
 
     def __init__(self, type):
         self.type = type
         
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        record = self.format()
         db.session.commit()
+        notify_write(self.__tablename__, "insert", record)
 
     def update(self):
+        record = self.format()
         db.session.commit()
+        notify_write(self.__tablename__, "update", record)
 
     def delete(self):
+        record = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_write(self.__tablename__, "delete", record)
 
     def format(self):
         return {
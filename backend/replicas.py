@@ -0,0 +1,146 @@
+from functools import wraps
+from threading import Lock
+from time import monotonic
+
+from flask import g, has_request_context
+from sqlalchemy import create_engine, event, text
+
+"""
+replicas
+    read replicas of the primary database. Views opting in with
+    `replica_reads` read from the healthy replicas in turn, everything
+    else (writes, reads after a write in the same request, requests
+    outside the views) uses the primary. Replicas failing a health check
+    or a connection are skipped until a later check passes, reads fall
+    back to the primary when none is healthy.
+"""
+
+
+class ReplicaSet:
+    """Round-robin over the healthy replica engines"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.engines = []
+        self.healthy = []
+        self._checked_at = 0
+        self._next = 0
+
+    def configure(self, uris, engine_options=None):
+        """Create an engine per replica URI, replacing the previous ones"""
+        self.dispose()
+        self._next = 0
+        self.engines = [
+            create_engine(uri, **(engine_options or {}))
+            for uri in uris
+        ]
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+        self.healthy = list(self.engines)
+        self._checked_at = monotonic()
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = []
+        self.healthy = []
+
+    def after_fork(self):
+        """Drop the connections inherited from the parent process without
+        closing them, the parent keeps using them"""
+        for engine in self.engines:
+            engine.dispose(close=False)
+
+    def choose(self):
+        """The next healthy replica, None when there is none"""
+        with self._lock:
+            if not self.healthy:
+                return None
+            engine = self.healthy[self._next % len(self.healthy)]
+            self._next += 1
+            return engine
+
+    def mark_down(self, engine):
+        with self._lock:
+            if engine in self.healthy:
+                self.healthy = [
+                    healthy for healthy in self.healthy if healthy is not engine
+                ]
+
+    def check(self):
+        """SELECT 1 on every replica, returns the number of healthy ones"""
+        healthy = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except Exception:
+                continue
+            healthy.append(engine)
+
+        with self._lock:
+            self.healthy = healthy
+            self._checked_at = monotonic()
+        return len(healthy)
+
+    def check_if_due(self, interval):
+        """check() at most once every interval seconds, 0 disables the
+        checks"""
+        if (
+            self.engines
+            and interval
+            and monotonic() - self._checked_at >= interval
+        ):
+            self.check()
+
+    def _on_error(self, context):
+        # a lost or refused connection takes the replica out of the
+        # rotation until the next health check
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+
+def replica_reads(view):
+    """Let the reads of a view go to a replica"""
+    @wraps(view)
+    def replica_view(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+
+    return replica_view
+
+
+def replica_engine():
+    """Replica engine of the current request, None to read from the
+    primary. A request reads from a single replica, its count and page
+    queries see the same data"""
+    if not has_request_context():
+        return None
+    if not g.get("replica_reads") or g.get("primary_reads"):
+        return None
+    if "replica" not in g:
+        g.replica = replica_set.choose()
+    return g.replica
+
+
+def primary_reads():
+    """Send the following reads of the request to the primary, e.g to
+    read a row a replica does not have yet
+
+    Returns:
+        bool: True when the request was reading from a replica
+    """
+    if not has_request_context():
+        return False
+    from_replica = g.get("replica") is not None and not g.get("primary_reads")
+    g.primary_reads = True
+    return from_replica
+
+
+def mark_written(session, flush_context):
+    """after_flush hook: the rest of the request reads its own writes"""
+    if has_request_context():
+        g.primary_reads = True
+
+
+replica_set = ReplicaSet()
@@ -1,11 +1,43 @@
 from unicodedata import category
+import asyncio
+import gzip
 import unittest
 import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Event
+from time import sleep
+from unittest.mock import patch
+from asgiref.testing import ApplicationCommunicator
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, inspect, Integer, text
+from sqlalchemy.engine import Engine
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
 
 
 from flaskr import create_app
-from models import (setup_db, Question, Category)
+from flaskr.asgi import create_asgi_app
+from flaskr.cache import CacheBackend, CategoriesCache, LocalCache, RedisCache, WriteBroadcast
+from flaskr.coalescing import CoalescedResponses, coalesced_responses, SingleFlight
+from flaskr.http_cache import conditional, data_version, DataVersion
+from flaskr.index import question_index, QuestionIndex
+from flaskr.sampling import parse_difficulty
+from flaskr.quiz import pick_question_id, pick_quiz_question_ids, quiz_sessions, QuizSessions
+from flaskr.search import InvertedIndexSearch, SearchEngine, search_engine
+from flaskr.startup import run_fork_hooks, warmup
+from flaskr.suggest import SuggestIndex
+from migrations import applied_versions, apply_migrations, MIGRATIONS
+from benchmarks.endpoints import MIXES, regressions, run, Scenarios
+from benchmarks.seed import seed_app
+from models import (db, setup_db, Question, Category)
+from replicas import replica_reads, replica_set, ReplicaSet
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -35,6 +67,100 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def test_fetch_pool_metrics(self):
+        """Connection pool metrics of the worker
+        """
+        response = self.client.get("/metrics/pool")
+        metrics = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        for key in ("checkouts", "checked_out", "overflow", "timeouts"):
+            self.assertIn(key, metrics)
+
+    def test_fetch_metrics(self):
+        """Prometheus metrics of the worker
+
+        test:
+            - the requests served are counted per route
+            - cache and pool metrics are exposed
+        """
+        self.client.get("/api/categories")
+        response = self.client.get("/metrics")
+        metrics = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn(
+            'trivia_responses_total{route="/api/categories",method="GET",status="200"}',
+            metrics
+        )
+        self.assertIn('trivia_sql_queries_per_request_count{route="/api/categories"', metrics)
+        self.assertIn('trivia_cache_hits_total{cache="categories"}', metrics)
+        self.assertIn("trivia_db_pool_checked_out", metrics)
+
+    def test_asgi_matches_wsgi(self):
+        """The async views answer like the Flask views
+
+        test:
+            - same status and body for the categories and a questions page
+            - same Access-Control headers for an allowed origin
+        """
+        asgi_app = create_asgi_app()
+        origin = "http://localhost:3000"
+
+        async def get(path, query_string):
+            communicator = ApplicationCommunicator(asgi_app, {
+                "type": "http",
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "query_string": query_string.encode(),
+                "headers": [(b"origin", origin.encode())],
+            })
+            await communicator.send_input({"type": "http.request", "body": b""})
+            start = await communicator.receive_output()
+            body = await communicator.receive_output()
+            await asgi_app.engine.dispose()
+            return start["status"], start["headers"], body["body"]
+
+        def access_controls(headers):
+            return sorted(
+                (name.lower(), value)
+                for name, value in headers
+                if name.lower().startswith("access-control-")
+            )
+
+        for path, query_string in (("/api/categories", ""), ("/api/questions", "page=1")):
+            status, headers, body = asyncio.run(get(path, query_string))
+            response = self.client.get(
+                f"{path}?{query_string}",
+                headers={"Origin": origin}
+            )
+
+            self.assertEqual(status, response.status_code)
+            self.assertEqual(body, response.data)
+            self.assertEqual(
+                access_controls(
+                    (name.decode(), value.decode()) for name, value in headers
+                ),
+                access_controls(response.headers)
+            )
+
+    def test_fetch_questions_gzip(self):
+        """Large responses are compressed for clients accepting gzip
+        """
+        plain = self.client.get('/api/questions?page=1')
+        response = self.client.get(
+            '/api/questions?page=1',
+            headers={"Accept-Encoding": "gzip"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
     def test_fetch_categories(self):
         """Fetch all categories
         
@@ -49,6 +175,33 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertListEqual(list(categories.keys()), ["categories"])
 
+    def test_fetch_categories_not_modified(self):
+        """Revalidating with the ETag returns 304 until the data changes
+        
+        test: 
+            - ETag and Cache-Control headers
+            - status code 304 Not Modified
+        """
+        response = self.client.get("/api/categories")
+        etag = response.headers["ETag"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Cache-Control", response.headers)
+
+        response = self.client.get(
+            "/api/categories", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_fetch_categories_vary_on_origin(self):
+        """Shared caches keep the CORS headers of each origin apart
+        """
+        response = self.client.get(
+            "/api/categories", headers={"Origin": "http://localhost:3000"})
+
+        self.assertIn("Origin", response.vary)
+
     def test_get_by_category(self):
         """Get questions by category
         """
@@ -76,6 +229,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res_data["message"], "resource not found")
         
         
+    def test_get_by_category_not_found(self):
+        """an unknown category id returns 404 instead of crashing
+        """
+        response = self.client.get("/api/categories/100000/questions")
+        res_data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(res_data["message"], "resource not found")
+
+    def test_get_by_category_paginated(self):
+        """a page of questions keeps the total of the category
+        """
+        category = Category.query.first()
+
+        response = self.client.get(
+            f"/api/categories/{category.id}/questions?page=1&limit=1")
+        questions = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(questions["questions"]), 1)
+        self.assertGreaterEqual(
+            questions["total_questions"], len(questions["questions"]))
+        
     def test_create_category(self):
         '''Create a new Category'''
 
@@ -143,6 +319,10 @@ class TriviaTestCase(unittest.TestCase):
             self.assertEqual(status_code, 200)
             self.assertEqual(response_data, success_response_mock)
             self.assertNotEqual(response_data, "")
+
+            # the new type is stored
+            db.session.expire_all()
+            self.assertEqual(Category.query.get(category.id).type, payload["type"])
         
     
     def test_delete_category(self):
@@ -205,6 +385,34 @@ class TriviaTestCase(unittest.TestCase):
         self.assertNotIsInstance(questions["questions"], tuple)
 
 
+    def test_fetch_questions_with_cursor(self):
+        """Walk every question with cursor pagination
+        """
+        limit = 5
+        seen_ids = []
+        cursor = ""
+
+        while cursor is not None:
+            response = self.client.get(
+                f'/api/questions?after={cursor}&limit={limit}')
+            questions = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(questions["questions"]), limit)
+            seen_ids.extend(question["id"] for question in questions["questions"])
+            cursor = questions["next_cursor"]
+
+        # every question once, in id order
+        self.assertListEqual(seen_ids, sorted(set(seen_ids)))
+        self.assertEqual(len(seen_ids), questions["total_questions"])
+
+    def test_fetch_questions_with_invalid_cursor(self):
+        """An unknown cursor is a bad request
+        """
+        response = self.client.get('/api/questions?after=not-a-cursor')
+
+        self.assertEqual(response.status_code, 400)
+
     def test_delete_question(self):
         """Delete a question with a particular Id
         """
@@ -277,7 +485,115 @@ class TriviaTestCase(unittest.TestCase):
         # response message
         self.assertNotEqual(response.get_data(True), "")
         self.assertEqual(response.get_data(True), response_msg_mock)
-        
+
+    def test_create_question_with_invalid_category(self):
+        """An unknown category or a difficulty out of 1-5 is a bad request
+        and nothing is inserted
+        """
+        total_questions = Question.query.count()
+        for category, difficulty in (("abc", 1), ("4", "hard"), ("4", 9)):
+            payload = {
+                'question': 'Which category is this?',
+                'answer': "None",
+                'category': category,
+                'difficulty': difficulty
+            }
+            response = self.client.post('/api/questions', data=json.dumps(payload))
+
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Question.query.count(), total_questions)
+
+    def test_bulk_import_questions(self):
+        """Import JSON Lines, valid rows are inserted and invalid rows reported
+        """
+        category = Category.query.first()
+        rows = [
+            {'question': 'Bulk question one?', 'answer': 'One',
+             'category': category.id, 'difficulty': 1},
+            {'question': 'Bulk question two?', 'answer': 'Two',
+             'category': category.type, 'difficulty': 2},
+            {'question': 'Bulk question without answer?',
+             'category': category.id, 'difficulty': 3},
+        ]
+        body = "\n".join(json.dumps(row) for row in rows)
+
+        response = self.client.post(
+            '/api/questions/bulk', data=body,
+            content_type='application/x-ndjson')
+        report = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual(report["failed"], 1)
+        self.assertEqual(report["errors"][0]["line"], 3)
+
+    def test_bulk_import_questions_csv(self):
+        """Import a CSV body with a header row
+        """
+        category = Category.query.first()
+        body = (
+            "question,answer,category,difficulty\n"
+            f"Bulk CSV question?,Yes,{category.id},4\n"
+        )
+
+        response = self.client.post(
+            '/api/questions/bulk', data=body, content_type='text/csv')
+        report = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(report["imported"], 1)
+        self.assertListEqual(report["errors"], [])
+
+    def test_bulk_import_questions_invalid_utf8(self):
+        """A line that is not UTF-8 is reported, the others are imported
+        """
+        category = Category.query.first()
+        row = json.dumps({'question': 'Bulk question?', 'answer': 'Yes',
+                          'category': category.id, 'difficulty': 1})
+        body = f"{row}\n".encode() + b'{"question": "\xff"}\n' + f"{row}\n".encode()
+
+        response = self.client.post(
+            '/api/questions/bulk', data=body,
+            content_type='application/x-ndjson')
+        report = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual(report["errors"][0]["line"], 2)
+
+    def test_export_questions(self):
+        """Stream the questions of a category as JSON Lines
+        """
+        category = Category.query.first()
+
+        response = self.client.get(
+            f'/api/questions/export?format=jsonl&category={category.id}')
+        questions = [
+            json.loads(line)
+            for line in response.get_data(True).splitlines()
+        ]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        for question in questions:
+            self.assertEqual(int(question["category"]), category.id)
+
+    def test_export_questions_csv(self):
+        """CSV exports start with a header row
+        """
+        response = self.client.get('/api/questions/export?format=csv')
+        header = response.get_data(True).splitlines()[0]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(header, "id,question,answer,category,difficulty")
+
+    def test_export_questions_unknown_format(self):
+        """Unknown export formats are a bad request
+        """
+        response = self.client.get('/api/questions/export?format=xml')
+
+        self.assertEqual(response.status_code, 400)
+
     def test_search_question(self):
         """Search for question by searchTerm in the request object
         
@@ -315,6 +631,99 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(int(questions["current_category"]), 2)
         self.assertIsInstance(questions["questions"], list)
     
+    def test_search_question_is_case_insensitive(self):
+        """Search terms match regardless of case
+        """
+        lower = self.client.post(
+            '/api/questions?current_category=null',
+            data=json.dumps({"searchTerm": "what"}))
+        upper = self.client.post(
+            '/api/questions?current_category=null',
+            data=json.dumps({"searchTerm": "WHAT"}))
+
+        self.assertEqual(lower.status_code, 200)
+        self.assertEqual(
+            json.loads(lower.data)["total_questions"],
+            json.loads(upper.data)["total_questions"])
+
+    def test_search_question_paginated(self):
+        """A page of search results keeps the total of every match
+        """
+        payload = {
+            "searchTerm": "What",
+            "page": 1,
+            "limit": 2
+        }
+
+        response = self.client.post(
+            '/api/questions?current_category=null', data=json.dumps(payload))
+        questions = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(questions["questions"]), 2)
+        self.assertGreaterEqual(
+            questions["total_questions"], len(questions["questions"]))
+
+    def test_search_question_with_invalid_page(self):
+        """page and limit must be positive integers
+        """
+        for paging in ({"page": "2"}, {"page": 0}, {"page": -1}, {"page": 1, "limit": 0}):
+            response = self.client.post(
+                '/api/questions?current_category=null',
+                data=json.dumps({"searchTerm": "What", **paging}))
+
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_results_are_cached_until_a_write(self):
+        """Repeated searches are served from the search cache, creating a
+        question clears it
+
+        test:
+            - the same normalised term is a cache hit
+            - the created question is found by the next search
+        """
+        self.client.post('/api/questions', data=json.dumps({"searchTerm": "zebra"}))
+        hits = search_engine.results.hits
+        response = self.client.post(
+            '/api/questions', data=json.dumps({"searchTerm": "  ZEBRA! "}))
+
+        self.assertEqual(search_engine.results.hits, hits + 1)
+
+        payload = {
+            'question': 'Which zebra crossed the road?',
+            'answer': "The striped one",
+            'category': Category.query.first().id,
+            'difficulty': 1
+        }
+        self.client.post('/api/questions', data=json.dumps(payload))
+        after = self.client.post('/api/questions', data=json.dumps({"searchTerm": "zebra"}))
+
+        self.assertEqual(
+            json.loads(after.data)["total_questions"],
+            json.loads(response.data)["total_questions"] + 1)
+
+    def test_suggest_questions(self):
+        """Type-ahead completes the last word of the prefix
+
+        test:
+            - status code 200 OK
+            - every suggestion starts with the last word typed
+        """
+        response = self.client.get('/api/questions/suggest?prefix=what%20wh&limit=5')
+        result = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(result["suggestions"]), 5)
+        for word in result["suggestions"]:
+            self.assertTrue(word.startswith("wh"))
+
+    def test_suggest_questions_without_prefix(self):
+        """The prefix query argument is required
+        """
+        response = self.client.get('/api/questions/suggest')
+
+        self.assertEqual(response.status_code, 400)
+
     def test_quizzes(self):
         """If proper request object is specified, return a question object
         """
@@ -333,6 +742,66 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(list(result.keys()), ["question"])
 
+    def test_quizzes_in_a_difficulty_band(self):
+        """The question is picked among the requested difficulties
+        """
+        question = Question.query.filter(Question.difficulty != None).first()
+        payload = {
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "ALL"},
+            "difficulty": [question.difficulty, question.difficulty],
+            "strategy": "adaptive",
+            "answers": [True, False]
+        }
+        response = self.client.post('/api/quizzes', data=json.dumps(payload))
+        result = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(result["question"]["difficulty"], question.difficulty)
+
+    def test_quizzes_with_unknown_strategy(self):
+        """An unknown strategy is a bad request
+        """
+        payload = {
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "ALL"},
+            "strategy": "hardest"
+        }
+        response = self.client.post('/api/quizzes', data=json.dumps(payload))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_quizzes_batch(self):
+        """A batch holds distinct questions, none of them previous ones
+        """
+        question = Question.query.first()
+        payload = {
+            "previous_questions": [question.id],
+            "quiz_category": {"id": 0, "type": "ALL"},
+            "count": 5
+        }
+        response = self.client.post('/api/quizzes/batch', data=json.dumps(payload))
+        result = json.loads(response.data)
+        ids = [question["id"] for question in result["questions"]]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(result["total_questions"], len(ids))
+        self.assertLessEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotIn(question.id, ids)
+
+    def test_quizzes_batch_with_invalid_count(self):
+        """count must be a positive integer
+        """
+        payload = {
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "ALL"},
+            "count": 0
+        }
+        response = self.client.post('/api/quizzes/batch', data=json.dumps(payload))
+
+        self.assertEqual(response.status_code, 400)
+
     def test_quizzes_if_not_formatted_well(self):
         """If data is not formatted as below, this test ensures that the format is adhere to.
         
@@ -352,6 +821,1025 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(response.status_code, 400)
         
+    def test_quiz_session(self):
+        """Play a whole category through a quiz session, no question twice
+        """
+        question = Question.query.first()
+        category = Category.query.filter_by(id=question.category).first()
+        payload = {
+            "quiz_category": {
+                "id": category.id,
+                "type": category.type
+            }
+        }
+
+        response = self.client.post('/api/quizzes/sessions', data=json.dumps(payload))
+        session = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+
+        served_ids = []
+        for _ in range(session["total_questions"]):
+            response = self.client.post(
+                f'/api/quizzes/sessions/{session["session_id"]}/next')
+            self.assertEqual(response.status_code, 200)
+            served_ids.append(json.loads(response.data)["question"]["id"])
+
+        self.assertEqual(len(served_ids), len(set(served_ids)))
+
+        # the category is exhausted
+        response = self.client.post(
+            f'/api/quizzes/sessions/{session["session_id"]}/next')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.delete(
+            f'/api/quizzes/sessions/{session["session_id"]}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_quiz_session_not_found(self):
+        """Unknown or ended sessions return 404
+        """
+        response = self.client.post('/api/quizzes/sessions/unknown/next')
+
+        self.assertEqual(response.status_code, 404)
+        
+class CacheBackendTestCase(unittest.TestCase):
+    """This class represents the cache backends test case"""
+
+    def test_local_cache_evicts_least_recently_used(self):
+        """The LRU keeps max_entries keys, dropping the least recently used
+        """
+        cache = LocalCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_incomplete_backend_is_not_instantiable(self):
+        """A backend missing a method of the interface fails when created
+        """
+        class PeekOnlyCache(CacheBackend):
+            def peek(self, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            PeekOnlyCache()
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_cache_is_shared(self):
+        """Two workers on the same server see each other's keys and counters
+        """
+        server = fakeredis.FakeServer()
+        worker_a = RedisCache(fakeredis.FakeRedis(server=server))
+        worker_b = RedisCache(fakeredis.FakeRedis(server=server))
+
+        worker_a.set("search:what", {"ids": [1]})
+        self.assertEqual(worker_b.get("search:what"), {"ids": [1]})
+
+        worker_b.delete("search:what")
+        self.assertIsNone(worker_a.get("search:what"))
+
+        worker_a.incr("data-version")
+        self.assertEqual(worker_b.incr("data-version"), 2)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_cache_listens_after_fork(self):
+        """A forked worker subscribes again and keeps receiving messages
+        """
+        server = fakeredis.FakeServer()
+        worker = RedisCache(fakeredis.FakeRedis(server=server))
+        received = Queue()
+        worker.subscribe("writes", received.put)
+
+        worker.after_fork()
+        RedisCache(fakeredis.FakeRedis(server=server)).publish("writes", "hello")
+
+        self.assertEqual(received.get(timeout=5), "hello")
+        worker.close()
+
+    def test_write_broadcast_logs_bad_messages(self):
+        """A message that can't be replayed is logged, the listener keeps
+        running
+        """
+        with self.assertLogs("flaskr.cache", "ERROR"):
+            WriteBroadcast().receive("not a write")
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_cache_listens_again_after_a_failure(self):
+        """A failed listener subscribes again once the server answers and
+        reports the messages it may have missed
+        """
+        server = fakeredis.FakeServer()
+        worker = RedisCache(fakeredis.FakeRedis(server=server))
+        worker.retry_delay = 0.01
+        received = Queue()
+        reconnected = Queue()
+        worker.subscribe("writes", received.put)
+        worker.on_reconnect(lambda: reconnected.put(True))
+
+        server.connected = False
+        sleep(0.3)
+        server.connected = True
+
+        self.assertTrue(reconnected.get(timeout=5))
+        RedisCache(fakeredis.FakeRedis(server=server)).publish("writes", "hello")
+        self.assertEqual(received.get(timeout=5), "hello")
+        worker.close()
+
+
+class WriteDuringLoad(CategoriesCache):
+    """Categories cache whose loads read fixed rows, a category write can
+    be committed while a load runs"""
+
+    def __init__(self, rows):
+        super().__init__(ttl=60)
+        self.rows = rows
+        self.write_during_load = None
+
+    def _load(self):
+        entry = self._entry_of(self.rows)
+        if self.write_during_load is not None:
+            self.rows, self.write_during_load = self.write_during_load, None
+            self.on_write("categories", "update", {"id": 1})
+        return entry
+
+
+class CategoriesCacheTestCase(unittest.TestCase):
+    """This class represents the categories cache test case"""
+
+    def test_cached_until_a_category_write(self):
+        """The map is loaded once, and again after a category write
+        """
+        categories = WriteDuringLoad([(1, "Science")])
+        self.assertEqual(categories.mapping(), {"1": "Science"})
+
+        categories.rows = [(1, "Art")]
+        self.assertEqual(categories.type_of(1), "Science")
+        categories.on_write("questions", "insert", {"id": 9})
+        self.assertEqual(categories.type_of(1), "Science")
+
+        categories.on_write("categories", "update", {"id": 1})
+        self.assertEqual(categories.id_of("Art"), 1)
+        self.assertEqual(categories.misses, 2)
+
+    def test_load_across_a_write_is_not_cached(self):
+        """A load that read the categories of before a write is served to
+        its request only
+        """
+        categories = WriteDuringLoad([(1, "Science")])
+        categories.write_during_load = [(1, "Art")]
+
+        self.assertEqual(categories.mapping(), {"1": "Science"})
+        self.assertEqual(categories.mapping(), {"1": "Art"})
+
+    def test_fill_across_a_write_is_not_cached(self):
+        """Rows read by the async views before a write are not cached
+        """
+        categories = WriteDuringLoad([(1, "Art")])
+        generation = categories.generation
+        categories.invalidate()
+
+        loaded = categories.fill([(1, "Science")], generation)
+
+        self.assertEqual(loaded.type_of(1), "Science")
+        self.assertTrue(categories.stale())
+        self.assertEqual(categories.type_of(1), "Art")
+
+
+class ReplicaSetTestCase(unittest.TestCase):
+    """This class represents the read replicas test case"""
+
+    def setUp(self):
+        self.replicas = ReplicaSet()
+        self.replicas.configure(["sqlite://", "sqlite://"])
+
+    def tearDown(self):
+        self.replicas.dispose()
+
+    def test_replicas_round_robin(self):
+        """Reads go to each replica in turn
+        """
+        first, second = self.replicas.engines
+
+        self.assertEqual(
+            [self.replicas.choose() for _ in range(4)],
+            [first, second, first, second]
+        )
+
+    def test_replica_down_is_skipped(self):
+        """A replica marked down serves no reads until a check passes
+        """
+        first, second = self.replicas.engines
+        self.replicas.mark_down(first)
+
+        self.assertEqual({self.replicas.choose() for _ in range(4)}, {second})
+
+        self.replicas.mark_down(second)
+        self.assertIsNone(self.replicas.choose())
+
+        self.assertEqual(self.replicas.check(), 2)
+        self.assertEqual(len({self.replicas.choose() for _ in range(4)}), 2)
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the replica routing test case, on a primary
+    and a replica SQLite file holding different categories"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        uris = {}
+        for name in ("primary", "replica"):
+            uris[name] = f"sqlite:///{os.path.join(self.directory.name, name)}.db"
+            engine = create_engine(uris[name])
+            db.Model.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Category.__table__.insert(), {"type": name})
+            engine.dispose()
+
+        self.app = Flask(__name__)
+        setup_db(self.app, uris["primary"], migrate=False, replica_uris=[uris["replica"]])
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        replica_set.configure([])
+        coalesced_responses.clear()
+        self.directory.cleanup()
+
+    def read(self, view):
+        with self.app.test_request_context("/api/categories"):
+            return view()
+
+    @staticmethod
+    def category_types():
+        return [category.type for category in Category.query.order_by(Category.id)]
+
+    def test_reads_go_to_the_replica(self):
+        """A view reading from replicas gets the rows of the replica
+        """
+        self.assertEqual(self.read(replica_reads(self.category_types)), ["replica"])
+        self.assertEqual(self.read(self.category_types), ["primary"])
+
+    def test_reads_after_a_flush_stay_on_the_primary(self):
+        """A request reads its own writes once it flushed
+        """
+        def write_then_read():
+            db.session.add(Category("written"))
+            db.session.flush()
+            types = self.category_types()
+            db.session.rollback()
+            return types
+
+        self.assertEqual(
+            self.read(replica_reads(write_then_read)),
+            ["primary", "written"]
+        )
+
+    def test_no_healthy_replica_reads_the_primary(self):
+        """Reads fall back to the primary when every replica is down
+        """
+        replica, = replica_set.engines
+        replica_set.mark_down(replica)
+
+        self.assertEqual(self.read(replica_reads(self.category_types)), ["primary"])
+
+    def test_etagged_views_read_the_primary(self):
+        """The bodies cached under the primary's data version are read
+        from the primary
+        """
+        def view():
+            return json.dumps(self.category_types())
+
+        response = self.read(conditional(replica_reads(view)))
+
+        self.assertEqual(json.loads(response.get_data()), ["primary"])
+
+
+class StartupTestCase(unittest.TestCase):
+    """This class represents the production startup test case, on a
+    SQLite file migrated beforehand like `flask db upgrade` does"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_uri = f"sqlite:///{os.path.join(self.directory.name, 'trivia.db')}"
+        engine = create_engine(self.database_uri)
+        db.Model.metadata.create_all(engine)
+        apply_migrations(engine)
+        with engine.begin() as connection:
+            connection.execute(Category.__table__.insert(), {"id": 1, "type": "Science"})
+            connection.execute(Question.__table__.insert(), {
+                "question": "What is H2O?",
+                "answer": "Water",
+                "category": 1,
+                "difficulty": 1
+            })
+        engine.dispose()
+
+        self.statements = []
+        event.listen(Engine, "before_cursor_execute", self.record_statement)
+
+    def tearDown(self):
+        event.remove(Engine, "before_cursor_execute", self.record_statement)
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.directory.cleanup()
+
+    def record_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def create_production_app(self):
+        with patch.multiple(
+            "flaskr",
+            SQLALCHEMY_DATABASE_URI=self.database_uri,
+            SQLALCHEMY_REPLICA_URIS=[],
+            PRODUCTION_STARTUP=True,
+            MIGRATE_ON_STARTUP=False,
+            WARM_ON_STARTUP=False
+        ):
+            self.app = create_app()
+        return self.app
+
+    def test_production_startup_runs_no_query(self):
+        """create_app() runs no DDL and no query, the first request loads
+        the indexes
+        """
+        app = self.create_production_app()
+
+        self.assertEqual(self.statements, [])
+        self.assertFalse(warmup.done)
+
+        response = app.test_client().get('/api/categories')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(warmup.done)
+        self.assertEqual(question_index.count(), 1)
+        self.assertFalse([
+            statement for statement in self.statements
+            if statement.lstrip().upper().startswith(("CREATE", "ALTER", "DROP"))
+        ])
+
+    def test_forked_worker_gets_its_own_boot_id(self):
+        """Workers forked from a preloaded app send their own ETags
+        """
+        self.create_production_app()
+        boot_id = data_version.boot_id
+
+        run_fork_hooks()
+
+        self.assertNotEqual(data_version.boot_id, boot_id)
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """This class represents the schema migrations test case, on a SQLite
+    file with the schema the app had before the migrations"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.directory.name, 'trivia.db')}"
+        )
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE categories (id INTEGER NOT NULL PRIMARY KEY, type VARCHAR)"
+            ))
+            connection.execute(text(
+                "CREATE TABLE questions (id INTEGER NOT NULL PRIMARY KEY, "
+                "question VARCHAR, answer VARCHAR, category VARCHAR, difficulty INTEGER)"
+            ))
+            connection.execute(text(
+                "INSERT INTO categories (id, type) "
+                "VALUES (1, 'Science'), (2, 'Art'), (3, 'Science')"
+            ))
+            connection.execute(text(
+                "INSERT INTO questions (id, question, answer, category, difficulty) "
+                "VALUES (1, 'What is H2O?', 'Water', '3', 1), "
+                "(2, 'Who painted Guernica?', 'Picasso', '2', 2), "
+                "(3, 'Orphan?', 'Yes', '9', 3)"
+            ))
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_upgrade_twice(self):
+        """The migrations type the category column, index the hot columns
+        and merge the duplicated categories, once
+        """
+        self.assertEqual(len(apply_migrations(self.engine)), len(MIGRATIONS))
+        self.assertEqual(apply_migrations(self.engine), [])
+        self.assertEqual(
+            applied_versions(self.engine),
+            {version for version, _, _ in MIGRATIONS}
+        )
+
+        inspector = inspect(self.engine)
+        columns = {column["name"]: column for column in inspector.get_columns("questions")}
+        indexes = {
+            index["name"]
+            for table in ("questions", "categories")
+            for index in inspector.get_indexes(table)
+        }
+        with self.engine.connect() as connection:
+            categories = connection.execute(text(
+                "SELECT id, type FROM categories ORDER BY id"
+            )).fetchall()
+            questions = connection.execute(text(
+                "SELECT id, category, typeof(category) FROM questions ORDER BY id"
+            )).fetchall()
+
+        self.assertIsInstance(columns["category"]["type"], Integer)
+        self.assertEqual(
+            indexes,
+            {"ix_questions_category", "ix_questions_difficulty", "ix_categories_type"}
+        )
+        self.assertEqual(categories, [(1, "Science"), (2, "Art")])
+        self.assertEqual(questions, [(1, 1, "integer"), (2, 2, "integer"), (3, None, "null")])
+
+
+class QuestionIndexTestCase(unittest.TestCase):
+    """This class represents the question index test case, on a SQLite
+    file"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        setup_db(
+            self.app,
+            f"sqlite:///{os.path.join(self.directory.name, 'trivia.db')}",
+            migrate=False
+        )
+        self.context = self.app.app_context()
+        self.context.push()
+        self.execute(Category.__table__.insert(), [{"id": 1, "type": "Science"}, {"id": 2, "type": "Art"}])
+        self.execute(Question.__table__.insert(), [
+            {"id": question_id, "question": "?", "answer": "!", "category": category, "difficulty": 1}
+            for question_id, category in ((1, 1), (2, 2), (3, 1), (4, 2))
+        ])
+        self.index = QuestionIndex()
+        self.index.build()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def execute(self, statement, parameters=None):
+        with db.engine.begin() as connection:
+            connection.execute(statement, parameters)
+
+    def test_build_add_and_remove(self):
+        """Writes keep the ids of each category and bucket sorted
+        """
+        self.assertEqual(list(self.index.ids(1)), [1, 3])
+        self.assertEqual(self.index.counts(), {1: 2, 2: 2})
+
+        self.index.add(0, 1, 3)
+        self.index.remove(2)
+
+        self.assertEqual(list(self.index.ids()), [0, 1, 3, 4])
+        self.assertEqual(list(self.index.ids("1")), [0, 1, 3])
+        self.assertEqual(list(self.index.ids(2)), [4])
+        self.assertEqual(list(self.index.buckets(1)[(1, 3)]), [0])
+
+    def test_verify_detects_offsetting_drift(self):
+        """A category whose count is right but whose ids are not is out of
+        sync, and repaired
+        """
+        self.execute(text("UPDATE questions SET category = 2 WHERE id = 1"))
+        self.execute(text("UPDATE questions SET category = 1 WHERE id = 2"))
+
+        self.assertFalse(self.index.verify(repair=False))
+        self.assertFalse(self.index.verify())
+        self.assertEqual(list(self.index.ids(1)), [2, 3])
+        self.assertTrue(self.index.verify())
+
+    def test_category_delete_detaches_its_questions(self):
+        """Deleting a category moves its questions to no category
+        """
+        self.execute(text("UPDATE questions SET category = NULL WHERE category = 2"))
+        self.execute(text("DELETE FROM categories WHERE id = 2"))
+
+        self.index.on_write("categories", "delete", {"id": 2})
+
+        self.assertEqual(list(self.index.ids(2)), [])
+        self.assertEqual(list(self.index.ids(None)), [1, 2, 3, 4])
+        self.assertEqual(self.index.counts(), {1: 2, None: 2})
+        self.assertTrue(self.index.verify(repair=False))
+
+
+class SQLiteApiTestCase(unittest.TestCase):
+    """This class represents the API test case on a seeded SQLite file,
+    for the tests that must run without a Postgres server"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with patch.multiple(
+            "flaskr",
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(self.directory.name, 'trivia.db')}",
+            SQLALCHEMY_REPLICA_URIS=[]
+        ):
+            self.app = create_app()
+        seed_app(self.app, 40, 4)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        coalesced_responses.clear()
+        self.directory.cleanup()
+
+    def test_category_write_invalidates_the_categories(self):
+        """A renamed category is served at once, under a new ETag
+        """
+        response = self.client.get("/api/categories")
+        etag = response.headers["ETag"]
+        self.assertEqual(json.loads(response.data)["categories"]["1"], "Category 1")
+
+        renamed = self.client.put("/api/categories/1", data=json.dumps({"type": "Rivers"}))
+        self.assertEqual(renamed.status_code, 200)
+
+        response = self.client.get("/api/categories", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(json.loads(response.data)["categories"]["1"], "Rivers")
+
+        questions = json.loads(self.client.get("/api/questions?page=1").data)
+        self.assertEqual(questions["categories"]["1"], "Rivers")
+
+    def test_question_rows_match_the_models(self):
+        """The column-only payloads match Question.format()
+        """
+        for url in ("/api/questions?page=2", "/api/categories/2/questions"):
+            questions = json.loads(self.client.get(url).data)["questions"]
+
+            with self.app.app_context():
+                expected = [
+                    question.format()
+                    for question in Question.query.filter(
+                        Question.id.in_([question["id"] for question in questions])
+                    ).order_by(Question.id)
+                ]
+
+            self.assertTrue(questions)
+            self.assertEqual(sorted(questions, key=lambda question: question["id"]), expected)
+
+    def test_accept_encoding_negotiation(self):
+        """Bodies are compressed for the clients accepting it, and vary on
+        Accept-Encoding
+        """
+        plain = self.client.get("/api/questions?page=1", headers={"Accept-Encoding": "identity"})
+        compressed = self.client.get(
+            "/api/questions?page=1",
+            headers={"Accept-Encoding": "gzip;q=0.5, identity;q=0.1"}
+        )
+        refused = self.client.get("/api/questions?page=1", headers={"Accept-Encoding": "gzip;q=0"})
+
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertNotIn("Content-Encoding", refused.headers)
+        for response in (plain, compressed, refused):
+            self.assertIn("Accept-Encoding", response.vary)
+            self.assertEqual(response.headers["ETag"], plain.headers["ETag"])
+
+    def test_asgi_matches_flask(self):
+        """The async views send the bodies and ETags of the Flask views
+        """
+        uri = self.app.config["SQLALCHEMY_DATABASE_URI"]
+        with patch.multiple("flaskr", SQLALCHEMY_DATABASE_URI=uri, SQLALCHEMY_REPLICA_URIS=[]), \
+                patch("flaskr.asgi.SQLALCHEMY_DATABASE_URI", uri):
+            asgi_app = create_asgi_app()
+
+        async def get(path, query_string, accept_encoding):
+            communicator = ApplicationCommunicator(asgi_app, {
+                "type": "http",
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "query_string": query_string.encode(),
+                "headers": [(b"accept-encoding", accept_encoding.encode())],
+            })
+            await communicator.send_input({"type": "http.request", "body": b""})
+            start = await communicator.receive_output()
+            body = await communicator.receive_output()
+            return start["status"], dict(
+                (name.decode().lower(), value.decode()) for name, value in start["headers"]
+            ), body["body"]
+
+        async def get_all(requests):
+            try:
+                return [await get(*request) for request in requests]
+            finally:
+                await asgi_app.engine.dispose()
+
+        requests = [
+            (path, query_string, accept_encoding)
+            for path, query_string in (
+                ("/api/categories", ""),
+                ("/api/questions", "page=1"),
+                ("/api/questions", "page=99"),
+            )
+            for accept_encoding in ("identity", "gzip")
+        ]
+        with patch.object(data_version, "local_ttl", 0):
+            asgi_responses = asyncio.run(get_all(requests))
+
+            for (path, query_string, accept_encoding), (status, headers, body) in zip(
+                requests, asgi_responses
+            ):
+                response = self.client.get(
+                    f"{path}?{query_string}",
+                    headers={"Accept-Encoding": accept_encoding}
+                )
+
+                self.assertEqual(status, response.status_code)
+                self.assertEqual(body, response.data)
+                for name in ("etag", "content-encoding", "vary"):
+                    self.assertEqual(headers.get(name), response.headers.get(name), name)
+
+    def test_benchmark_mixes_run_without_errors(self):
+        """Every request of every load test mix gets an expected status
+        """
+        for mix_name, mix in MIXES.items():
+            seed_app(self.app, 40, 4, spare_categories=10)
+            scenarios = Scenarios(40, 4, 0, spare_categories=10)
+            scenarios.sessions = [quiz_sessions.start()[0] for _ in range(2)]
+
+            results = run(self.app, scenarios, mix, 60, 2)
+
+            self.assertEqual(results["total"]["errors"], 0, mix_name)
+            self.assertEqual(results["total"]["requests"], 60)
+
+    def test_benchmark_regressions(self):
+        """Slower p95s, lower throughputs and extra queries beyond the
+        threshold are reported
+        """
+        baseline = {"quiz": {
+            "quiz": {"p95_ms": 2.0, "queries": 1.0},
+            "total": {"requests_per_second": 1000},
+        }}
+        results = {"quiz": {
+            "quiz": {"p95_ms": 2.2, "queries": 2.0},
+            "total": {"requests_per_second": 700},
+        }}
+
+        self.assertEqual(len(regressions(results, baseline, 0.2)), 2)
+        self.assertEqual(regressions(baseline, baseline, 0.2), [])
+
+
+class CoalescingTestCase(unittest.TestCase):
+    """This class represents the request coalescing test case"""
+
+    def test_local_etags_expire(self):
+        """Without a shared backend the ETags change every local_ttl
+        seconds, a worker does not see the writes of the others
+        """
+        version = DataVersion(local_ttl=5)
+        with patch("flaskr.http_cache.monotonic", side_effect=[101, 104, 106]):
+            etags = [version.etag("/api/categories?") for _ in range(3)]
+
+        self.assertEqual(etags[0], etags[1])
+        self.assertNotEqual(etags[1], etags[2])
+
+        version.bind(LocalCache(8))
+        self.assertEqual(version.etag("/api/categories?"), version.etag("/api/categories?"))
+
+    def test_single_flight_shares_one_computation(self):
+        """Concurrent callers of a key wait for the running computation
+        """
+        flight = SingleFlight()
+        started = Event()
+        release = Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "value"
+
+        with ThreadPoolExecutor(4) as executor:
+            leader = executor.submit(flight.do, "key", compute)
+            started.wait(5)
+            followers = [executor.submit(flight.do, "key", compute) for _ in range(3)]
+            while flight.joined < 3:
+                sleep(0.001)
+            release.set()
+
+            results = [leader.result()] + [follower.result() for follower in followers]
+
+        self.assertEqual(results, ["value"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_coalesced_responses_serve_stale_while_recomputing(self):
+        """The previous body is served, with its ETag, while the body of a
+        new data version is computed
+        """
+        responses = CoalescedResponses(max_entries=8, stale_seconds=60)
+        render = lambda body: lambda: (200, body, [])
+        responses.get("/api/questions?page=1", "v1", None, render(b"old"))
+
+        started = Event()
+        release = Event()
+
+        def slow_render():
+            started.set()
+            release.wait(5)
+            return 200, b"new", []
+
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(
+                responses.get, "/api/questions?page=1", "v2", None, slow_render
+            )
+            started.wait(5)
+            stale = responses.get("/api/questions?page=1", "v2", None, render(b"other"))
+            release.set()
+            fresh = leader.result()
+
+        self.assertEqual((stale["etag"], stale["body"]), ("v1", b"old"))
+        self.assertEqual((fresh["etag"], fresh["body"]), ("v2", b"new"))
+        self.assertEqual(
+            responses.get("/api/questions?page=1", "v2", None, render(b"other"))["body"],
+            b"new"
+        )
+        self.assertEqual(responses.stale_hits, 1)
+
+    def test_async_requests_share_one_computation(self):
+        """Concurrent coroutines of a path await the same body, which the
+        threaded lookups then reuse
+        """
+        responses = CoalescedResponses(max_entries=8, stale_seconds=60)
+        calls = []
+
+        async def render():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 200, b"body", []
+
+        async def requests():
+            return await asyncio.gather(*(
+                responses.get_async("/api/categories?", "v1", None, render)
+                for _ in range(4)
+            ))
+
+        entries = asyncio.run(requests())
+
+        self.assertEqual([entry["body"] for entry in entries], [b"body"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(responses.coalesced, 3)
+        self.assertIs(
+            responses.get("/api/categories?", "v1", None, lambda: (200, b"other", [])),
+            entries[0]
+        )
+
+
+class ListSearch:
+    """Search backend returning a fixed list of ids, a write can be
+    committed while a search runs"""
+
+    def __init__(self, engine, question_ids):
+        self.engine = engine
+        self.question_ids = question_ids
+        self.write_during_search = None
+
+    def search(self, search_term, category_id=None, search_answers=False):
+        question_ids = list(self.question_ids)
+        if self.write_during_search is not None:
+            self.question_ids, self.write_during_search = self.write_during_search, None
+            self.engine.on_write("questions", "delete", {"id": 1})
+        return question_ids
+
+    def on_write(self, table, action, record):
+        pass
+
+
+class SearchEngineTestCase(unittest.TestCase):
+    """This class represents the search results cache test case"""
+
+    def setUp(self):
+        self.engine = SearchEngine(cache_entries=8, cache_ttl=60)
+        self.backend = self.engine.backend = ListSearch(self.engine, [1, 2])
+
+    def test_results_are_cached_until_a_write(self):
+        """Searches are served from the cache until a question is written
+        """
+        self.assertEqual(self.engine.search("river"), (1, 2))
+        self.backend.question_ids = [2]
+        self.assertEqual(self.engine.search("river"), (1, 2))
+
+        self.engine.on_write("questions", "delete", {"id": 1})
+        self.assertEqual(self.engine.search("river"), (2,))
+
+    def test_search_across_a_write_is_not_cached(self):
+        """A search that read the data of before a write does not fill
+        the cache cleared by the write
+        """
+        self.backend.write_during_search = [2]
+
+        self.assertEqual(self.engine.search("river"), (1, 2))
+        self.assertEqual(self.engine.search("river"), (2,))
+
+
+class InvertedIndexSearchTestCase(unittest.TestCase):
+    """This class represents the in-process search index test case"""
+
+    def setUp(self):
+        self.index = InvertedIndexSearch()
+        for question_id, question in enumerate(
+            ["What river is longest?", "Which river is widest?"],
+            start=1
+        ):
+            self.index.on_write("questions", "insert", {
+                "id": question_id,
+                "question": question,
+                "answer": "Nile",
+                "category": 3
+            })
+
+    def test_writes_are_searchable(self):
+        """Inserted questions are found by prefix, deleted ones are not
+        """
+        self.assertEqual(self.index.search("riv"), [1, 2])
+        self.assertEqual(self.index.search("nile", search_answers=True), [1, 2])
+
+        self.index.on_write("questions", "delete", {"id": 1})
+
+        self.assertEqual(self.index.search("riv"), [2])
+        self.assertEqual(self.index.search("longest"), [])
+        self.assertEqual(self.index.search("riv", category_id="3"), [2])
+
+    def test_writes_replace_the_postings(self):
+        """A write never mutates the postings a running search iterates
+        """
+        postings = self.index._questions["river"]
+        tokens = self.index._tokens
+
+        self.index.on_write("questions", "insert", {
+            "id": 3, "question": "Longest river?", "answer": "Amazon", "category": 3
+        })
+        self.index.on_write("questions", "delete", {"id": 2})
+
+        self.assertEqual(postings, {1: 1, 2: 1})
+        self.assertNotIn("amazon", tokens)
+        self.assertEqual(self.index.search("river"), [1, 3])
+
+
+class SuggestIndexTestCase(unittest.TestCase):
+    """This class represents the suggestion index test case"""
+
+    def setUp(self):
+        self.index = SuggestIndex()
+        for question_id, question in enumerate(
+            ["What river is longest?", "Which river is widest?", "What is a rivet?"],
+            start=1
+        ):
+            self.index.on_write("questions", "insert", {"id": question_id, "question": question})
+        self.index.on_write("categories", "insert", {"id": 4, "type": "History"})
+
+    def test_most_used_words_first(self):
+        """Completions of the last word, by number of questions
+        """
+        words, categories = self.index.suggest("what ri")
+
+        self.assertEqual(words, ["river", "rivet"])
+        self.assertEqual(categories, [])
+        self.assertEqual(self.index.suggest("h")[1], [{"id": 4, "type": "History"}])
+
+    def test_deleted_question_words_are_dropped(self):
+        """A word only used by a deleted question is no longer suggested
+        """
+        self.index.suggest("ri")
+        self.index.on_write("questions", "delete", {"id": 3, "question": "What is a rivet?"})
+
+        self.assertEqual(self.index.suggest("ri")[0], ["river"])
+
+    def test_writes_drop_the_memoised_prefixes_they_change(self):
+        """A write forgets the memoised words of its own prefixes only
+        """
+        self.index.suggest("ri")
+        self.index.suggest("wh")
+
+        self.index.on_write("questions", "insert", {"id": 4, "question": "Rivet or rivet?"})
+        self.index.on_write("questions", "insert", {"id": 5, "question": "Rivet?"})
+
+        self.assertIn(("wh", 10), self.index._top_words)
+        self.assertEqual(self.index.suggest("ri")[0], ["rivet", "river"])
+
+    def test_renamed_category(self):
+        """A renamed category is suggested by its new name only
+        """
+        self.index.on_write("categories", "update", {"id": 4, "type": "Geography"})
+
+        self.assertEqual(self.index.suggest("h")[1], [])
+        self.assertEqual(self.index.suggest("geo")[1], [{"id": 4, "type": "Geography"}])
+
+
+class PickQuestionTestCase(unittest.TestCase):
+    """This class represents the random quiz question selection test case"""
+
+    def test_never_picks_a_previous_question(self):
+        """Random draws and the set difference fallback both skip the
+        previous questions
+        """
+        question_ids = list(range(1, 21))
+
+        for previous in ([], [1, 2, 3], list(range(1, 20))):
+            for _ in range(50):
+                self.assertNotIn(pick_question_id(question_ids, previous), previous)
+
+        self.assertEqual(pick_question_id(question_ids, list(range(1, 20))), 20)
+
+    def test_exhausted_category(self):
+        """No question is left once every one was served, or in an empty
+        category
+        """
+        self.assertIsNone(pick_question_id([1, 2], [2, 1]))
+        self.assertIsNone(pick_question_id([], []))
+
+    def test_batch_picks_distinct_questions(self):
+        """A batch never repeats a question and stops when the category
+        runs out
+        """
+        index = QuestionIndex()
+        for question_id in range(1, 6):
+            index.add(question_id, 1)
+
+        with patch("flaskr.quiz.question_index", index):
+            picked = pick_quiz_question_ids(1, [2], 10)
+
+        self.assertEqual(sorted(picked), [1, 3, 4, 5])
+
+
+class QuizSessionsTestCase(unittest.TestCase):
+    """This class represents the server-side quiz sessions test case"""
+
+    def setUp(self):
+        self.index = QuestionIndex()
+        for question_id in range(1, 11):
+            self.index.add(question_id, 1 + question_id % 2)
+        patcher = patch("flaskr.quiz.question_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sessions = QuizSessions(ttl=60, max_sessions=8)
+
+    def test_every_question_once(self):
+        """A session serves each question of its category once, in a
+        random order
+        """
+        session_id, total = self.sessions.start(2)
+        picks = [self.sessions.next_question_id(session_id) for _ in range(total)]
+
+        self.assertEqual(total, 5)
+        self.assertEqual(sorted(question_id for question_id, _ in picks), [1, 3, 5, 7, 9])
+        self.assertEqual([remaining for _, remaining in picks], [4, 3, 2, 1, 0])
+        self.assertEqual(self.sessions.next_question_id(session_id), (None, 0))
+
+    def test_questions_created_later_are_not_served(self):
+        """The session draws from the ids its category had when it started
+        """
+        session_id, _ = self.sessions.start()
+        self.index.add(11, 1)
+
+        picked = {self.sessions.next_question_id(session_id)[0] for _ in range(11)}
+
+        self.assertEqual(picked, set(range(1, 11)) | {None})
+
+    def test_ended_session_is_unknown(self):
+        """An ended session is gone
+        """
+        session_id, _ = self.sessions.start(1)
+
+        self.assertTrue(self.sessions.end(session_id))
+        with self.assertRaises(KeyError):
+            self.sessions.next_question_id(session_id)
+
+
+class ParseDifficultyTestCase(unittest.TestCase):
+    """This class represents the quiz difficulty parsing test case"""
+
+    def test_difficulty_and_band(self):
+        """A difficulty or a [min, max] band, as ints or strings
+        """
+        self.assertIsNone(parse_difficulty(None))
+        self.assertEqual(parse_difficulty(3), range(3, 4))
+        self.assertEqual(parse_difficulty(["2", 4]), range(2, 5))
+
+    def test_invalid_difficulty_is_a_value_error(self):
+        """Malformed difficulties raise ValueError, the views answer 400
+        """
+        for difficulty in ([1], [1, 2, 3], {"min": 1}, 2.5, [1, 4.9], True, "hard", 9, [4, 2]):
+            with self.assertRaises(ValueError, msg=repr(difficulty)):
+                parse_difficulty(difficulty)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()